@@ -9,14 +9,41 @@
 - 管理员功能（添加/删除电影）
 """
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_from_directory
+from flask import (Flask, render_template, request, redirect, url_for, session, jsonify, g, has_app_context, abort,
+                   make_response)
 import sqlite3
+import json
 import bcrypt
-from datetime import datetime
+from datetime import datetime, timezone
 import os
 import sys
 import uuid
+import time
+import queue
+import threading
+import atexit
+import shutil
+import tempfile
+import functools
 from werkzeug.utils import secure_filename
+import numpy as np
+from file_serving import send_file_ranges
+from upload_store import (store_upload, hash_file, content_filename, upload_filename_from_url,
+                          partial_upload_path, write_chunk, fanout_path, FANOUT_LEVELS, FANOUT_WIDTH,
+                          ingest_receipt_path, INGEST_RECEIPT_SUFFIX)
+from text_search import ngram_tokenize, build_match_query, PrefixSuggestIndex
+from recommender import ItemCFModel, ALSModel, compute_movie_neighbors
+from job_queue import JobWorker, enqueue_job, job_counts
+from password_hashing import PasswordHasher, HashingBusy
+from query_cache import TaggedCache
+from cache_bus import InvalidationBus, publish as publish_invalidation
+from page_cache import PageCache
+from fragment_cache import FragmentCacheExtension
+import media_jobs
+import image_derivatives
+from image_derivatives import pillow_available, DERIVED_DIRNAME
+from mp4_meta import MP4_EXTENSIONS
+from hls_packager import HLS_PLAYLIST_NAME
 
 # 创建Flask应用实例
 app = Flask(__name__)
@@ -24,6 +51,281 @@ app.secret_key = 'movie_recommendation_system_secret_key_2024'
 
 # SQLite数据库配置
 DATABASE = 'movie_system.db'
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))  # 每个进程最多保持的连接数
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # 等待空闲连接的超时时间（秒）
+
+# 查询结果缓存（见query_cache.py）：分类、电影详情等几乎不变的查询在进程内缓存，数据修改时按标签失效
+QUERY_CACHE_SIZE = 1024                                             # 最多缓存的查询结果数
+QUERY_CACHE_TTL = float(os.environ.get('QUERY_CACHE_TTL', 300))     # 有效期（秒），0表示不缓存
+# 未登录用户的首页/分类页/搜索页整页缓存（见page_cache.py），电影、分类、评分变化时失效
+PAGE_CACHE_TTL = float(os.environ.get('PAGE_CACHE_TTL', 60))          # 有效期（秒），0表示不缓存
+PAGE_CACHE_MEMORY = 16 * 1024 * 1024                                  # 内存层大小（字节）
+PAGE_CACHE_DISK = 256 * 1024 * 1024                                   # 磁盘层大小（字节）
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'movie-page-cache')
+PAGE_CACHE_TAGS = ('movies', 'movie-list', 'categories')
+# 电影卡片的模板片段缓存（见fragment_cache.py），键为电影ID+版本号，首页/分类页/搜索页共享
+FRAGMENT_CACHE_SIZE = 4096                                            # 最多缓存的片段数（每部电影2个）
+FRAGMENT_CACHE_TTL = float(os.environ.get('FRAGMENT_CACHE_TTL', 3600))  # 有效期（秒），0表示不缓存
+# 上传文件按内容命名（同名即同内容），浏览器和代理可以长期缓存，不必再验证
+UPLOAD_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CACHE_BUS_POLL_INTERVAL = 1.0  # 多进程部署时每个进程检查其他进程发布的缓存失效记录的间隔（秒），见cache_bus.py
+CACHE_BUS_SKIP_ENDPOINTS = {'static', 'uploaded_file', 'api_suggest'}  # 这些请求不检查缓存失效记录
+
+# SQLite PRAGMA配置方案，按部署环境通过环境变量 DB_PRAGMA_PROFILE 选择
+DB_PRAGMA_PROFILES = {
+    # WAL模式：读写互不阻塞，适合多worker进程部署（默认）
+    'wal': {
+        'busy_timeout': 5000,          # 遇到锁时最多等待5秒，而不是立即报错
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',       # WAL下NORMAL不会损坏数据库，只在断电时可能丢失最后几个事务
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64000,          # 负数表示KB，即每个连接约64MB页缓存
+        'temp_store': 'MEMORY',
+    },
+    # 安全优先：WAL + 每次提交都fsync
+    'safe': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -16000,
+        'temp_store': 'MEMORY',
+    },
+    # 传统回滚日志模式（SQLite默认行为），用于不支持WAL的网络文件系统
+    'legacy': {
+        'busy_timeout': 5000,
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+    },
+}
+DB_PRAGMA_PROFILE = os.environ.get('DB_PRAGMA_PROFILE', 'wal')
+
+# 搜索框自动补全配置
+SUGGEST_DEFAULT_LIMIT = 8
+SUGGEST_MAX_LIMIT = 20
+SUGGEST_INDEX_TTL = 300  # 前缀索引完整重建的间隔（秒），用于刷新评分变化带来的热度变化
+
+# 个性化推荐配置
+RECOMMENDER_NEIGHBORS = 50       # 每部电影保留的相似电影数量
+RECOMMENDER_REFRESH_SECONDS = int(os.environ.get('RECOMMENDER_REFRESH_SECONDS', 600))  # 模型重新训练的间隔
+RECOMMENDATION_LIMIT = 8         # 首页展示的推荐数量
+
+# 矩阵分解（ALS）离线训练参数，训练命令: python manage.py train-als
+ALS_FACTORS = 32
+ALS_REGULARIZATION = 0.1
+ALS_ITERATIONS = 10
+
+# 相似电影配置，刷新命令: python manage.py refresh-neighbors
+MOVIE_NEIGHBORS_STORED = 12       # 每部电影在movie_neighbors表中保存的相似电影数量
+SIMILAR_MOVIES_LIMIT = 6          # 电影详情页展示的相似电影数量
+NEIGHBOR_CONTENT_WEIGHT = 0.4     # 内容相似度（类型/导演/简介）所占权重，其余为共同评分相似度
+
+# 二级索引：(索引名, 表名, 列)，由setup_database幂等创建
+# 新增查询时请运行 python manage.py index-advisor 检查是否出现全表扫描
+DB_INDEXES = [
+    ('idx_movies_created_at', 'movies', 'created_at'),                          # 首页/管理面板按时间倒序
+    ('idx_movie_categories_category_created', 'movie_categories', 'category_id, created_at, movie_id'),  # 分类页按时间倒序（覆盖索引，不需要临时排序）
+    ('idx_movie_categories_movie', 'movie_categories', 'movie_id'),            # 编辑/删除电影时按电影查分类
+    ('idx_ratings_movie_created', 'ratings', 'movie_id, created_at'),           # 电影详情页的评论列表
+    ('idx_ratings_user_created', 'ratings', 'user_id, created_at'),             # 个人中心的评分记录
+    ('idx_users_created_at', 'users', 'created_at'),                            # 用户管理按注册时间排序
+    ('idx_users_role', 'users', 'role'),                                        # 删除用户时统计管理员数量
+    ('idx_movie_neighbors_score', 'movie_neighbors', 'movie_id, score'),       # 详情页的相似电影
+    ('idx_movie_neighbors_neighbor', 'movie_neighbors', 'neighbor_id'),         # 增量刷新/删除电影时反查
+    ('idx_upload_sessions_updated', 'upload_sessions', 'updated_at'),          # 清理过期的分块上传
+    ('idx_jobs_status_run_after', 'jobs', 'status, run_after'),                 # worker领取任务
+    ('idx_jobs_movie_status', 'jobs', 'movie_id, status'),                      # 电影的处理状态
+    ('idx_movies_image_file', 'movies', 'substr(image_url, 10)'),               # 缩略图生成后按海报文件名找电影
+    ('idx_movies_video_file', 'movies', 'substr(video_url, 10)'),               # HLS打包完成后按视频文件名找电影
+    ('idx_movies_image_url', 'movies', 'image_url'),                            # 上传目录迁移/去重时改写海报URL
+    ('idx_movies_video_url', 'movies', 'video_url'),                            # 上传目录迁移/去重时改写视频URL
+    ('idx_poster_variants_filename', 'poster_variants', 'filename'),            # 上传目录迁移时改写缩略图路径
+]
+
+# 全文搜索：FTS5虚拟表保存经过search_ngrams()切分后的文本（见text_search.py），
+# 管理员添加、编辑、删除电影后由on_movie_changed()调用sync_search_index()同步；
+# search_ngrams是Python函数，不用触发器同步，其他工具（如sqlite3命令行）写movies表时不会因为缺少该函数而失败，
+# 绕过应用直接修改电影后执行 python manage.py search-rebuild 重建索引
+SEARCH_INDEX_COLUMNS = ('title', 'director', 'genre', 'description')
+SEARCH_COLUMN_WEIGHTS = (10.0, 5.0, 3.0, 1.0)  # BM25列权重，与SEARCH_INDEX_COLUMNS一一对应
+# 旧版本创建的全文搜索同步触发器，setup_database时删除
+LEGACY_SEARCH_INDEX_TRIGGERS = ('trg_movies_fts_insert', 'trg_movies_fts_update', 'trg_movies_fts_delete')
+
+# 评分聚合触发器：在写入ratings的同一事务内以O(1)维护movies的rating_sum/rating_count/rating，
+# 不再在每次评分时用AVG()重新扫描该电影的全部评分
+# 注意：UPDATE的SET表达式中引用的都是更新前的列值
+# 没有评分的电影rating为0.0（与REBUILD_RATING_AGGREGATES_SQL一致）
+RATING_AGGREGATE_TRIGGERS = {
+    'trg_ratings_aggregate_insert': '''
+        CREATE TRIGGER IF NOT EXISTS trg_ratings_aggregate_insert
+        AFTER INSERT ON ratings
+        BEGIN
+            UPDATE movies SET
+                rating_sum = rating_sum + NEW.rating,
+                rating_count = rating_count + 1,
+                rating = (rating_sum + NEW.rating) * 1.0 / (rating_count + 1)
+            WHERE id = NEW.movie_id;
+        END
+    ''',
+    'trg_ratings_aggregate_update': '''
+        CREATE TRIGGER IF NOT EXISTS trg_ratings_aggregate_update
+        AFTER UPDATE OF rating, movie_id ON ratings
+        BEGIN
+            UPDATE movies SET
+                rating_sum = rating_sum - OLD.rating,
+                rating_count = rating_count - 1,
+                rating = CASE WHEN rating_count > 1
+                              THEN (rating_sum - OLD.rating) * 1.0 / (rating_count - 1)
+                              ELSE 0.0 END
+            WHERE id = OLD.movie_id;
+            UPDATE movies SET
+                rating_sum = rating_sum + NEW.rating,
+                rating_count = rating_count + 1,
+                rating = (rating_sum + NEW.rating) * 1.0 / (rating_count + 1)
+            WHERE id = NEW.movie_id;
+        END
+    ''',
+    'trg_ratings_aggregate_delete': '''
+        CREATE TRIGGER IF NOT EXISTS trg_ratings_aggregate_delete
+        AFTER DELETE ON ratings
+        BEGIN
+            UPDATE movies SET
+                rating_sum = rating_sum - OLD.rating,
+                rating_count = rating_count - 1,
+                rating = CASE WHEN rating_count > 1
+                              THEN (rating_sum - OLD.rating) * 1.0 / (rating_count - 1)
+                              ELSE 0.0 END
+            WHERE id = OLD.movie_id;
+        END
+    ''',
+}
+
+# 相似电影的增量刷新：评分或电影内容变化时把电影ID记入movie_neighbors_dirty，
+# 批处理任务只重新计算这些电影（以及与它们相关的电影）的相似电影列表
+MOVIE_NEIGHBOR_TRIGGERS = {
+    # 不用INSERT OR IGNORE：触发器中的冲突处理会被外层语句（评分的UPSERT）的冲突处理覆盖
+    'trg_ratings_neighbors_insert': '''
+        CREATE TRIGGER IF NOT EXISTS trg_ratings_neighbors_insert
+        AFTER INSERT ON ratings
+        BEGIN
+            INSERT INTO movie_neighbors_dirty (movie_id) SELECT NEW.movie_id
+            WHERE NOT EXISTS (SELECT 1 FROM movie_neighbors_dirty WHERE movie_id = NEW.movie_id);
+        END
+    ''',
+    'trg_ratings_neighbors_update': '''
+        CREATE TRIGGER IF NOT EXISTS trg_ratings_neighbors_update
+        AFTER UPDATE OF rating, movie_id ON ratings
+        BEGIN
+            INSERT INTO movie_neighbors_dirty (movie_id) SELECT OLD.movie_id
+            WHERE NOT EXISTS (SELECT 1 FROM movie_neighbors_dirty WHERE movie_id = OLD.movie_id);
+            INSERT INTO movie_neighbors_dirty (movie_id) SELECT NEW.movie_id
+            WHERE NOT EXISTS (SELECT 1 FROM movie_neighbors_dirty WHERE movie_id = NEW.movie_id);
+        END
+    ''',
+    'trg_ratings_neighbors_delete': '''
+        CREATE TRIGGER IF NOT EXISTS trg_ratings_neighbors_delete
+        AFTER DELETE ON ratings
+        BEGIN
+            INSERT INTO movie_neighbors_dirty (movie_id) SELECT OLD.movie_id
+            WHERE NOT EXISTS (SELECT 1 FROM movie_neighbors_dirty WHERE movie_id = OLD.movie_id);
+        END
+    ''',
+    'trg_movies_neighbors_insert': '''
+        CREATE TRIGGER IF NOT EXISTS trg_movies_neighbors_insert
+        AFTER INSERT ON movies
+        BEGIN
+            INSERT INTO movie_neighbors_dirty (movie_id) SELECT NEW.id
+            WHERE NOT EXISTS (SELECT 1 FROM movie_neighbors_dirty WHERE movie_id = NEW.id);
+        END
+    ''',
+    'trg_movies_neighbors_update': '''
+        CREATE TRIGGER IF NOT EXISTS trg_movies_neighbors_update
+        AFTER UPDATE OF director, genre, description ON movies
+        BEGIN
+            INSERT INTO movie_neighbors_dirty (movie_id) SELECT NEW.id
+            WHERE NOT EXISTS (SELECT 1 FROM movie_neighbors_dirty WHERE movie_id = NEW.id);
+        END
+    ''',
+    # 删除电影时立即清理，详情页不会再显示已删除的电影
+    'trg_movies_neighbors_delete': '''
+        CREATE TRIGGER IF NOT EXISTS trg_movies_neighbors_delete
+        AFTER DELETE ON movies
+        BEGIN
+            DELETE FROM movie_neighbors WHERE movie_id = OLD.id;
+            DELETE FROM movie_neighbors WHERE neighbor_id = OLD.id;
+            INSERT INTO movie_neighbors_dirty (movie_id) SELECT OLD.id
+            WHERE NOT EXISTS (SELECT 1 FROM movie_neighbors_dirty WHERE movie_id = OLD.id);
+        END
+    ''',
+}
+
+# 上传文件引用计数：upload_files.ref_count = 引用该文件的image_url/video_url数量
+# URL形如 /uploads/<文件名>（历史数据为 /uploads\<文件名>），substr(url, 10) 取出文件名；外部链接不会匹配任何文件
+UPLOAD_REF_TRIGGERS = {
+    'trg_movies_upload_refs_insert': '''
+        CREATE TRIGGER IF NOT EXISTS trg_movies_upload_refs_insert
+        AFTER INSERT ON movies
+        BEGIN
+            UPDATE upload_files SET ref_count = ref_count + 1 WHERE filename = substr(NEW.image_url, 10);
+            UPDATE upload_files SET ref_count = ref_count + 1 WHERE filename = substr(NEW.video_url, 10);
+        END
+    ''',
+    'trg_movies_upload_refs_update': '''
+        CREATE TRIGGER IF NOT EXISTS trg_movies_upload_refs_update
+        AFTER UPDATE OF image_url, video_url ON movies
+        BEGIN
+            UPDATE upload_files SET ref_count = ref_count - 1 WHERE filename = substr(OLD.image_url, 10);
+            UPDATE upload_files SET ref_count = ref_count - 1 WHERE filename = substr(OLD.video_url, 10);
+            UPDATE upload_files SET ref_count = ref_count + 1 WHERE filename = substr(NEW.image_url, 10);
+            UPDATE upload_files SET ref_count = ref_count + 1 WHERE filename = substr(NEW.video_url, 10);
+        END
+    ''',
+    'trg_movies_upload_refs_delete': '''
+        CREATE TRIGGER IF NOT EXISTS trg_movies_upload_refs_delete
+        AFTER DELETE ON movies
+        BEGIN
+            UPDATE upload_files SET ref_count = ref_count - 1 WHERE filename = substr(OLD.image_url, 10);
+            UPDATE upload_files SET ref_count = ref_count - 1 WHERE filename = substr(OLD.video_url, 10);
+        END
+    ''',
+}
+
+# 电影版本号：详情页显示的内容变化时version加1、modified_at更新为当前时间，
+# 详情页据此生成ETag/Last-Modified，浏览器再次访问时不用重新渲染（见movie_detail）
+# 评分写入由评分聚合触发器更新rating等字段，同样会触发版本更新；
+# 相似电影列表中显示了本电影的标题和评分，所以把本电影列为相似电影的电影也一起更新
+MOVIE_VERSION_TRIGGERS = {
+    'trg_movies_version_update': '''
+        CREATE TRIGGER IF NOT EXISTS trg_movies_version_update
+        AFTER UPDATE OF title, director, year, genre, description, image_url, video_url, video_type,
+                        rating, rating_sum, rating_count, processing_state ON movies
+        BEGIN
+            UPDATE movies SET version = version + 1, modified_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            UPDATE movies SET version = version + 1, modified_at = CURRENT_TIMESTAMP
+            WHERE id IN (SELECT movie_id FROM movie_neighbors WHERE neighbor_id = NEW.id);
+        END
+    ''',
+}
+BUMP_MOVIE_VERSION_SQL = "UPDATE movies SET version = version + 1, modified_at = CURRENT_TIMESTAMP WHERE id = ?"
+
+# 分类页排序触发器：movie_categories冗余保存电影的created_at，
+# 分类页可以直接按 (category_id, created_at) 索引顺序读取，不再对该分类的全部电影做临时排序
+CATEGORY_ORDER_TRIGGERS = {
+    'trg_movie_categories_created_at': '''
+        CREATE TRIGGER IF NOT EXISTS trg_movie_categories_created_at
+        AFTER INSERT ON movie_categories
+        BEGIN
+            UPDATE movie_categories SET created_at = (SELECT created_at FROM movies WHERE id = NEW.movie_id)
+            WHERE id = NEW.id;
+        END
+    ''',
+    'trg_movies_created_at_update': '''
+        CREATE TRIGGER IF NOT EXISTS trg_movies_created_at_update
+        AFTER UPDATE OF created_at ON movies
+        BEGIN
+            UPDATE movie_categories SET created_at = NEW.created_at WHERE movie_id = NEW.id;
+        END
+    ''',
+}
 
 # 文件上传配置
 UPLOAD_FOLDER = 'uploads'
@@ -31,18 +333,280 @@ ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'webm', 'ogg', 'mov', 'avi'}
 MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB（视频文件较大）
 
+# 分块上传（可断点续传）配置，接口见 /api/uploads
+CHUNKED_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024  # 分块上传的单个文件上限：2GB
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024                # 建议客户端使用的分块大小
+UPLOAD_CHUNK_MAX = 16 * 1024 * 1024                # 单次请求最多接收的字节数
+UPLOAD_SESSION_TTL = 24 * 3600                     # 超过该时间没有新数据的上传会话会被清理（秒）
+
+# 后台任务worker配置，生产环境运行: python manage.py worker
+JOB_WORKER_PROCESSES = int(os.environ.get('JOB_WORKER_PROCESSES', 2))  # 执行任务的进程数
+JOB_POLL_INTERVAL = 1.0                                                 # 没有任务时的轮询间隔（秒）
+
+# 上传目录垃圾回收配置（worker空闲时定期执行，也可以运行 python manage.py uploads-gc）
+UPLOAD_GC_INTERVAL = 3600              # 两次回收之间的间隔（秒）
+UPLOAD_GC_GRACE = 24 * 3600            # 文件修改后至少经过这么久才会被回收，避免删掉刚上传、电影还没保存的文件
+UPLOAD_GC_QUARANTINE = True            # True时先移入隔离目录，超过UPLOAD_GC_QUARANTINE_TTL后再删除
+UPLOAD_GC_QUARANTINE_TTL = 7 * 24 * 3600
+UPLOAD_GC_BATCH = 200                  # 每处理这么多个文件暂停一次，降低对磁盘和数据库的压力
+UPLOAD_GC_PAUSE = 0.2                  # 暂停的秒数
+UPLOAD_QUARANTINE_DIRNAME = '.quarantine'
+UPLOAD_MIGRATE_BATCH = 500             # 迁移到分散目录时每个事务改写的文件数
+
+# HLS打包（不转码，见hls_packager.py）：开启后上传的MP4视频在解析完成后自动切分为HLS分片
+HLS_PACKAGING = os.environ.get('HLS_PACKAGING') == '1'
+HLS_DIRNAME = 'hls'                    # 分片在上传目录中的子目录：hls/ab/cd/<文件名>/index.m3u8
+
+# 密码哈希进程池（见password_hashing.py）：bcrypt不在请求线程中计算，登录高峰不会拖慢其他页面
+PASSWORD_HASH_PROCESSES = int(os.environ.get('PASSWORD_HASH_PROCESSES', 2))  # 0表示在请求线程中直接计算
+PASSWORD_HASH_MAX_PENDING = 16         # 排队+执行中的哈希数上限，超过时返回503
+PASSWORD_HASH_TIMEOUT = 5.0            # 等待哈希结果的最长时间（秒）
+PASSWORD_HASH_RETRY_AFTER = 2          # 拒绝时Retry-After响应头的秒数
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+# 由Apache(mod_xsendfile)/lighttpd等前端服务器直接发送上传文件（包括Range请求），Python进程只返回X-Sendfile头
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+
+# 应用PRAGMA配置
+def apply_pragma_profile(conn, profile=None):
+    """
+    在连接上应用PRAGMA配置方案
+
+    Args:
+        conn: 数据库连接
+        profile: 配置方案名称，默认使用DB_PRAGMA_PROFILE
+
+    Returns:
+        {pragma名称: (期望值, 实际生效值)}
+    """
+    profile = profile or DB_PRAGMA_PROFILE
+    if profile not in DB_PRAGMA_PROFILES:
+        raise ValueError(f"未知的PRAGMA配置方案: {profile}（可选: {', '.join(DB_PRAGMA_PROFILES)}）")
+    
+    results = {}
+    for name, value in DB_PRAGMA_PROFILES[profile].items():
+        conn.execute(f"PRAGMA {name} = {value}")
+        # 重新读取，确认设置是否真正生效（例如mmap_size可能被编译选项限制）
+        row = conn.execute(f"PRAGMA {name}").fetchone()
+        results[name] = (value, row[0] if row else None)
+    return results
+
+# 初始化新连接
+def configure_connection(conn):
+    """
+    新连接创建后执行的初始化：应用PRAGMA配置，注册全文搜索索引用到的SQL函数
+
+    Returns:
+        PRAGMA配置结果，见apply_pragma_profile
+    """
+    conn.create_function('search_ngrams', 1, ngram_tokenize, deterministic=True)
+    return apply_pragma_profile(conn)
+
+# 数据库连接池
+class SQLiteConnectionPool:
+    """
+    SQLite连接池：复用已打开的连接，避免每次查询都重新建立连接
+
+    - 空闲连接按后进先出复用，最近使用过的连接页缓存更"热"
+    - 取出连接时做健康检查，失效连接会被丢弃并重新创建
+    - 连接数达到上限时等待归还，超时则抛出异常
+    - 进程fork后自动丢弃父进程的连接（多worker部署）
+    """
+
+    def __init__(self, database, max_size=5, timeout=10.0, initializer=None):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.initializer = initializer  # 新连接创建后调用，用于设置PRAGMA等
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """重置连接池状态（初始化或fork后调用）"""
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        """fork之后父进程的连接不能在子进程中使用，丢弃它们"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def _create_connection(self):
+        """创建新连接，设置行工厂为sqlite3.Row"""
+        conn = sqlite3.connect(self.database, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # 使结果可以通过列名访问
+        if self.initializer:
+            self.initializer(conn)
+        return conn
+
+    def _is_healthy(self, conn):
+        """健康检查：执行一条最简单的查询"""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        """从连接池获取一个连接"""
+        self._check_pid()
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                with self._lock:
+                    if self._created < self.max_size:
+                        self._created += 1
+                        create = True
+                    else:
+                        create = False
+                if create:
+                    try:
+                        return self._create_connection()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise RuntimeError(f"等待数据库连接超时（连接池大小: {self.max_size}）")
+            
+            if self._is_healthy(conn):
+                return conn
+            # 失效连接：关闭并重新获取
+            self._discard(conn)
+
+    def release(self, conn):
+        """归还连接到连接池，未提交的事务会被回滚"""
+        if self._pid != os.getpid():
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        """关闭连接并释放其占用的名额"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        """连接池状态，便于监控"""
+        return {
+            'max_size': self.max_size,
+            'created': self._created,
+            'idle': self._idle.qsize(),
+        }
+
+db_pool = SQLiteConnectionPool(DATABASE, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                               initializer=configure_connection)
+# 进程退出时关闭连接，WAL模式下最后一个连接关闭会做checkpoint并清理-wal文件
+atexit.register(lambda: db_pool.close_all())
+
+password_hasher = PasswordHasher(PASSWORD_HASH_PROCESSES, max_pending=PASSWORD_HASH_MAX_PENDING,
+                                 timeout=PASSWORD_HASH_TIMEOUT)
+atexit.register(lambda: password_hasher.shutdown())
+
+query_cache = TaggedCache(QUERY_CACHE_SIZE, default_ttl=QUERY_CACHE_TTL)
+# 跨进程的缓存失效通知：进程内的缓存都订阅它
+cache_bus = InvalidationBus(CACHE_BUS_POLL_INTERVAL)
+cache_bus.subscribe(query_cache)
+
+page_cache = PageCache(PAGE_CACHE_MEMORY, disk_dir=PAGE_CACHE_DIR, disk_bytes=PAGE_CACHE_DISK, ttl=PAGE_CACHE_TTL)
+cache_bus.subscribe(page_cache)
+# 模板片段缓存：{% cache %} 标签
+fragment_cache = TaggedCache(FRAGMENT_CACHE_SIZE, default_ttl=FRAGMENT_CACHE_TTL)
+cache_bus.subscribe(fragment_cache)
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = fragment_cache
+atexit.register(lambda: page_cache.clear())
+
+# 切换数据库文件
+def set_database(path):
+    """让应用改用另一个数据库文件（测试和维护命令使用），原连接池中的空闲连接会被关闭"""
+    global DATABASE, db_pool
+    db_pool.close_all()
+    DATABASE = path
+    db_pool = SQLiteConnectionPool(path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                                   initializer=configure_connection)
+    # 内存中的派生数据来自原数据库，下次使用时重新加载
+    query_cache.clear()
+    page_cache.clear()
+    fragment_cache.clear()
+    cache_bus.reset()
+    derived_data.clear()
 
 # 获取数据库连接
 def get_db_connection():
-    """获取数据库连接，设置行工厂为sqlite3.Row"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # 使结果可以通过列名访问
-    return conn
+    """
+    获取数据库连接
+
+    在请求（应用上下文）中，同一个请求内的所有查询复用同一个连接，
+    请求结束时由teardown_appcontext归还到连接池；
+    在请求之外（脚本、测试）直接从连接池借出，用完需调用release_db_connection
+    """
+    if has_app_context():
+        if 'db_conn' not in g:
+            g.db_conn = db_pool.acquire()
+        return g.db_conn
+    return db_pool.acquire()
+
+# 归还数据库连接
+def release_db_connection(conn):
+    """归还get_db_connection获取的连接（请求内的连接留到请求结束再归还）"""
+    if has_app_context() and g.get('db_conn') is conn:
+        return
+    db_pool.release(conn)
+
+# 请求开始时读取其他进程发布的缓存失效记录
+@app.before_request
+def poll_cache_invalidations():
+    """
+    每隔CACHE_BUS_POLL_INTERVAL秒检查一次cache_invalidations表，使本进程中过期的缓存失效
+
+    只有到了检查时间才从连接池取连接；上传文件、静态文件和自动补全不读取这些缓存，不做检查
+    """
+    if request.endpoint in CACHE_BUS_SKIP_ENDPOINTS:
+        return
+    try:
+        cache_bus.poll(get_db_connection)
+    except (sqlite3.Error, RuntimeError) as e:
+        # 连接池耗尽时跳过本次检查，不影响请求本身
+        print(f"读取缓存失效记录失败: {e}")
+
+# 请求结束时归还连接
+@app.teardown_appcontext
+def teardown_db_connection(exception):
+    """应用上下文结束时把本请求使用的连接归还到连接池"""
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        db_pool.release(conn)
 
 # 数据库操作辅助函数
-def execute_db_query(query, params=None, fetch_one=False, fetch_all=False, commit=False):
+def execute_db_query(query, params=None, fetch_one=False, fetch_all=False, commit=False,
+                     cache_tags=None, cache_ttl=None, invalidate_tags=None):
     """
     执行数据库查询的通用函数
     
@@ -52,10 +616,22 @@ def execute_db_query(query, params=None, fetch_one=False, fetch_all=False, commi
         fetch_one: 是否获取单条记录
         fetch_all: 是否获取所有记录
         commit: 是否提交事务
+        cache_tags: 查询结果缓存的失效标签（如 ['categories']），为空时不缓存；
+                    缓存以SQL和参数为键，修改数据后调用invalidate_cache(标签)
+        cache_ttl: 缓存有效期（秒），默认QUERY_CACHE_TTL
+        invalidate_tags: commit为True时要失效的缓存标签，失效记录与本次修改在同一事务中提交
     
     Returns:
-        查询结果或操作状态
+        查询结果或操作状态（缓存的结果每次返回副本，调用方可以修改）
     """
+    cache_key = None
+    if cache_tags and not commit and (fetch_one or fetch_all):
+        cache_key = (query, tuple(params or ()), bool(fetch_one))
+        cached = query_cache.get(cache_key, _CACHE_MISS)
+        if cached is not _CACHE_MISS:
+            return _copy_result(cached)
+        generation = query_cache.generation
+    
     conn = None
     try:
         conn = get_db_connection()
@@ -67,14 +643,20 @@ def execute_db_query(query, params=None, fetch_one=False, fetch_all=False, commi
             cursor.execute(query)
         
         if commit:
+            if invalidate_tags:
+                invalidate_cache(*invalidate_tags, conn=conn)
             conn.commit()
         
         if fetch_one:
             result = cursor.fetchone()
-            return dict(result) if result else None
+            result = dict(result) if result else None
         elif fetch_all:
-            results = cursor.fetchall()
-            return [dict(row) for row in results]
+            result = [dict(row) for row in cursor.fetchall()]
+        if fetch_one or fetch_all:
+            if cache_key:
+                query_cache.set(cache_key, _copy_result(result), ttl=cache_ttl, tags=cache_tags,
+                                generation=generation)
+            return result
         
         return cursor.lastrowid if cursor.lastrowid else True
     except Exception as e:
@@ -86,7 +668,59 @@ def execute_db_query(query, params=None, fetch_one=False, fetch_all=False, commi
         return None
     finally:
         if conn:
-            conn.close()
+            release_db_connection(conn)
+
+_CACHE_MISS = object()
+
+def _copy_result(result):
+    """复制查询结果（dict或dict列表），缓存中的对象不会被调用方修改"""
+    if isinstance(result, list):
+        return [dict(row) for row in result]
+    return dict(result) if result else result
+
+# 使查询结果缓存失效
+def invalidate_cache(*tags, conn=None):
+    """
+    删除带有任一标签的缓存结果，修改数据后调用（标签见get_categories/get_movie）
+    
+    本进程立即失效，同时写入cache_invalidations表通知其他进程（见cache_bus.py）
+    
+    Args:
+        conn: 在调用方的事务中发布（随业务数据一起提交）；默认单独提交
+    """
+    cache_bus.invalidate_local(*tags)
+    try:
+        if conn is not None:
+            publish_invalidation(conn, tags)
+            return
+        conn = get_db_connection()
+        try:
+            with conn:
+                publish_invalidation(conn, tags)
+        finally:
+            release_db_connection(conn)
+    except sqlite3.Error as e:
+        # 其他进程的缓存最迟在有效期后更新
+        print(f"发布缓存失效记录失败: {e}")
+
+def movie_cache_tags(movie_id):
+    """电影数据变化时要失效的标签：这部电影的缓存查询，以及列出电影的页面"""
+    return (f'movie:{movie_id}', 'movie-list')
+
+# 常用的缓存查询
+def get_categories():
+    """所有分类（缓存，标签 categories）"""
+    return execute_db_query("SELECT * FROM categories", fetch_all=True, cache_tags=('categories',))
+
+def get_category(category_id):
+    """单个分类（缓存，标签 categories）"""
+    return execute_db_query("SELECT * FROM categories WHERE id = ?", (category_id,), fetch_one=True,
+                            cache_tags=('categories',))
+
+def get_movie(movie_id):
+    """单部电影（缓存，标签 movies 和 movie:<id>；评分变化、编辑、后台任务都会使其失效）"""
+    return execute_db_query("SELECT * FROM movies WHERE id = ?", (movie_id,), fetch_one=True,
+                            cache_tags=('movies', f'movie:{movie_id}'))
 
 # 检查用户是否登录的辅助函数
 def check_login():
@@ -100,6 +734,12 @@ def check_admin():
         return False
     return session.get('role') == 'admin'
 
+# 密码哈希进程池繁忙时的响应
+def busy_response(template, **context):
+    """重新显示表单并返回503，Retry-After提示客户端稍后重试"""
+    html = render_template(template, error='当前登录请求较多，请稍后再试', **context)
+    return html, 503, {'Retry-After': str(PASSWORD_HASH_RETRY_AFTER)}
+
 # 检查图片文件扩展名是否允许
 def allowed_image_file(filename):
     """检查图片文件扩展名是否在允许的范围内"""
@@ -112,6 +752,47 @@ def allowed_video_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_VIDEO_EXTENSIONS
 
+# 保存上传文件
+def save_upload(file):
+    """
+    把上传的文件写入内容寻址存储（见upload_store.py）并登记到upload_files表
+    
+    Args:
+        file: 上传的文件对象
+    
+    Returns:
+        相对路径（uploads/哈希值.扩展名），用于拼接成URL存储在数据库中
+    """
+    extension = file.filename.rsplit('.', 1)[1].lower()
+    filename, digest, size, duplicate = store_upload(file.stream, extension, app.config['UPLOAD_FOLDER'])
+    execute_db_query(
+        "INSERT INTO upload_files (filename, sha256, size) VALUES (?, ?, ?) ON CONFLICT(filename) DO NOTHING",
+        (filename, digest, size),
+        commit=True
+    )
+    if duplicate:
+        print(f"上传文件与已有文件内容相同，直接复用: {filename}")
+    return f'uploads/{filename}'
+
+# 使用分块上传完成的文件
+def claim_chunked_upload(upload_id):
+    """
+    校验表单中由分块上传接口返回的上传ID
+    
+    Returns:
+        已完成且尚未被其他电影使用的上传会话；否则返回None
+    """
+    if not upload_id:
+        return None
+    upload = execute_db_query(
+        "SELECT * FROM upload_sessions WHERE id = ? AND completed_at IS NOT NULL AND movie_id IS NULL",
+        (upload_id,),
+        fetch_one=True
+    )
+    if not upload or upload['extension'] not in ALLOWED_VIDEO_EXTENSIONS:
+        return None
+    return upload
+
 # 处理图片文件上传
 def handle_image_upload(file):
     """
@@ -124,17 +805,7 @@ def handle_image_upload(file):
         保存的文件路径或None
     """
     if file and file.filename and allowed_image_file(file.filename):
-        # 生成唯一文件名，避免文件名冲突
-        filename = str(uuid.uuid4()) + '.' + file.filename.rsplit('.', 1)[1].lower()
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # 确保上传目录存在
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        
-        # 保存文件
-        file.save(file_path)
-        # 返回相对路径，用于存储在数据库中
-        return file_path
+        return save_upload(file)
     return None
 
 # 处理视频文件上传
@@ -149,17 +820,7 @@ def handle_video_upload(file):
         保存的文件路径或None
     """
     if file and file.filename and allowed_video_file(file.filename):
-        # 生成唯一文件名，避免文件名冲突
-        filename = str(uuid.uuid4()) + '.' + file.filename.rsplit('.', 1)[1].lower()
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        # 确保上传目录存在
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        
-        # 保存文件
-        file.save(file_path)
-        # 返回相对路径，用于存储在数据库中
-        return file_path
+        return save_upload(file)
     return None
 
 # 创建数据库和表
@@ -170,6 +831,8 @@ def setup_database():
         
         # 连接到SQLite数据库
         conn = sqlite3.connect(DATABASE)
+        # journal_mode=WAL会持久化到数据库文件中，初始化时先设置一次
+        pragma_results = configure_connection(conn)
         cursor = conn.cursor()
         
         # 创建用户表
@@ -197,6 +860,11 @@ def setup_database():
                 video_url VARCHAR(500),  -- 视频URL字段
                 video_type VARCHAR(20) DEFAULT 'external',  -- 视频类型：external(外部链接) / upload(本地上传)
                 rating FLOAT DEFAULT 0.0,
+                rating_sum INTEGER DEFAULT 0,  -- 评分总和，由触发器维护
+                rating_count INTEGER DEFAULT 0,  -- 评分人数，由触发器维护
+                processing_state VARCHAR(20) DEFAULT 'ready',  -- 上传文件的后台处理状态：processing / ready / failed
+                version INTEGER NOT NULL DEFAULT 1,  -- 详情页内容的版本号，由触发器维护
+                modified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  -- 详情页内容的最后修改时间
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
@@ -215,6 +883,7 @@ def setup_database():
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 movie_id INTEGER,
                 category_id INTEGER,
+                created_at TIMESTAMP,  -- 电影的创建时间（由触发器维护，分类页排序用）
                 FOREIGN KEY (movie_id) REFERENCES movies (id),
                 FOREIGN KEY (category_id) REFERENCES categories (id)
             )
@@ -235,6 +904,127 @@ def setup_database():
             )
         ''')
         
+        # 创建相似电影表（由批处理任务refresh_movie_neighbors写入）及待刷新电影表
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'movie_neighbors'")
+        neighbor_table_exists = cursor.fetchone()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS movie_neighbors (
+                movie_id INTEGER NOT NULL,
+                neighbor_id INTEGER NOT NULL,
+                score FLOAT NOT NULL,
+                PRIMARY KEY (movie_id, neighbor_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS movie_neighbors_dirty (
+                movie_id INTEGER PRIMARY KEY
+            )
+        ''')
+        if not neighbor_table_exists:
+            # 新建的相似电影表：所有已有电影都需要计算一次
+            cursor.execute("INSERT OR IGNORE INTO movie_neighbors_dirty (movie_id) SELECT id FROM movies /* advisor: full-scan */")
+        
+        # 创建上传文件表：内容寻址存储中的文件及其引用计数
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_files (
+                filename VARCHAR(100) PRIMARY KEY,  -- 哈希值.扩展名
+                sha256 CHAR(64) NOT NULL,
+                size INTEGER NOT NULL,
+                ref_count INTEGER DEFAULT 0,  -- 引用该文件的电影字段数，由触发器维护
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 创建海报缩略图表（文件在上传目录的derived/子目录中，见image_derivatives.py）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS poster_variants (
+                source VARCHAR(100) NOT NULL,  -- 原图在上传目录中的文件名
+                format VARCHAR(10) NOT NULL,   -- avif / webp
+                width INTEGER NOT NULL,
+                filename VARCHAR(120) NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (source, format, width)
+            )
+        ''')
+        
+        # 创建缓存失效记录表（跨进程的缓存失效通知，见cache_bus.py）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cache_invalidations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,  -- 订阅端按id读取新记录
+                tag VARCHAR(100) NOT NULL,
+                created_at FLOAT NOT NULL              -- time.time()，超过保留时间后删除
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_invalidations_created ON cache_invalidations(created_at)")
+        
+        # 创建HLS打包结果表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS hls_streams (
+                source VARCHAR(100) PRIMARY KEY,  -- 原视频在上传目录中的相对路径
+                playlist VARCHAR(150) NOT NULL,   -- 播放列表在上传目录中的相对路径
+                segments INTEGER NOT NULL,
+                duration FLOAT,
+                size INTEGER NOT NULL,            -- 所有分片的总字节数
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 创建上传视频的元数据表（由后台任务解析MP4得到，见mp4_meta.py）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS video_info (
+                filename VARCHAR(100) PRIMARY KEY,  -- 上传目录中的文件名
+                duration FLOAT,                     -- 时长（秒）
+                width INTEGER,
+                height INTEGER,
+                video_codec VARCHAR(50),            -- RFC 6381编码字符串，如 avc1.640028
+                audio_codec VARCHAR(50),            -- 如 mp4a.40.2
+                faststart INTEGER DEFAULT 0         -- moov是否在mdat之前
+            )
+        ''')
+        
+        # 创建分块上传会话表：received为已经写入临时文件的字节数
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                id CHAR(32) PRIMARY KEY,
+                filename VARCHAR(255) NOT NULL,  -- 客户端的原始文件名
+                extension VARCHAR(10) NOT NULL,
+                size INTEGER NOT NULL,
+                received INTEGER DEFAULT 0,
+                user_id INTEGER,
+                movie_id INTEGER,  -- 提交电影表单后关联的电影
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                completed_at TIMESTAMP  -- 调用finalize的时间
+            )
+        ''')
+        for column, column_type in (('movie_id', 'INTEGER'), ('completed_at', 'TIMESTAMP')):
+            try:
+                cursor.execute(f"ALTER TABLE upload_sessions ADD COLUMN {column} {column_type}")
+                print(f"已添加upload_sessions.{column}字段")
+            except sqlite3.OperationalError:
+                pass
+        
+        # 创建后台任务表（见job_queue.py）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind VARCHAR(50) NOT NULL,
+                payload TEXT NOT NULL,  -- JSON
+                movie_id INTEGER,
+                status VARCHAR(20) DEFAULT 'queued',  -- queued / running / done / failed
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER DEFAULT 3,
+                worker VARCHAR(100),
+                result TEXT,
+                error TEXT,
+                run_after TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                lease_until TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+        
         # 检查并添加视频相关字段（如果表已存在）
         try:
             cursor.execute("ALTER TABLE movies ADD COLUMN video_url VARCHAR(500)")
@@ -248,8 +1038,92 @@ def setup_database():
         except sqlite3.OperationalError:
             print("video_type字段已存在")
         
+        try:
+            cursor.execute("ALTER TABLE movies ADD COLUMN processing_state VARCHAR(20) DEFAULT 'ready'")
+            print("已添加processing_state字段")
+        except sqlite3.OperationalError:
+            print("processing_state字段已存在")
+        
+        # 检查并添加评分聚合字段（如果表已存在）
+        rating_columns_added = False
+        for column in ('rating_sum', 'rating_count'):
+            try:
+                cursor.execute(f"ALTER TABLE movies ADD COLUMN {column} INTEGER DEFAULT 0")
+                rating_columns_added = True
+                print(f"已添加{column}字段")
+            except sqlite3.OperationalError:
+                print(f"{column}字段已存在")
+        
+        # 检查并添加版本字段（如果表已存在）
+        try:
+            cursor.execute("ALTER TABLE movies ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            print("已添加version字段")
+        except sqlite3.OperationalError:
+            print("version字段已存在")
+        
+        try:
+            # ALTER TABLE不能使用CURRENT_TIMESTAMP作为默认值，已有电影用创建时间回填
+            cursor.execute("ALTER TABLE movies ADD COLUMN modified_at TIMESTAMP")
+            cursor.execute("UPDATE movies SET modified_at = created_at /* advisor: full-scan */")
+            print("已添加modified_at字段")
+        except sqlite3.OperationalError:
+            print("modified_at字段已存在")
+        
+        try:
+            cursor.execute("ALTER TABLE movie_categories ADD COLUMN created_at TIMESTAMP")
+            cursor.execute('''UPDATE movie_categories
+                              SET created_at = (SELECT created_at FROM movies WHERE id = movie_categories.movie_id)
+                              /* advisor: full-scan */''')
+            print("已添加movie_categories.created_at字段")
+        except sqlite3.OperationalError:
+            print("movie_categories.created_at字段已存在")
+        
+        # 创建评分聚合触发器
+        for trigger_sql in RATING_AGGREGATE_TRIGGERS.values():
+            cursor.execute(trigger_sql)
+        
+        # 创建全文搜索索引及同步触发器
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'movies_fts'")
+        search_index_exists = cursor.fetchone()
+        if not search_index_exists:
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE movies_fts
+                USING fts5({', '.join(SEARCH_INDEX_COLUMNS)}, tokenize = 'unicode61')
+            """)
+            # 新建的搜索索引：先把已有电影写入索引，之后由应用在修改电影时同步
+            cursor.execute(REBUILD_SEARCH_INDEX_SQL)
+            print("已创建全文搜索索引")
+        for trigger_name in LEGACY_SEARCH_INDEX_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+        print("全文搜索索引由应用同步，直接修改movies表后请执行 python manage.py search-rebuild")
+        
+        # 创建相似电影增量刷新触发器
+        for trigger_sql in MOVIE_NEIGHBOR_TRIGGERS.values():
+            cursor.execute(trigger_sql)
+        
+        # 创建上传文件引用计数触发器
+        for trigger_sql in UPLOAD_REF_TRIGGERS.values():
+            cursor.execute(trigger_sql)
+        
+        # 创建电影版本号触发器
+        for trigger_sql in MOVIE_VERSION_TRIGGERS.values():
+            cursor.execute(trigger_sql)
+        
+        # 创建分类页排序触发器
+        for trigger_sql in CATEGORY_ORDER_TRIGGERS.values():
+            cursor.execute(trigger_sql)
+        
+        if rating_columns_added:
+            # 新增字段后根据现有评分回填聚合值
+            cursor.execute(REBUILD_RATING_AGGREGATES_SQL)
+            print("已根据评分表回填评分聚合字段")
+        
+        # 创建二级索引（IF NOT EXISTS保证可以重复执行）
+        for index_name, table, columns in DB_INDEXES:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+        
         # 检查是否有用户数据
-        cursor.execute("SELECT * FROM users")
+        cursor.execute("SELECT 1 FROM users LIMIT 1")
         users_exist = cursor.fetchone()
         if not users_exist:
             # 添加默认管理员账号
@@ -261,7 +1135,7 @@ def setup_database():
             print("已创建管理员账号")
         
         # 检查是否有分类数据
-        cursor.execute("SELECT * FROM categories")
+        cursor.execute("SELECT 1 FROM categories LIMIT 1")
         categories_exist = cursor.fetchone()
         if not categories_exist:
             # 添加默认电影分类
@@ -274,7 +1148,7 @@ def setup_database():
             print("已添加电影分类")
         
         # 检查是否有电影数据
-        cursor.execute("SELECT * FROM movies")
+        cursor.execute("SELECT 1 FROM movies LIMIT 1")
         movies_exist = cursor.fetchone()
         if not movies_exist:
             # 添加示例电影数据 - 包含视频URL
@@ -291,38 +1165,1157 @@ def setup_database():
                     "INSERT INTO movies (title, director, year, genre, description, image_url, video_url, rating) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
                     movie
                 )
-                
-                # 获取刚插入的电影ID
-                movie_id = cursor.lastrowid
-                
-                # 为电影分配分类（简单地将电影类型映射到分类）
-                genre_to_category = {
-                    '科幻/悬疑': 4,  # 科幻片
-                    '剧情': 6,       # 剧情片
-                    '爱情/灾难': 3,  # 爱情片
-                    '科幻/动作': 4,  # 科幻片
-                }
-                
-                if movie[3] in genre_to_category:
-                    cursor.execute(
-                        "INSERT INTO movie_categories (movie_id, category_id) VALUES (?, ?)",
-                        (movie_id, genre_to_category[movie[3]])
-                    )
-            print("已添加示例电影数据")
-        
-        # 提交所有更改
-        conn.commit()
-        conn.close()
-        print("数据库初始化完成！")
-        print("管理员账号: admin")
-        print("管理员密码: admin123")
-        print(f"数据库文件已创建: {os.path.abspath(DATABASE)}")
-        return True
+                
+                # 获取刚插入的电影ID
+                movie_id = cursor.lastrowid
+                cursor.execute("DELETE FROM movies_fts WHERE rowid = ?", (movie_id,))
+                cursor.execute(SYNC_SEARCH_INDEX_SQL, (movie_id,))
+                
+                # 为电影分配分类（简单地将电影类型映射到分类）
+                genre_to_category = {
+                    '科幻/悬疑': 4,  # 科幻片
+                    '剧情': 6,       # 剧情片
+                    '爱情/灾难': 3,  # 爱情片
+                    '科幻/动作': 4,  # 科幻片
+                }
+                
+                if movie[3] in genre_to_category:
+                    cursor.execute(
+                        "INSERT INTO movie_categories (movie_id, category_id) VALUES (?, ?)",
+                        (movie_id, genre_to_category[movie[3]])
+                    )
+            print("已添加示例电影数据")
+        
+        # 提交所有更改
+        conn.commit()
+        # 更新查询优化器使用的统计信息
+        cursor.execute("PRAGMA optimize")
+        conn.close()
+        print("数据库初始化完成！")
+        print("管理员账号: admin")
+        print("管理员密码: admin123")
+        print(f"数据库文件已创建: {os.path.abspath(DATABASE)}")
+        report_pragma_settings(pragma_results)
+        return True
+    except Exception as e:
+        print(f"数据库初始化失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+# 根据评分表重新计算聚合字段（没有评分的电影rating为0.0，与评分聚合触发器一致）
+REBUILD_RATING_AGGREGATES_SQL = '''
+    UPDATE movies SET
+        rating_sum = COALESCE((SELECT SUM(rating) FROM ratings WHERE movie_id = movies.id), 0),
+        rating_count = (SELECT COUNT(*) FROM ratings WHERE movie_id = movies.id),
+        rating = COALESCE((SELECT AVG(rating) FROM ratings WHERE movie_id = movies.id), 0.0)
+    /* advisor: full-scan */
+'''
+
+# 根据movies表重新计算上传文件的引用计数
+REBUILD_UPLOAD_REFS_SQL = (
+    "UPDATE upload_files SET ref_count = 0 /* advisor: full-scan */",
+    '''UPDATE upload_files SET ref_count = refs.count
+       FROM (SELECT filename, COUNT(*) AS count FROM (
+                 SELECT substr(image_url, 10) AS filename FROM movies
+                 UNION ALL
+                 SELECT substr(video_url, 10) FROM movies
+             ) GROUP BY filename) AS refs
+       WHERE upload_files.filename = refs.filename /* advisor: full-scan */''',
+)
+
+# 用movies表重建全文搜索索引
+REBUILD_SEARCH_INDEX_SQL = '''
+    INSERT INTO movies_fts (rowid, title, director, genre, description)
+    SELECT id, search_ngrams(title), search_ngrams(director),
+           search_ngrams(genre), search_ngrams(description)
+    FROM movies
+    /* advisor: full-scan */
+'''
+# 把一部电影写入全文搜索索引
+SYNC_SEARCH_INDEX_SQL = '''
+    INSERT INTO movies_fts (rowid, title, director, genre, description)
+    SELECT id, search_ngrams(title), search_ngrams(director),
+           search_ngrams(genre), search_ngrams(description)
+    FROM movies WHERE id = ?
+'''
+
+# 同步一部电影的全文搜索索引
+def sync_search_index(movie_id):
+    """删除电影在索引中的旧内容，电影仍然存在时重新写入"""
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.execute("DELETE FROM movies_fts WHERE rowid = ?", (movie_id,))
+            conn.execute(SYNC_SEARCH_INDEX_SQL, (movie_id,))
+    finally:
+        release_db_connection(conn)
+
+# 重建全文搜索索引
+def rebuild_search_index():
+    """清空并重新生成全文搜索索引（修改分词规则后需要执行）"""
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.execute("DELETE FROM movies_fts /* advisor: full-scan */")
+            conn.execute(REBUILD_SEARCH_INDEX_SQL)
+        return conn.execute("SELECT COUNT(*) FROM movies_fts /* advisor: full-scan */").fetchone()[0]
+    finally:
+        release_db_connection(conn)
+
+# 重新计算上传文件的引用计数
+def rebuild_upload_refs():
+    """根据movies表的image_url/video_url重新计算upload_files.ref_count"""
+    conn = get_db_connection()
+    try:
+        with conn:
+            for sql in REBUILD_UPLOAD_REFS_SQL:
+                conn.execute(sql)
+    finally:
+        release_db_connection(conn)
+
+# 把旧的上传文件迁移到内容寻址存储
+def deduplicate_uploads():
+    """
+    扫描上传目录，把以UUID命名的旧文件按SHA-256改名，合并内容相同的文件，并改写movies表中的URL
+
+    每个文件按 建立新文件名（硬链接，不支持时复制）-> 提交URL改写 -> 删除旧文件 的顺序处理，
+    中途中断也不会留下指向不存在文件的URL，重新执行即可继续
+
+    Returns:
+        {'files': 改名的文件数, 'duplicates': 合并掉的重复文件数, 'reclaimed_bytes': 释放的字节数}
+    """
+    folder = app.config['UPLOAD_FOLDER']
+    stats = {'files': 0, 'duplicates': 0, 'reclaimed_bytes': 0}
+    if not os.path.isdir(folder):
+        return stats
+    with os.scandir(folder) as entries:
+        names = sorted(entry.name for entry in entries if entry.is_file() and not entry.name.startswith('.'))
+    
+    for name in names:
+        stem, _, extension = name.rpartition('.')
+        if not stem:
+            continue
+        path = os.path.join(folder, name)
+        digest, size = hash_file(path)
+        target = content_filename(digest, extension)
+        if target != name:
+            target_path = os.path.join(folder, target)
+            duplicate = os.path.exists(target_path)
+            if not duplicate:
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                try:
+                    os.link(path, target_path)
+                except OSError:
+                    shutil.copy2(path, target_path)
+        
+        conn = get_db_connection()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO upload_files (filename, sha256, size) VALUES (?, ?, ?) ON CONFLICT(filename) DO NOTHING",
+                    (target, digest, size)
+                )
+                if target != name:
+                    for column in ('image_url', 'video_url'):
+                        conn.execute(
+                            f"UPDATE movies SET {column} = ? WHERE {column} IN (?, ?)",
+                            (f'/uploads/{target}', f'/uploads/{name}', f'/uploads\\{name}')
+                        )
+        finally:
+            release_db_connection(conn)
+        
+        if target != name:
+            os.remove(path)
+            stats['files'] += 1
+            if duplicate:
+                stats['duplicates'] += 1
+                stats['reclaimed_bytes'] += size
+                print(f"重复文件: {name} -> {target}")
+            else:
+                print(f"改名: {name} -> {target}")
+    
+    rebuild_upload_refs()
+    invalidate_cache('movies')
+    return stats
+
+# 把平铺的上传文件迁移到两级分散目录
+def migrate_upload_layout(batch_size=UPLOAD_MIGRATE_BATCH):
+    """
+    把上传目录（和缩略图目录）中平铺的文件移到 ab/cd/文件名，并分批改写数据库中的路径
+
+    每批按 建立新路径（硬链接，不支持时复制）-> 一个事务改写movies/upload_files/poster_variants/video_info
+    -> 删除旧路径 的顺序处理：任何时刻数据库中的URL都指向存在的文件，中断后重新执行即可继续
+
+    Returns:
+        {'files': 迁移的上传文件数, 'variants': 迁移的缩略图数, 'movies': 改写URL的电影字段数}
+    """
+    folder = app.config['UPLOAD_FOLDER']
+    stats = {'files': 0, 'variants': 0, 'movies': 0}
+    if not os.path.isdir(folder):
+        return stats
+    
+    def flat_files(path):
+        with os.scandir(path) as entries:
+            return sorted(entry.name for entry in entries
+                          if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'))
+    
+    def link(source, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if not os.path.exists(target):
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+    
+    derived_folder = os.path.join(folder, DERIVED_DIRNAME)
+    for base, kind in ((folder, 'files'), (derived_folder, 'variants')):
+        if not os.path.isdir(base):
+            continue
+        names = flat_files(base)
+        for start in range(0, len(names), batch_size):
+            batch = names[start:start + batch_size]
+            for name in batch:
+                link(os.path.join(base, name), os.path.join(base, fanout_path(name)))
+            
+            conn = get_db_connection()
+            try:
+                with conn:
+                    sources = set()
+                    for name in batch:
+                        new = fanout_path(name)
+                        if kind == 'variants':
+                            conn.execute("UPDATE poster_variants SET filename = ? WHERE filename = ?", (new, name))
+                            sources.update(row['source'] for row in conn.execute(
+                                "SELECT source FROM poster_variants WHERE filename = ?", (new,)))
+                            continue
+                        # 先改名upload_files，再改写电影URL（触发器会把引用计数再加一遍），最后恢复原来的计数
+                        row = conn.execute("SELECT ref_count FROM upload_files WHERE filename = ?", (name,)).fetchone()
+                        conn.execute("UPDATE upload_files SET filename = ? WHERE filename = ?", (new, name))
+                        for column in ('image_url', 'video_url'):
+                            stats['movies'] += conn.execute(
+                                f"UPDATE movies SET {column} = ? WHERE {column} IN (?, ?)",
+                                (f'/uploads/{new}', f'/uploads/{name}', f'/uploads\\{name}')
+                            ).rowcount
+                        if row:
+                            conn.execute("UPDATE upload_files SET ref_count = ? WHERE filename = ?", (row['ref_count'], new))
+                        conn.execute("UPDATE poster_variants SET source = ? WHERE source = ?", (new, name))
+                        conn.execute("UPDATE video_info SET filename = ? WHERE filename = ?", (new, name))
+                    # 缩略图路径变了，页面中的 <picture> 要更新：使用这些海报的电影更新版本号（改写URL的电影由触发器更新）
+                    conn.executemany(
+                        '''UPDATE movies SET version = version + 1, modified_at = CURRENT_TIMESTAMP
+                           WHERE substr(image_url, 10) = ?''',
+                        [(source,) for source in sources]
+                    )
+            finally:
+                release_db_connection(conn)
+            
+            for name in batch:
+                os.remove(os.path.join(base, name))
+            stats[kind] += len(batch)
+            print(f"已迁移 {stats[kind]}/{len(names)} 个{'缩略图' if kind == 'variants' else '上传文件'}")
+    invalidate_cache('movies')
+    return stats
+
+# 回收没有被电影引用的上传文件
+def iter_upload_files(folder):
+    """
+    用os.scandir逐个遍历上传目录中的文件：平铺的旧文件和两级分散目录中的文件
+    （跳过以"."开头的临时文件/隔离目录和缩略图目录）
+    
+    Yields:
+        (相对路径, os.DirEntry)
+    """
+    def walk(path, prefix, depth):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_file(follow_symlinks=False):
+                    yield prefix + entry.name, entry
+                elif (depth < FANOUT_LEVELS and len(entry.name) == FANOUT_WIDTH
+                      and entry.is_dir(follow_symlinks=False)):
+                    yield from walk(entry.path, f'{prefix}{entry.name}/', depth + 1)
+    
+    yield from walk(folder, '', 0)
+
+def pending_job_files(folder):
+    """
+    排队中和执行中的任务引用的上传文件
+
+    逐个解析任务参数（JSON），取出其中的文件名和路径，绝对路径换算成相对上传目录的路径
+
+    Returns:
+        文件名集合（与iter_upload_files返回的名称格式相同）
+    """
+    base = os.path.abspath(folder)
+    files = set()
+    rows = execute_db_query(
+        "SELECT payload FROM jobs WHERE status IN ('queued', 'running')", fetch_all=True) or []
+    for row in rows:
+        try:
+            payload = json.loads(row['payload'])
+        except ValueError:
+            continue
+        for value in payload.values():
+            if not isinstance(value, str):
+                continue
+            if os.path.isabs(value):
+                value = os.path.relpath(value, base)
+            files.add(value.replace(os.sep, '/'))
+    return files
+
+def collect_upload_garbage(grace=UPLOAD_GC_GRACE, quarantine=UPLOAD_GC_QUARANTINE, dry_run=False,
+                           pause=UPLOAD_GC_PAUSE):
+    """
+    扫描上传目录，回收没有被movies表引用的文件（删除电影、更换海报/视频后留下的旧文件）
+
+    - 用os.scandir逐个读取目录项（包括分散目录），不一次性列出整个目录
+    - 跳过以"."开头的文件（上传中的临时文件、隔离目录）、修改时间在宽限期内的文件和待处理任务引用的文件
+    - 每个文件在BEGIN IMMEDIATE事务中再次确认引用计数为0，同时删除upload_files/缩略图/视频元数据/HLS分片记录
+    - quarantine=True时移入隔离目录，隔离超过UPLOAD_GC_QUARANTINE_TTL的文件在之后的回收中删除
+    - 每处理UPLOAD_GC_BATCH个文件暂停pause秒
+
+    Returns:
+        {'scanned', 'orphaned', 'skipped_recent', 'quarantined', 'deleted', 'reclaimed_bytes'}
+    """
+    folder = app.config['UPLOAD_FOLDER']
+    stats = {'scanned': 0, 'orphaned': 0, 'skipped_recent': 0, 'quarantined': 0, 'deleted': 0, 'reclaimed_bytes': 0}
+    if not os.path.isdir(folder):
+        return stats
+    derived_folder = os.path.join(folder, DERIVED_DIRNAME)
+    quarantine_folder = os.path.join(folder, UPLOAD_QUARANTINE_DIRNAME)
+    
+    rows = execute_db_query("SELECT image_url, video_url FROM movies /* advisor: full-scan */", fetch_all=True) or []
+    referenced = {upload_filename_from_url(url) for row in rows for url in (row['image_url'], row['video_url'])}
+    pending = pending_job_files(folder)
+    cutoff = time.time() - grace
+    
+    def remove(path, size):
+        """删除或隔离一个文件（隔离目录中保留相对上传目录的路径，不同分散目录中的同名文件不会互相覆盖）"""
+        if quarantine:
+            target = os.path.join(quarantine_folder, os.path.relpath(path, folder))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+            # 修改时间记为隔离时间
+            os.utime(target)
+            stats['quarantined'] += 1
+        else:
+            os.remove(path)
+            stats['deleted'] += 1
+        stats['reclaimed_bytes'] += size
+    
+    processed = 0
+    for name, entry in iter_upload_files(folder):
+        stats['scanned'] += 1
+        if name in referenced:
+            continue
+        file_stat = entry.stat(follow_symlinks=False)
+        if file_stat.st_mtime > cutoff or name in pending:
+            stats['skipped_recent'] += 1
+            continue
+        stats['orphaned'] += 1
+        if dry_run:
+            print(f"待回收: {name} ({file_stat.st_size} 字节)")
+            stats['reclaimed_bytes'] += file_stat.st_size
+            continue
+            
+        conn = get_db_connection()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT ref_count FROM upload_files WHERE filename = ?", (name,)).fetchone()
+                if row and row['ref_count'] > 0:
+                    # 扫描开始之后又被电影引用
+                    conn.rollback()
+                    continue
+                variants = conn.execute(
+                    "SELECT filename, size FROM poster_variants WHERE source = ?", (name,)).fetchall()
+                hls = conn.execute("SELECT size FROM hls_streams WHERE source = ?", (name,)).fetchone()
+                conn.execute("DELETE FROM poster_variants WHERE source = ?", (name,))
+                conn.execute("DELETE FROM hls_streams WHERE source = ?", (name,))
+                conn.execute("DELETE FROM video_info WHERE filename = ?", (name,))
+                conn.execute("DELETE FROM upload_files WHERE filename = ?", (name,))
+                # 先移走文件再提交：文件操作失败时数据库记录保持不变
+                remove(entry.path, file_stat.st_size)
+                for variant in variants:
+                    variant_path = os.path.join(derived_folder, variant['filename'])
+                    if os.path.exists(variant_path):
+                        remove(variant_path, variant['size'])
+                # HLS分片可以随时重新生成，直接删除
+                hls_dir = os.path.join(folder, hls_output_dir(name))
+                if hls and os.path.isdir(hls_dir):
+                    shutil.rmtree(hls_dir)
+                    stats['reclaimed_bytes'] += hls['size']
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        finally:
+            release_db_connection(conn)
+        print(f"回收上传文件: {name} ({file_stat.st_size} 字节)")
+        
+        processed += 1
+        if pause and processed % UPLOAD_GC_BATCH == 0:
+            time.sleep(pause)
+
+    # 清理隔离期已满的文件，以及清理后变空的子目录
+    if not dry_run and os.path.isdir(quarantine_folder):
+        expire_before = time.time() - UPLOAD_GC_QUARANTINE_TTL
+        for dirpath, dirnames, filenames in os.walk(quarantine_folder, topdown=False):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if os.lstat(path).st_mtime < expire_before:
+                    os.remove(path)
+                    stats['deleted'] += 1
+            if dirpath != quarantine_folder and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+    return stats
+
+def run_upload_gc():
+    """worker定期执行的上传目录回收（同时清理过期的分块上传会话）"""
+    expire_upload_sessions()
+    stats = collect_upload_garbage()
+    if stats['orphaned']:
+        print(f"上传目录回收: 扫描 {stats['scanned']} 个文件，回收 {stats['orphaned']} 个，"
+              f"释放 {stats['reclaimed_bytes'] / 1024 / 1024:.1f} MB")
+    return stats
+
+# ==============================
+# 上传文件的后台处理任务（job_queue.py / media_jobs.py）
+# ==============================
+
+# 根据任务状态更新电影的处理状态
+UPDATE_PROCESSING_STATE_SQL = '''
+    UPDATE movies SET processing_state = CASE
+        WHEN EXISTS (SELECT 1 FROM jobs WHERE movie_id = ? AND status IN ('queued', 'running')) THEN 'processing'
+        WHEN EXISTS (SELECT 1 FROM jobs WHERE movie_id = ? AND status = 'failed') THEN 'failed'
+        ELSE 'ready' END
+    WHERE id = ?
+'''
+
+def enqueue_upload_jobs(movie_id, stored_paths=(), chunked_upload=None):
+    """
+    保存电影后为上传的文件安排后台任务，并把电影标记为处理中
+    
+    Args:
+        stored_paths: 表单直接上传的文件路径（uploads/文件名，None会被忽略），安排完整性检查，
+                      海报还会生成缩略图，MP4视频还会解析元数据
+        chunked_upload: 分块上传会话，安排计算哈希、移入内容寻址存储并写入video_url
+    """
+    folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    jobs = []
+    for path in stored_paths:
+        if not path:
+            continue
+        filename = path.split('/', 1)[1]
+        stored = execute_db_query(
+            "SELECT sha256, size FROM upload_files WHERE filename = ?", (filename,), fetch_one=True)
+        if stored:
+            jobs.append(('verify_upload', {'path': os.path.join(folder, filename),
+                                           'sha256': stored['sha256'], 'size': stored['size']}))
+        if allowed_image_file(filename):
+            jobs.extend(poster_jobs([filename]))
+        else:
+            jobs.extend(video_probe_jobs([filename]))
+    
+    conn = get_db_connection()
+    try:
+        with conn:
+            # 同一个上传ID只能被一部电影使用（防止重复提交表单）
+            if chunked_upload and conn.execute(
+                    "UPDATE upload_sessions SET movie_id = ? WHERE id = ? AND movie_id IS NULL",
+                    (movie_id, chunked_upload['id'])).rowcount:
+                jobs.append(('ingest_upload', {
+                    'upload_id': chunked_upload['id'],
+                    'part_path': partial_upload_path(folder, chunked_upload['id']),
+                    'extension': chunked_upload['extension'],
+                    'folder': folder,
+                }))
+            if not jobs:
+                return
+            # 之前的任务记录不再影响处理状态
+            conn.execute("DELETE FROM jobs WHERE movie_id = ? AND status IN ('done', 'failed')", (movie_id,))
+            for kind, payload in jobs:
+                enqueue_job(conn, kind, payload, movie_id)
+            conn.execute("UPDATE movies SET processing_state = 'processing' WHERE id = ?", (movie_id,))
+            invalidate_cache(*movie_cache_tags(movie_id), conn=conn)
+        print(f"电影 {movie_id} 已安排后台任务: {', '.join(kind for kind, _ in jobs)}")
+    finally:
+        release_db_connection(conn)
+
+def poster_jobs(filenames):
+    """
+    为还没有缩略图的海报生成任务参数（同一张海报只生成一次）
+
+    Returns:
+        [('poster_derivatives', payload)]；未安装Pillow时为空
+    """
+    if not pillow_available():
+        return []
+    folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    jobs = []
+    for filename in filenames:
+        exists = execute_db_query(
+            "SELECT 1 FROM poster_variants WHERE source = ? LIMIT 1", (filename,), fetch_one=True)
+        if not exists and os.path.isfile(os.path.join(folder, filename)):
+            jobs.append(('poster_derivatives', {'path': os.path.join(folder, filename), 'source': filename,
+                                                'folder': os.path.join(folder, DERIVED_DIRNAME)}))
+    return jobs
+
+def enqueue_poster_backfill():
+    """为所有本地上传但还没有缩略图的海报安排任务（安装Pillow之前上传的海报），返回任务数"""
+    rows = execute_db_query(
+        "SELECT image_url FROM movies WHERE image_url LIKE '/uploads%' /* advisor: full-scan */",
+        fetch_all=True
+    ) or []
+    filenames = {upload_filename_from_url(row['image_url']) for row in rows}
+    jobs = poster_jobs(sorted(name for name in filenames if name and allowed_image_file(name)))
+    if jobs:
+        conn = get_db_connection()
+        try:
+            with conn:
+                for kind, payload in jobs:
+                    enqueue_job(conn, kind, payload)
+        finally:
+            release_db_connection(conn)
+    return len(jobs)
+
+def apply_poster_derivatives(conn, job, result):
+    """登记生成的缩略图"""
+    conn.executemany(
+        '''INSERT INTO poster_variants (source, width, format, filename, size) VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(source, format, width) DO UPDATE SET filename = excluded.filename, size = excluded.size''',
+        [(result['source'], *variant) for variant in result['variants']]
+    )
+    # 页面中的 <picture> 换成缩略图；电影卡片的片段缓存以版本号为键，使用该海报的电影需要更新版本号
+    conn.execute(
+        '''UPDATE movies SET version = version + 1, modified_at = CURRENT_TIMESTAMP
+           WHERE substr(image_url, 10) = ?''',
+        (result['source'],)
+    )
+    invalidate_cache('movie-list', conn=conn)
+
+def video_probe_jobs(filenames):
+    """
+    为还没有元数据的MP4/MOV视频生成任务参数
+
+    Returns:
+        [('probe_video', payload)]
+    """
+    folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    jobs = []
+    for filename in filenames:
+        extension = filename.rsplit('.', 1)[-1].lower()
+        if extension not in MP4_EXTENSIONS:
+            continue
+        exists = execute_db_query("SELECT 1 FROM video_info WHERE filename = ?", (filename,), fetch_one=True)
+        if not exists and os.path.isfile(os.path.join(folder, filename)):
+            jobs.append(('probe_video', {'path': os.path.join(folder, filename), 'source': filename,
+                                         'extension': extension, 'folder': folder}))
+    return jobs
+
+def enqueue_video_backfill():
+    """为所有本地上传但还没有元数据的视频安排解析任务（旧视频），返回任务数"""
+    rows = execute_db_query(
+        "SELECT id, video_url FROM movies WHERE video_url LIKE '/uploads%' /* advisor: full-scan */",
+        fetch_all=True
+    ) or []
+    conn = get_db_connection()
+    count = 0
+    try:
+        with conn:
+            for row in rows:
+                filename = upload_filename_from_url(row['video_url'])
+                for kind, payload in video_probe_jobs([filename] if filename else []):
+                    # 关联电影：重排后的新文件需要写回该电影的video_url
+                    enqueue_job(conn, kind, payload, row['id'])
+                    count += 1
+    finally:
+        release_db_connection(conn)
+    return count
+
+def hls_output_dir(filename):
+    """视频的HLS分片目录（相对上传目录）：hls/分散目录/文件名（不含扩展名）"""
+    return f"{HLS_DIRNAME}/{filename.rsplit('.', 1)[0]}"
+
+def enqueue_hls_job(conn, filename, force=False):
+    """
+    为视频安排HLS打包任务（在写回解析结果的同一事务中调用）；未开启HLS_PACKAGING且不是force时跳过
+    
+    Returns:
+        是否安排了任务
+    """
+    if not (HLS_PACKAGING or force) or filename.rsplit('.', 1)[-1].lower() not in MP4_EXTENSIONS:
+        return False
+    if conn.execute("SELECT 1 FROM hls_streams WHERE source = ?", (filename,)).fetchone():
+        return False
+    folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    # 不关联电影：打包期间电影照常播放MP4，不显示"处理中"
+    enqueue_job(conn, 'package_hls', {'path': os.path.join(folder, filename), 'source': filename,
+                                      'output_dir': os.path.join(folder, hls_output_dir(filename))})
+    return True
+
+def enqueue_hls_backfill():
+    """为所有已解析但还没有HLS分片的上传视频安排打包任务，返回任务数"""
+    rows = execute_db_query(
+        "SELECT filename FROM video_info WHERE filename NOT IN (SELECT source FROM hls_streams) /* advisor: full-scan */",
+        fetch_all=True
+    ) or []
+    conn = get_db_connection()
+    try:
+        with conn:
+            return sum(enqueue_hls_job(conn, row['filename'], force=True) for row in rows)
+    finally:
+        release_db_connection(conn)
+
+def apply_package_hls(conn, job, result):
+    """登记HLS打包结果"""
+    conn.execute(
+        '''INSERT OR REPLACE INTO hls_streams (source, playlist, segments, duration, size)
+           VALUES (?, ?, ?, ?, ?)''',
+        (result['source'], f"{hls_output_dir(result['source'])}/{HLS_PLAYLIST_NAME}",
+         result['segments'], result['duration'], result['size'])
+    )
+    # 详情页改为优先播放HLS，使用该视频的电影需要更新版本号
+    conn.execute(
+        '''UPDATE movies SET version = version + 1, modified_at = CURRENT_TIMESTAMP
+           WHERE substr(video_url, 10) = ?''',
+        (result['source'],)
+    )
+
+def save_video_info(conn, filename, video):
+    """保存视频元数据"""
+    if video:
+        conn.execute(
+            '''INSERT OR REPLACE INTO video_info (filename, duration, width, height, video_codec, audio_codec, faststart)
+               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+            (filename, video['duration'], video['width'], video['height'],
+             video['video_codec'], video['audio_codec'], int(video['faststart']))
+        )
+
+def apply_ingest_upload(conn, job, result):
+    """分块上传的文件处理完成：登记文件和视频元数据、写入电影的video_url、删除上传会话"""
+    conn.execute(
+        "INSERT INTO upload_files (filename, sha256, size) VALUES (?, ?, ?) ON CONFLICT(filename) DO NOTHING",
+        (result['filename'], result['sha256'], result['size'])
+    )
+    save_video_info(conn, result['filename'], result.get('video'))
+    if result.get('video'):
+        enqueue_hls_job(conn, result['filename'])
+    if job['movie_id'] is not None:
+        conn.execute(
+            "UPDATE movies SET video_url = ?, video_type = 'upload' WHERE id = ?",
+            (f"/uploads/{result['filename']}", job['movie_id'])
+        )
+    conn.execute("DELETE FROM upload_sessions WHERE id = ?", (job['payload']['upload_id'],))
+
+def apply_probe_video(conn, job, result):
+    """
+    保存视频元数据；视频被重排为faststart时登记新文件，并把电影的video_url改为新文件
+    （只改仍然指向原文件的电影，原文件的引用计数归零后由清理任务删除）
+    """
+    filename = result.get('filename', result['source'])
+    if filename != result['source']:
+        conn.execute(
+            "INSERT INTO upload_files (filename, sha256, size) VALUES (?, ?, ?) ON CONFLICT(filename) DO NOTHING",
+            (filename, result['sha256'], result['size'])
+        )
+        if job['movie_id'] is not None:
+            conn.execute(
+                "UPDATE movies SET video_url = ? WHERE id = ? AND video_url IN (?, ?)",
+                (f'/uploads/{filename}', job['movie_id'],
+                 f"/uploads/{result['source']}", f"/uploads\\{result['source']}")
+            )
+    save_video_info(conn, filename, result['video'])
+    if result['video']:
+        enqueue_hls_job(conn, filename)
+
+def update_processing_state(conn, job):
+    """任务完成或彻底失败后更新电影的处理状态"""
+    if job['movie_id'] is not None:
+        conn.execute(UPDATE_PROCESSING_STATE_SQL, (job['movie_id'],) * 3)
+        # 同一事务中的apply函数可能还改写了video_url；worker通常是单独的进程，通过失效记录通知Web进程
+        invalidate_cache(*movie_cache_tags(job['movie_id']), conn=conn)
+
+# 任务类型 -> (在子进程中执行的函数, 在worker主进程中写回结果的函数)
+JOB_HANDLERS = {
+    'ingest_upload': (media_jobs.ingest_upload, apply_ingest_upload),
+    'verify_upload': (media_jobs.verify_upload, None),
+    'poster_derivatives': (media_jobs.poster_derivatives, apply_poster_derivatives),
+    'probe_video': (media_jobs.probe_video, apply_probe_video),
+    'package_hls': (media_jobs.package_hls, apply_package_hls),
+}
+
+def get_video_info(video_url):
+    """
+    详情页显示的视频信息
+
+    Returns:
+        {'duration_text': 'm:ss'或'h:mm:ss', 'resolution': '1920×1080', 'codecs': 'avc1.640028, mp4a.40.2',
+         'hls_url': HLS播放列表URL或None}；不是本地上传或尚未解析的视频返回None
+    """
+    filename = upload_filename_from_url(video_url)
+    if not filename:
+        return None
+    row = execute_db_query(
+        '''SELECT v.*, h.playlist FROM video_info v
+           LEFT JOIN hls_streams h ON h.source = v.filename
+           WHERE v.filename = ?''',
+        (filename,),
+        fetch_one=True
+    )
+    if not row:
+        return None
+    info = {'duration_text': None, 'resolution': None,
+            'codecs': ', '.join(codec for codec in (row['video_codec'], row['audio_codec']) if codec),
+            'hls_url': f"/uploads/{row['playlist']}" if row['playlist'] else None}
+    if row['duration']:
+        minutes, seconds = divmod(int(round(row['duration'])), 60)
+        hours, minutes = divmod(minutes, 60)
+        info['duration_text'] = f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes}:{seconds:02d}'
+    if row['width'] and row['height']:
+        info['resolution'] = f"{row['width']}×{row['height']}"
+    return info
+
+def get_poster_sources(*movie_lists):
+    """
+    查询页面上所有海报的缩略图，一次查询
+
+    Returns:
+        {image_url: [(格式, srcset字符串)]}，格式按AVIF、WebP排列；没有缩略图的海报不在结果中
+    """
+    urls = {movie['image_url'] for movies in movie_lists for movie in movies or [] if movie['image_url']}
+    sources = {upload_filename_from_url(url): url for url in urls}
+    sources.pop(None, None)
+    if not sources:
+        return {}
+    placeholders = ','.join(['?'] * len(sources))
+    rows = execute_db_query(
+        f"SELECT source, format, width, filename FROM poster_variants WHERE source IN ({placeholders}) "
+        f"ORDER BY source, format, width",
+        tuple(sources),
+        fetch_all=True
+    ) or []
+    srcsets = {}
+    for row in rows:
+        srcsets.setdefault(sources[row['source']], {}).setdefault(row['format'], []).append(
+            f"/uploads/{DERIVED_DIRNAME}/{row['filename']} {row['width']}w")
+    order = [name for name, _, _ in image_derivatives.POSTER_FORMATS]
+    return {url: sorted(((fmt, ', '.join(items)) for fmt, items in formats.items()), key=lambda item: order.index(item[0]))
+            for url, formats in srcsets.items()}
+
+def open_worker_connection():
+    """worker主进程使用的独立连接（不经过Web请求的连接池）"""
+    conn = sqlite3.connect(DATABASE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    configure_connection(conn)
+    return conn
+
+def make_job_worker(processes=JOB_WORKER_PROCESSES):
+    """创建任务执行器；processes=0时在当前进程中执行"""
+    return JobWorker(open_worker_connection, JOB_HANDLERS, processes=processes,
+                     poll_interval=JOB_POLL_INTERVAL, after_job=update_processing_state,
+                     maintenance=run_upload_gc, maintenance_interval=UPLOAD_GC_INTERVAL)
+
+def run_pending_jobs():
+    """在当前进程中执行所有待处理任务（测试、调试用），返回执行的任务数"""
+    return make_job_worker(processes=0).run_pending()
+
+def get_job_counts():
+    """各状态的任务数量"""
+    conn = get_db_connection()
+    try:
+        return job_counts(conn)
+    finally:
+        release_db_connection(conn)
+
+# 全文搜索电影
+def search_movies(query):
+    """
+    用FTS5全文索引搜索电影，按BM25相关性排序（标题权重最高）
+
+    Returns:
+        电影列表；查询失败时为None
+    """
+    match = build_match_query(query)
+    if not match:
+        return []
+    weights = ', '.join(str(weight) for weight in SEARCH_COLUMN_WEIGHTS)
+    return execute_db_query(
+        f'''SELECT m.* FROM movies_fts
+            JOIN movies m ON m.id = movies_fts.rowid
+            WHERE movies_fts MATCH ?
+            ORDER BY bm25(movies_fts, {weights}), m.created_at DESC''',
+        (match,),
+        fetch_all=True
+    )
+
+# 搜索框自动补全的前缀索引（每个进程一份，首次使用时加载）
+suggest_index = PrefixSuggestIndex()
+suggest_index_lock = threading.Lock()
+# 收到movie:<id>失效通知、需要重新读取的电影，下次使用索引时逐部更新
+suggest_pending = set()
+
+# 获取自动补全索引
+def get_suggest_index():
+    """返回前缀索引，未加载或超过SUGGEST_INDEX_TTL时从数据库重建，之后应用等待更新的电影"""
+    if suggest_index.built_at is None or time.time() - suggest_index.built_at > SUGGEST_INDEX_TTL:
+        with suggest_index_lock:
+            if suggest_index.built_at is None or time.time() - suggest_index.built_at > SUGGEST_INDEX_TTL:
+                suggest_pending.clear()
+                movies = execute_db_query(
+                    "SELECT id, title, director, rating, rating_count FROM movies /* advisor: full-scan */",
+                    fetch_all=True
+                )
+                if movies is not None:
+                    suggest_index.rebuild(movies)
+    while suggest_pending:
+        try:
+            movie_id = suggest_pending.pop()
+        except KeyError:
+            break
+        movie = execute_db_query(
+            "SELECT id, title, director, rating, rating_count FROM movies WHERE id = ?",
+            (movie_id,),
+            fetch_one=True
+        )
+        with suggest_index_lock:
+            if movie:
+                suggest_index.update(movie)
+            else:
+                suggest_index.remove(movie_id)
+    return suggest_index
+
+# 电影数据变化后的处理
+def on_movie_changed(movie_id):
+    """管理员添加、编辑、删除电影后调用，同步全文搜索索引并使缓存失效（自动补全索引随失效通知更新）"""
+    sync_search_index(movie_id)
+    invalidate_cache(*movie_cache_tags(movie_id))
+
+# 协同过滤模型（每个进程一份；过期后在后台线程重新训练，训练期间继续使用旧模型）
+recommender_state = {'model': None, 'training': False, 'stale': False}
+recommender_lock = threading.Lock()
+
+# 读取全部评分
+def load_rating_arrays():
+    """
+    读取ratings表的全部评分，供推荐模型训练使用
+
+    Returns:
+        (用户ID数组, 电影ID数组, 评分数组)；没有评分时返回None
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.row_factory = None  # 直接返回元组，评分很多时比sqlite3.Row省内存
+        rows = cursor.execute("SELECT user_id, movie_id, rating FROM ratings /* advisor: full-scan */").fetchall()
+    finally:
+        release_db_connection(conn)
+    if not rows:
+        return None
+    data = np.array(rows, dtype=np.float64)
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2]
+
+# 训练协同过滤模型
+def train_recommender():
+    """从ratings表读取全部评分并训练item-item协同过滤模型"""
+    arrays = load_rating_arrays()
+    if arrays is None:
+        return None
+    model = ItemCFModel.fit(*arrays, top_n=RECOMMENDER_NEIGHBORS)
+    print(f"协同过滤模型训练完成: {len(arrays[2])} 条评分, {len(model.movie_ids)} 部电影")
+    return model
+
+def _refresh_recommender():
+    """后台线程：重新训练模型并替换"""
+    try:
+        model = train_recommender()
+        if model is not None:
+            recommender_state['model'] = model
     except Exception as e:
-        print(f"数据库初始化失败: {e}")
-        import traceback
-        traceback.print_exc()
-        return False
+        print(f"协同过滤模型训练失败: {e}")
+    finally:
+        recommender_state['training'] = False
+
+# 获取协同过滤模型
+def get_recommender():
+    """返回当前模型；首次使用时同步训练，过期或收到批量修改通知后在后台重新训练"""
+    model = recommender_state['model']
+    if model is None:
+        with recommender_lock:
+            if recommender_state['model'] is None:
+                recommender_state['model'] = train_recommender()
+            return recommender_state['model']
+    
+    expired = recommender_state['stale'] or time.time() - model.built_at > RECOMMENDER_REFRESH_SECONDS
+    if expired and not recommender_state['training']:
+        with recommender_lock:
+            if not recommender_state['training']:
+                recommender_state['training'] = True
+                recommender_state['stale'] = False
+                threading.Thread(target=_refresh_recommender, daemon=True).start()
+    return model
+
+# ALS模型文件前缀（与数据库文件放在同一目录）
+def als_model_prefix():
+    """ALS因子文件的路径前缀，例如 movie_system_als_user_factors.npy"""
+    return os.path.splitext(DATABASE)[0] + '_als'
+
+# 已加载的ALS模型及其meta文件的修改时间
+als_state = {'model': None, 'mtime': None}
+als_lock = threading.Lock()
+
+# 获取ALS模型
+def get_als_model():
+    """
+    以mmap方式加载ALS模型；训练命令写入新文件后自动重新加载
+
+    Returns:
+        ALSModel，尚未训练时返回None
+    """
+    try:
+        mtime = os.path.getmtime(als_model_prefix() + '_meta.json')
+    except OSError:
+        return None
+    if als_state['mtime'] != mtime:
+        with als_lock:
+            if als_state['mtime'] != mtime:
+                als_state['model'] = ALSModel.load(als_model_prefix())
+                als_state['mtime'] = mtime
+    return als_state['model']
+
+# 进程内派生数据的失效通知订阅者
+class DerivedDataSubscriber:
+    """
+    让自动补全索引、协同过滤模型、ALS模型跟随缓存失效通知更新（本进程和其他进程的修改都会收到，见cache_bus.py）
+
+    - movie:<id>：自动补全索引下次使用时重新读取这部电影
+    - movies：批量修改了电影或评分，自动补全索引下次使用时重建，协同过滤模型在后台重新训练
+    - clear()：错过了失效记录或切换了数据库，全部派生数据下次使用时重新加载
+    """
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            if tag == 'movies':
+                suggest_index.built_at = None
+                recommender_state['stale'] = True
+            elif tag.startswith('movie:') and suggest_index.built_at is not None:
+                suggest_pending.add(int(tag[len('movie:'):]))
+
+    def clear(self):
+        suggest_index.built_at = None
+        recommender_state['model'] = None
+        recommender_state['stale'] = False
+        als_state['mtime'] = None
+
+derived_data = DerivedDataSubscriber()
+cache_bus.subscribe(derived_data)
+
+# 为用户生成个性化推荐
+def recommend_movies_for_user(user_id, limit=RECOMMENDATION_LIMIT):
+    """
+    根据用户的评分记录推荐电影（用户最新的评分即时生效，不需要等模型重新训练）
+
+    优先使用离线训练的ALS模型；用户不在ALS模型中（训练之后才开始评分）时使用协同过滤模型
+
+    Returns:
+        电影列表（按推荐分排序），每部电影附带recommend_score
+    """
+    user_ratings = execute_db_query(
+        "SELECT movie_id, rating FROM ratings WHERE user_id = ?",
+        (user_id,),
+        fetch_all=True
+    ) or []
+    rated = {row['movie_id']: row['rating'] for row in user_ratings}
+    
+    ranked = None
+    als_model = get_als_model()
+    if als_model is not None:
+        ranked = als_model.recommend(user_id, exclude=rated.keys(), limit=limit)
+    if not ranked:
+        model = get_recommender()
+        if model is None:
+            return []
+        ranked = model.recommend(rated, limit)
+    if not ranked:
+        return []
+    
+    placeholders = ', '.join('?' for _ in ranked)
+    movies = execute_db_query(
+        f"SELECT * FROM movies WHERE id IN ({placeholders})",
+        tuple(movie_id for movie_id, _ in ranked),
+        fetch_all=True
+    ) or []
+    movies_by_id = {movie['id']: movie for movie in movies}
+    results = []
+    for movie_id, score in ranked:
+        if movie_id in movies_by_id:
+            results.append(dict(movies_by_id[movie_id], recommend_score=score))
+    return results
+
+# 刷新相似电影表
+def refresh_movie_neighbors(full=False):
+    """
+    批处理任务：重新计算movie_neighbors表
+
+    增量模式只计算movie_neighbors_dirty中的电影，以及受它们影响的电影：
+    当前相似列表里包含这些电影的，和这些电影新的相似列表里出现的（相似度是对称的，
+    对方的列表可能需要加入或调整）。相似度用全部评分和全部电影计算，结果与全量刷新一致；
+    只是没有被标记的电影不会因为其他用户平均分的细微变化而重新计算。
+
+    Args:
+        full: True时重新计算全部电影
+
+    Returns:
+        {'dirty': 标记的电影数, 'computed': 重新计算的电影数, 'rows': 写入的行数}
+    """
+    conn = get_db_connection()
+    try:
+        dirty = [row[0] for row in conn.execute(
+            "SELECT movie_id FROM movie_neighbors_dirty /* advisor: full-scan */")]
+        if not dirty and not full:
+            return {'dirty': 0, 'computed': 0, 'rows': 0}
+        movies = [dict(row) for row in conn.execute(
+            "SELECT id, genre, director, description FROM movies /* advisor: full-scan */")]
+    finally:
+        release_db_connection(conn)
+    
+    arrays = load_rating_arrays() or (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+    
+    def compute(targets):
+        return compute_movie_neighbors(movies, *arrays, targets=targets, top_n=MOVIE_NEIGHBORS_STORED,
+                                       content_weight=NEIGHBOR_CONTENT_WEIGHT)
+    
+    if full:
+        results = compute(None)
+    else:
+        results = compute(dirty)
+        affected = set()
+        for neighbors in results.values():
+            affected.update(neighbor_id for neighbor_id, _ in neighbors)
+        for start in range(0, len(dirty), 500):
+            chunk = dirty[start:start + 500]
+            placeholders = ', '.join('?' for _ in chunk)
+            rows = execute_db_query(
+                f"SELECT DISTINCT movie_id FROM movie_neighbors WHERE neighbor_id IN ({placeholders})",
+                tuple(chunk),
+                fetch_all=True
+            ) or []
+            affected.update(row['movie_id'] for row in rows)
+        affected.difference_update(results)
+        if affected:
+            results.update(compute(affected))
+    
+    conn = get_db_connection()
+    try:
+        with conn:
+            if full:
+                conn.execute("DELETE FROM movie_neighbors /* advisor: full-scan */")
+            else:
+                # 被标记但已删除的电影也要清掉旧行
+                conn.executemany("DELETE FROM movie_neighbors WHERE movie_id = ?",
+                                 [(movie_id,) for movie_id in set(results) | set(dirty)])
+            conn.executemany(
+                "INSERT INTO movie_neighbors (movie_id, neighbor_id, score) VALUES (?, ?, ?)",
+                [(movie_id, neighbor_id, score)
+                 for movie_id, neighbors in results.items() for neighbor_id, score in neighbors]
+            )
+            # 相似电影列表变了，详情页的ETag也要变
+            conn.executemany(BUMP_MOVIE_VERSION_SQL, [(movie_id,) for movie_id in results])
+            # 只清除本次读取到的标记，计算期间新产生的标记留给下一次
+            conn.executemany("DELETE FROM movie_neighbors_dirty WHERE movie_id = ?",
+                             [(movie_id,) for movie_id in dirty])
+    finally:
+        release_db_connection(conn)
+    
+    row_count = sum(len(neighbors) for neighbors in results.values())
+    print(f"相似电影刷新完成: 标记 {len(dirty)} 部, 重新计算 {len(results)} 部, 写入 {row_count} 行")
+    return {'dirty': len(dirty), 'computed': len(results), 'rows': row_count}
+
+# 读取相似电影
+def get_similar_movies(movie_id, limit=SIMILAR_MOVIES_LIMIT):
+    """从movie_neighbors表读取预先计算好的相似电影（一次索引查询，不做在线计算）"""
+    return execute_db_query(
+        '''SELECT m.id, m.title, m.director, m.year, m.image_url, m.rating, n.score
+           FROM movie_neighbors n
+           JOIN movies m ON m.id = n.neighbor_id
+           WHERE n.movie_id = ?
+           ORDER BY n.score DESC
+           LIMIT ?''',
+        (movie_id, limit),
+        fetch_all=True
+    ) or []
+
+# 校验评分聚合字段
+def verify_rating_aggregates():
+    """
+    将movies中的评分聚合字段与ratings表逐一核对
+
+    Returns:
+        不一致的电影列表，每项包含记录值和实际值
+    """
+    return execute_db_query(
+        '''SELECT m.id, m.title, m.rating_sum, m.rating_count, m.rating,
+                  COALESCE(r.actual_sum, 0) AS actual_sum,
+                  COALESCE(r.actual_count, 0) AS actual_count
+           FROM movies m
+           LEFT JOIN (SELECT movie_id, SUM(rating) AS actual_sum, COUNT(*) AS actual_count
+                      FROM ratings GROUP BY movie_id) r ON r.movie_id = m.id
+           WHERE m.rating_sum IS NOT COALESCE(r.actual_sum, 0)
+              OR m.rating_count IS NOT COALESCE(r.actual_count, 0)
+              OR (r.actual_count > 0 AND ABS(m.rating - r.actual_sum * 1.0 / r.actual_count) > 1e-9)
+           /* advisor: full-scan */''',
+        fetch_all=True
+    )
+
+# 重建评分聚合字段
+def rebuild_rating_aggregates():
+    """用ratings表重新计算所有电影的评分聚合字段"""
+    return execute_db_query(REBUILD_RATING_AGGREGATES_SQL, commit=True, invalidate_tags=['movies'])
+
+# 输出PRAGMA配置报告
+def report_pragma_settings(results, profile=None):
+    """打印PRAGMA配置方案中每一项的期望值和实际生效值"""
+    profile = profile or DB_PRAGMA_PROFILE
+    print(f"数据库PRAGMA配置方案: {profile}")
+    for name, (expected, actual) in results.items():
+        ok = str(expected).lower() == str(actual).lower()
+        if name == 'synchronous':
+            # 读取synchronous返回的是数字：0=OFF 1=NORMAL 2=FULL 3=EXTRA
+            ok = {'OFF': 0, 'NORMAL': 1, 'FULL': 2, 'EXTRA': 3}.get(str(expected).upper()) == actual
+        elif name == 'temp_store':
+            ok = {'DEFAULT': 0, 'FILE': 1, 'MEMORY': 2}.get(str(expected).upper()) == actual
+        mark = '✓' if ok else '✗'
+        print(f"  {mark} {name}: 期望 {expected}，实际 {actual}")
+
+# 未登录用户的整页缓存
+def cache_anonymous_page(view):
+    """
+    装饰器：未登录用户的GET请求直接返回缓存的HTML（键为路径+查询参数+登录状态），
+    登录用户照常渲染；缓存的页面在电影、分类、评分变化时失效（标签见PAGE_CACHE_TAGS）
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET' or check_login() or '_flashes' in session:
+            return view(*args, **kwargs)
+        key = ('anonymous', request.path, tuple(sorted(request.args.items(multi=True))))
+        body = page_cache.get(key)
+        if body is not None:
+            response = app.response_class(body, mimetype='text/html')
+            response.headers['X-Page-Cache'] = 'HIT'
+        else:
+            generation = page_cache.generation
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.mimetype != 'text/html' or response.direct_passthrough:
+                return response
+            page_cache.set(key, response.get_data(), PAGE_CACHE_TAGS, generation=generation)
+            response.headers['X-Page-Cache'] = 'MISS'
+        # 同一个URL登录前后内容不同，共享缓存（代理）要区分Cookie
+        response.vary.add('Cookie')
+        return response
+    return wrapper
 
 # ==============================
 # 路由定义开始
@@ -330,17 +2323,28 @@ def setup_database():
 
 # 首页路由
 @app.route('/')
+@cache_anonymous_page
 def index():
     """首页：显示所有电影和分类"""
     # 获取所有电影（按创建时间倒序）
     movies = execute_db_query("SELECT * FROM movies ORDER BY created_at DESC", fetch_all=True)
     
     # 获取所有分类
-    categories = execute_db_query("SELECT * FROM categories", fetch_all=True)
+    categories = get_categories()
+    
+    # 登录用户显示个性化推荐
+    recommendations = []
+    if check_login():
+        try:
+            recommendations = recommend_movies_for_user(session['user_id'])
+        except Exception as e:
+            print(f"生成推荐失败: {e}")
     
     return render_template('index.html', 
                          movies=movies, 
                          categories=categories, 
+                         recommendations=recommendations,
+                         posters=get_poster_sources(movies, recommendations),
                          user=session)
 
 # 用户注册路由
@@ -370,8 +2374,8 @@ def register():
             return render_template('register.html', error='用户名已存在')
         
         try:
-            # 加密密码
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+            # 加密密码（在密码哈希进程池中计算）
+            hashed_password = password_hasher.hash_password(password)
             
             # 创建新用户
             user_id = execute_db_query(
@@ -389,6 +2393,9 @@ def register():
             else:
                 return render_template('register.html', error='注册失败，请重试')
                 
+        except HashingBusy as e:
+            print(f"注册被拒绝: {e}")
+            return busy_response('register.html')
         except Exception as e:
             print(f"注册错误: {e}")
             return render_template('register.html', error='注册失败，请重试')
@@ -413,7 +2420,13 @@ def login():
             fetch_one=True
         )
         
-        if user and bcrypt.checkpw(password.encode('utf-8'), user['password']):
+        try:
+            password_ok = bool(user) and password_hasher.check_password(password, user['password'])
+        except HashingBusy as e:
+            print(f"登录被拒绝: {e}")
+            return busy_response('login.html')
+        
+        if password_ok:
             # 登录成功
             session['user_id'] = user['id']
             session['username'] = user['username']
@@ -436,16 +2449,73 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
+# 电影详情页的缓存验证信息
+def movie_page_validators(movie_id):
+    """
+    根据电影版本号生成详情页的ETag和Last-Modified（一次主键查询，不走查询缓存，
+    其他进程修改电影后立即生效）
+
+    页面还取决于登录状态（导航栏、本人的评分、管理员按钮），ETag中带上用户ID和角色
+
+    Returns:
+        (etag, last_modified)；电影不存在时返回None
+    """
+    row = execute_db_query(
+        "SELECT version, COALESCE(modified_at, created_at) AS modified_at FROM movies WHERE id = ?",
+        (movie_id,),
+        fetch_one=True
+    )
+    if not row:
+        return None
+    viewer = f"u{session['user_id']}-{session.get('role', 'user')}" if check_login() else 'anonymous'
+    etag = f"movie-{movie_id}-v{row['version']}-{viewer}"
+    last_modified = None
+    if row['modified_at']:
+        try:
+            # SQLite的CURRENT_TIMESTAMP是UTC时间
+            last_modified = datetime.strptime(str(row['modified_at'])[:19], '%Y-%m-%d %H:%M:%S').replace(
+                tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return etag, last_modified
+
+# 判断条件请求是否可以返回304
+def is_not_modified(etag, last_modified):
+    """
+    If-None-Match优先；没有If-None-Match时才看If-Modified-Since，
+    且只用于未登录用户（登录、注销不会改变修改时间）
+    """
+    if '_flashes' in session:
+        # 有待显示的提示消息，必须重新渲染
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified and not check_login():
+        return last_modified <= request.if_modified_since
+    return False
+
+# 写入缓存验证响应头
+def set_validators(response, etag, last_modified):
+    """浏览器可以保存页面，但每次使用前都要带上验证信息重新询问"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
 # 电影详情页路由
 @app.route('/movie/<int:movie_id>')
 def movie_detail(movie_id):
-    """电影详情页面"""
+    """电影详情页面，支持条件请求：内容没有变化时直接返回304，不再查询评分、相似电影和渲染模板"""
+    validators = movie_page_validators(movie_id)
+    if not validators:
+        return "电影不存在", 404
+    if is_not_modified(*validators):
+        return set_validators(make_response('', 304), *validators)
+    
     # 获取电影信息
-    movie = execute_db_query(
-        "SELECT * FROM movies WHERE id = ?", 
-        (movie_id,), 
-        fetch_one=True
-    )
+    movie = get_movie(movie_id)
     
     if not movie:
         return "电影不存在", 404
@@ -470,11 +2540,14 @@ def movie_detail(movie_id):
             fetch_one=True
         )
     
-    return render_template('movie_detail.html', 
+    response = make_response(render_template('movie_detail.html', 
                          movie=movie, 
                          ratings=ratings, 
                          user_rating=user_rating,
-                         user=session)
+                         similar_movies=get_similar_movies(movie_id),
+                         video_info=get_video_info(movie['video_url']),
+                         user=session))
+    return set_validators(response, *validators)
 
 # 评分和评论路由
 @app.route('/rate_movie/<int:movie_id>', methods=['POST'])
@@ -490,76 +2563,71 @@ def rate_movie(movie_id):
         if rating < 1 or rating > 5:
             return redirect(url_for('movie_detail', movie_id=movie_id))
         
-        # 检查是否已经评分过
-        existing_rating = execute_db_query(
-            "SELECT * FROM ratings WHERE user_id = ? AND movie_id = ?",
-            (session['user_id'], movie_id),
-            fetch_one=True
-        )
-        
-        if existing_rating:
-            # 更新现有评分
-            result = execute_db_query(
-                "UPDATE ratings SET rating = ?, review = ? WHERE user_id = ? AND movie_id = ?",
-                (rating, review, session['user_id'], movie_id),
-                commit=True
-            )
-        else:
-            # 添加新评分
-            result = execute_db_query(
-                "INSERT INTO ratings (user_id, movie_id, rating, review) VALUES (?, ?, ?, ?)",
-                (session['user_id'], movie_id, rating, review),
-                commit=True
-            )
-        
-        if result is not None:
-            # 更新电影平均评分
-            execute_db_query(
-                "UPDATE movies SET rating = (SELECT AVG(rating) FROM ratings WHERE movie_id = ?) WHERE id = ?",
-                (movie_id, movie_id),
-                commit=True
-            )
+        result = save_user_rating(session['user_id'], movie_id, rating, review)
+        if result is None:
+            print(f"评分保存失败: 电影 {movie_id}")
         
         return redirect(url_for('movie_detail', movie_id=movie_id))
     except Exception as e:
         print(f"评分操作失败: {e}")
         return redirect(url_for('movie_detail', movie_id=movie_id))
 
+# 保存用户评分
+def save_user_rating(user_id, movie_id, rating, review):
+    """
+    新增或更新用户对电影的评分（单条UPSERT语句、一次提交）
+
+    已评分时ON CONFLICT改为更新，电影的评分聚合字段由触发器在同一事务内刷新，
+    缓存失效记录也在同一事务中写入
+
+    Returns:
+        操作状态，失败时为None
+    """
+    result = execute_db_query(
+        '''INSERT INTO ratings (user_id, movie_id, rating, review) VALUES (?, ?, ?, ?)
+           ON CONFLICT(user_id, movie_id) DO UPDATE SET
+               rating = excluded.rating,
+               review = excluded.review''',
+        (user_id, movie_id, rating, review),
+        commit=True,
+        invalidate_tags=movie_cache_tags(movie_id)
+    )
+    return result
+
 # 分类页面路由
 @app.route('/category/<int:category_id>')
+@cache_anonymous_page
 def category(category_id):
     """按分类显示电影"""
     # 获取分类信息
-    category_info = execute_db_query(
-        "SELECT * FROM categories WHERE id = ?", 
-        (category_id,), 
-        fetch_one=True
-    )
+    category_info = get_category(category_id)
     
     if not category_info:
         return "分类不存在", 404
     
     # 获取该分类下的电影
     movies = execute_db_query(
-        '''SELECT m.* FROM movies m 
-           JOIN movie_categories mc ON m.id = mc.movie_id 
-           WHERE mc.category_id = ? 
-           ORDER BY m.created_at DESC''',
+        '''SELECT m.* FROM movie_categories mc
+           JOIN movies m ON m.id = mc.movie_id
+           WHERE mc.category_id = ?
+           ORDER BY mc.created_at DESC, mc.movie_id DESC''',
         (category_id,),
         fetch_all=True
     )
     
     # 获取所有分类
-    categories = execute_db_query("SELECT * FROM categories", fetch_all=True)
+    categories = get_categories()
     
     return render_template('category.html', 
                          movies=movies, 
                          category=category_info,
                          categories=categories,
+                         posters=get_poster_sources(movies),
                          user=session)
 
 # 搜索功能路由
 @app.route('/search')
+@cache_anonymous_page
 def search():
     """电影搜索功能"""
     query = request.args.get('q', '').strip()
@@ -567,23 +2635,203 @@ def search():
     if not query:
         return redirect(url_for('index'))
     
-    # 执行搜索（标题、导演、类型、描述）
-    search_pattern = f'%{query}%'
-    movies = execute_db_query(
-        "SELECT * FROM movies WHERE title LIKE ? OR director LIKE ? OR genre LIKE ? OR description LIKE ? ORDER BY created_at DESC",
-        (search_pattern, search_pattern, search_pattern, search_pattern),
-        fetch_all=True
-    )
+    # 执行全文搜索（标题、导演、类型、描述）
+    movies = search_movies(query) or []
     
     # 获取所有分类
-    categories = execute_db_query("SELECT * FROM categories", fetch_all=True)
+    categories = get_categories()
     
     return render_template('search.html', 
                          movies=movies, 
                          query=query,
                          categories=categories,
+                         posters=get_poster_sources(movies),
                          user=session)
 
+# 搜索框自动补全接口
+@app.route('/api/suggest')
+def api_suggest():
+    """按前缀返回热门的电影标题/导演，供搜索框输入时提示"""
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('k', SUGGEST_DEFAULT_LIMIT, type=int)
+    limit = max(1, min(limit, SUGGEST_MAX_LIMIT))
+    
+    suggestions = get_suggest_index().suggest(query, limit) if query else []
+    # 索引内部会缓存结果，这里复制后再补充链接
+    suggestions = [dict(item, url=url_for('movie_detail', movie_id=item['id'])) for item in suggestions]
+    
+    return jsonify({'query': query, 'suggestions': suggestions})
+
+# ==============================
+# 分块上传接口（管理员）
+# 1. POST /api/uploads                  {"filename", "size"} -> {"upload_id", "offset", "chunk_size"}
+# 2. PUT  /api/uploads/<id>             请求头Upload-Offset为本块的起始偏移，请求体为原始字节
+#    GET  /api/uploads/<id>             查询已收到的字节数，中断后从这里继续
+# 3. POST /api/uploads/<id>/finalize    全部收到后计算哈希并存入上传目录，返回文件URL
+#    DELETE /api/uploads/<id>           放弃上传
+# ==============================
+
+def upload_error(message, status, **extra):
+    """分块上传接口的错误响应"""
+    return jsonify(dict(extra, error=message)), status
+
+def get_upload_session(upload_id):
+    return execute_db_query("SELECT * FROM upload_sessions WHERE id = ?", (upload_id,), fetch_one=True)
+
+def upload_session_json(upload):
+    return {'upload_id': upload['id'], 'offset': upload['received'], 'size': upload['size'],
+            'chunk_size': UPLOAD_CHUNK_SIZE}
+
+def discard_upload_session(upload_id):
+    """删除上传会话及其临时文件"""
+    execute_db_query("DELETE FROM upload_sessions WHERE id = ?", (upload_id,), commit=True)
+    path = partial_upload_path(app.config['UPLOAD_FOLDER'], upload_id)
+    if os.path.exists(path):
+        os.remove(path)
+
+def expire_upload_sessions():
+    """
+    清理超过UPLOAD_SESSION_TTL没有收到数据的未完成上传会话（已完成的由后台任务处理后删除），
+    以及入库任务已经结束的结果记录文件（见media_jobs.ingest_upload）
+    """
+    expired = execute_db_query(
+        "SELECT id FROM upload_sessions WHERE updated_at < datetime('now', ?) AND completed_at IS NULL",
+        (f'-{UPLOAD_SESSION_TTL} seconds',),
+        fetch_all=True
+    ) or []
+    for upload in expired:
+        discard_upload_session(upload['id'])
+    
+    folder = app.config['UPLOAD_FOLDER']
+    if os.path.isdir(folder):
+        rows = execute_db_query(
+            "SELECT kind, payload FROM jobs WHERE status IN ('queued', 'running')", fetch_all=True) or []
+        # 还会重试的入库任务要用到自己的记录
+        pending = {os.path.abspath(ingest_receipt_path(json.loads(row['payload'])['part_path']))
+                   for row in rows if row['kind'] == 'ingest_upload'}
+        with os.scandir(folder) as entries:
+            receipts = [entry.path for entry in entries
+                        if entry.name.startswith('.upload-') and entry.name.endswith(INGEST_RECEIPT_SUFFIX)]
+        for path in receipts:
+            if os.path.abspath(path) not in pending:
+                os.remove(path)
+    return len(expired)
+
+@app.route('/api/uploads', methods=['POST'])
+def api_upload_create():
+    """创建分块上传会话"""
+    if not check_login() or not check_admin():
+        return upload_error('需要管理员权限', 403)
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get('filename') or '')
+    size = data.get('size')
+    if not allowed_video_file(filename):
+        return upload_error('不支持的视频格式', 400)
+    if not isinstance(size, int) or size <= 0 or size > CHUNKED_UPLOAD_MAX_SIZE:
+        return upload_error('文件大小无效', 400)
+    
+    expire_upload_sessions()
+    upload_id = uuid.uuid4().hex
+    folder = app.config['UPLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    open(partial_upload_path(folder, upload_id), 'wb').close()
+    execute_db_query(
+        "INSERT INTO upload_sessions (id, filename, extension, size, user_id) VALUES (?, ?, ?, ?, ?)",
+        (upload_id, filename[:255], filename.rsplit('.', 1)[1].lower(), size, session['user_id']),
+        commit=True
+    )
+    print(f"创建分块上传: {upload_id} {filename} ({size} 字节)")
+    return jsonify(upload_session_json(get_upload_session(upload_id))), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def api_upload_status(upload_id):
+    """查询上传进度（断点续传时先调用）"""
+    if not check_login() or not check_admin():
+        return upload_error('需要管理员权限', 403)
+    upload = get_upload_session(upload_id)
+    if not upload:
+        return upload_error('上传会话不存在或已过期', 404)
+    return jsonify(upload_session_json(upload))
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def api_upload_chunk(upload_id):
+    """
+    写入一块数据
+    
+    请求体直接从WSGI输入流按1MB读取并写入临时文件的对应位置，不经过表单解析，内存占用与分块大小无关。
+    Upload-Offset必须等于已收到的字节数，否则返回409和正确的偏移量。
+    """
+    if not check_login() or not check_admin():
+        return upload_error('需要管理员权限', 403)
+    upload = get_upload_session(upload_id)
+    if not upload:
+        return upload_error('上传会话不存在或已过期', 404)
+    offset = request.headers.get('Upload-Offset', type=int)
+    length = request.content_length
+    if offset != upload['received']:
+        return upload_error('偏移量与已收到的数据不一致', 409, offset=upload['received'])
+    if length is None or length <= 0 or length > UPLOAD_CHUNK_MAX:
+        return upload_error(f'每块大小需在1到{UPLOAD_CHUNK_MAX}字节之间', 400, offset=offset)
+    if offset + length > upload['size']:
+        return upload_error('数据超出声明的文件大小', 400, offset=offset)
+    
+    path = partial_upload_path(app.config['UPLOAD_FOLDER'], upload_id)
+    written, error = write_chunk(path, offset, request.stream, length)
+    # 条件更新：同一会话的并发请求只有一个能推进偏移量；中途断开时已写入的部分同样记录下来
+    conn = get_db_connection()
+    try:
+        with conn:
+            updated = conn.execute(
+                '''UPDATE upload_sessions SET received = ?, updated_at = CURRENT_TIMESTAMP
+                   WHERE id = ? AND received = ?''',
+                (offset + written, upload_id, offset)
+            ).rowcount
+    finally:
+        release_db_connection(conn)
+    if error is not None or written < length:
+        print(f"分块上传中断: {upload_id} 偏移 {offset} 已写入 {written}/{length} 字节 {error or ''}")
+        return upload_error('数据不完整，请从offset处继续上传', 400, offset=offset + written)
+    if not updated:
+        upload = get_upload_session(upload_id)
+        return upload_error('偏移量与已收到的数据不一致', 409, offset=upload['received'] if upload else 0)
+    return jsonify({'upload_id': upload_id, 'offset': offset + written, 'size': upload['size']})
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def api_upload_finalize(upload_id):
+    """
+    确认全部数据已收到，返回的upload_id随电影表单提交
+    
+    计算哈希、移入内容寻址存储等耗时处理在电影保存后由后台任务完成，这里立即返回
+    """
+    if not check_login() or not check_admin():
+        return upload_error('需要管理员权限', 403)
+    upload = get_upload_session(upload_id)
+    if not upload:
+        return upload_error('上传会话不存在或已过期', 404)
+    if upload['received'] != upload['size']:
+        return upload_error('文件尚未上传完成', 409, offset=upload['received'])
+    
+    path = partial_upload_path(app.config['UPLOAD_FOLDER'], upload_id)
+    # 临时文件可能残留中断请求多写的字节，按声明的大小截断
+    os.truncate(path, upload['size'])
+    execute_db_query(
+        "UPDATE upload_sessions SET completed_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (upload_id,),
+        commit=True
+    )
+    print(f"分块上传完成: {upload['filename']} ({upload['size']} 字节)")
+    return jsonify({'upload_id': upload_id, 'size': upload['size'], 'completed': True})
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def api_upload_cancel(upload_id):
+    """放弃上传，删除临时文件"""
+    if not check_login() or not check_admin():
+        return upload_error('需要管理员权限', 403)
+    if not get_upload_session(upload_id):
+        return upload_error('上传会话不存在或已过期', 404)
+    discard_upload_session(upload_id)
+    return '', 204
+
 # ==============================
 # 管理员功能路由
 # ==============================
@@ -607,6 +2855,22 @@ def admin_panel():
                          users=users,
                          user=session)
 
+# 运行指标接口
+@app.route('/admin/api/metrics')
+def admin_metrics():
+    """管理员查看运行指标：连接池、密码哈希进程池（队列深度、拒绝次数）、查询缓存、页面缓存、片段缓存命中率和后台任务"""
+    if not check_login() or not check_admin():
+        return jsonify({'error': '权限不足'}), 403
+    return jsonify({
+        'db_pool': db_pool.stats(),
+        'password_hashing': password_hasher.stats(),
+        'query_cache': query_cache.stats(),
+        'page_cache': page_cache.stats(),
+        'fragment_cache': fragment_cache.stats(),
+        'cache_bus': cache_bus.stats(),
+        'jobs': get_job_counts(),
+    })
+
 # 管理员添加电影路由
 @app.route('/admin/add_movie', methods=['GET', 'POST'])
 def admin_add_movie():
@@ -666,12 +2930,16 @@ def admin_add_movie():
                     print(f"视频文件已上传: {uploaded_video_path}")
                 else:
                     print("视频文件上传失败")
+        chunked_upload = None
+        if not uploaded_video_path:
+            # 页面已通过分块上传接口上传了视频，表单只提交上传ID，文件由后台任务处理
+            chunked_upload = claim_chunked_upload(request.form.get('video_upload_id'))
         
         # 简单验证
         if not title or not director or not year or not genre or not description:
             error_msg = '所有字段都是必填的'
             print(f"验证失败: {error_msg}")
-            categories_list = execute_db_query("SELECT * FROM categories", fetch_all=True)
+            categories_list = get_categories()
             return render_template('admin_add_movie.html', 
                                      categories=categories_list, 
                                      user=session, 
@@ -704,6 +2972,9 @@ def admin_add_movie():
                 final_video_url = f'/{uploaded_video_path}'
                 video_type = 'upload'
                 print(f"使用上传的视频文件: {final_video_url}")
+            # 分块上传的视频：后台任务处理完成后再写入video_url
+            elif chunked_upload:
+                print(f"视频等待后台处理: {chunked_upload['filename']}")
             # 如果有视频URL，则使用URL
             elif video_url:
                 final_video_url = video_url
@@ -721,7 +2992,7 @@ def admin_add_movie():
             if not movie_id:
                 error_msg = '添加电影失败，请重试'
                 print(f"插入失败: {error_msg}")
-                categories_list = execute_db_query("SELECT * FROM categories", fetch_all=True)
+                categories_list = get_categories()
                 return render_template('admin_add_movie.html', 
                                      categories=categories_list, 
                                      user=session, 
@@ -738,20 +3009,22 @@ def admin_add_movie():
                     )
                     print(f"分类关联插入结果: {result}")
             
+            enqueue_upload_jobs(movie_id, [uploaded_image_path, uploaded_video_path], chunked_upload)
+            on_movie_changed(movie_id)
             return redirect(url_for('admin_panel'))
         except Exception as e:
             error_msg = f'添加电影失败: {str(e)}'
             print(f"异常: {error_msg}")
             import traceback
             traceback.print_exc()
-            categories_list = execute_db_query("SELECT * FROM categories", fetch_all=True)
+            categories_list = get_categories()
             return render_template('admin_add_movie.html', 
                                  categories=categories_list, 
                                  user=session, 
                                  error=error_msg)
     
     # 获取所有分类
-    categories = execute_db_query("SELECT * FROM categories", fetch_all=True)
+    categories = get_categories()
     
     return render_template('admin_add_movie.html', categories=categories, user=session)
 
@@ -764,11 +3037,7 @@ def admin_edit_movie(movie_id):
         return redirect(url_for('login'))
     
     # 获取电影信息
-    movie = execute_db_query(
-        "SELECT * FROM movies WHERE id = ?", 
-        (movie_id,), 
-        fetch_one=True
-    )
+    movie = get_movie(movie_id)
     
     if not movie:
         return "电影不存在", 404
@@ -781,7 +3050,7 @@ def admin_edit_movie(movie_id):
     )
     
     # 获取所有分类
-    categories = execute_db_query("SELECT * FROM categories", fetch_all=True)
+    categories = get_categories()
     
     # 将电影的分类ID转换为列表
     selected_categories = [cat['category_id'] for cat in movie_categories]
@@ -801,11 +3070,7 @@ def admin_edit_movie_submit(movie_id):
         return redirect(url_for('login'))
     
     # 检查电影是否存在
-    existing_movie = execute_db_query(
-        "SELECT * FROM movies WHERE id = ?", 
-        (movie_id,), 
-        fetch_one=True
-    )
+    existing_movie = get_movie(movie_id)
     
     if not existing_movie:
         return "电影不存在", 404
@@ -846,6 +3111,10 @@ def admin_edit_movie_submit(movie_id):
                     print(f"视频文件已上传: {uploaded_video_path}")
                 else:
                     print("视频文件上传失败")
+        chunked_upload = None
+        if not uploaded_video_path:
+            # 页面已通过分块上传接口上传了视频，表单只提交上传ID，文件由后台任务处理
+            chunked_upload = claim_chunked_upload(request.form.get('video_upload_id'))
         
         # 简单验证
         if not title or not director or not year or not genre or not description:
@@ -853,17 +3122,13 @@ def admin_edit_movie_submit(movie_id):
             print(f"验证失败: {error_msg}")
             
             # 重新获取数据用于渲染模板
-            movie = execute_db_query(
-                "SELECT * FROM movies WHERE id = ?", 
-                (movie_id,), 
-                fetch_one=True
-            )
+            movie = get_movie(movie_id)
             movie_categories = execute_db_query(
                 "SELECT category_id FROM movie_categories WHERE movie_id = ?",
                 (movie_id,),
                 fetch_all=True
             )
-            categories_list = execute_db_query("SELECT * FROM categories", fetch_all=True)
+            categories_list = get_categories()
             selected_categories = [cat['category_id'] for cat in movie_categories]
             
             return render_template('admin_edit_movie.html', 
@@ -896,6 +3161,9 @@ def admin_edit_movie_submit(movie_id):
                 final_video_url = f'/{uploaded_video_path}'
                 video_type = 'upload'
                 print(f"使用上传的视频文件: {final_video_url}")
+            # 分块上传的视频：处理完成前继续播放原视频
+            elif chunked_upload:
+                print(f"视频等待后台处理: {chunked_upload['filename']}")
             # 如果有视频URL，则使用URL
             elif video_url:
                 final_video_url = video_url
@@ -919,17 +3187,13 @@ def admin_edit_movie_submit(movie_id):
                 print(f"更新失败: {error_msg}")
                 
                 # 重新获取数据用于渲染模板
-                movie = execute_db_query(
-                    "SELECT * FROM movies WHERE id = ?", 
-                    (movie_id,), 
-                    fetch_one=True
-                )
+                movie = get_movie(movie_id)
                 movie_categories = execute_db_query(
                     "SELECT category_id FROM movie_categories WHERE movie_id = ?",
                     (movie_id,),
                     fetch_all=True
                 )
-                categories_list = execute_db_query("SELECT * FROM categories", fetch_all=True)
+                categories_list = get_categories()
                 selected_categories = [cat['category_id'] for cat in movie_categories]
                 
                 return render_template('admin_edit_movie.html', 
@@ -951,6 +3215,8 @@ def admin_edit_movie_submit(movie_id):
                         commit=True
                     )
             
+            enqueue_upload_jobs(movie_id, [uploaded_image_path, uploaded_video_path], chunked_upload)
+            on_movie_changed(movie_id)
             return redirect(url_for('admin_panel'))
         except Exception as e:
             error_msg = f'更新电影失败: {str(e)}'
@@ -959,17 +3225,13 @@ def admin_edit_movie_submit(movie_id):
             traceback.print_exc()
             
             # 重新获取数据用于渲染模板
-            movie = execute_db_query(
-                "SELECT * FROM movies WHERE id = ?", 
-                (movie_id,), 
-                fetch_one=True
-            )
+            movie = get_movie(movie_id)
             movie_categories = execute_db_query(
                 "SELECT category_id FROM movie_categories WHERE movie_id = ?",
                 (movie_id,),
                 fetch_all=True
             )
-            categories_list = execute_db_query("SELECT * FROM categories", fetch_all=True)
+            categories_list = get_categories()
             selected_categories = [cat['category_id'] for cat in movie_categories]
             
             return render_template('admin_edit_movie.html', 
@@ -997,6 +3259,7 @@ def admin_delete_movie(movie_id):
         
         if result:
             print(f"电影 {movie_id} 删除成功")
+            on_movie_changed(movie_id)
         else:
             print(f"电影 {movie_id} 删除失败")
         
@@ -1089,7 +3352,8 @@ def admin_delete_user(user_id):
                 return jsonify({'success': False, 'message': '不能删除最后一个管理员'})
         
         # 删除用户相关的数据（评分）
-        execute_db_query("DELETE FROM ratings WHERE user_id = ?", (user_id,), commit=True)
+        execute_db_query("DELETE FROM ratings WHERE user_id = ?", (user_id,), commit=True,
+                         invalidate_tags=['movies'])
         
         # 删除用户
         result = execute_db_query("DELETE FROM users WHERE id = ?", (user_id,), commit=True)
@@ -1105,10 +3369,24 @@ def admin_delete_user(user_id):
         return jsonify({'success': False, 'message': '服务器错误'})
 
 # 添加访问上传文件的静态路由
-@app.route('/uploads/<filename>')
+@app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    """提供上传文件的静态访问"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """
+    提供上传文件的静态访问，支持视频拖动播放所需的Range请求（206 Partial Content）
+    
+    文件在分散目录中（ab/cd/文件名，缩略图在derived/下）；迁移前的旧URL（/uploads/文件名）
+    在平铺文件已经移走后按分散目录查找
+    """
+    # 以"."开头的是上传中的临时文件和隔离目录，不对外提供
+    if any(part.startswith('.') for part in filename.split('/')):
+        abort(404)
+    folder = app.config['UPLOAD_FOLDER']
+    if '/' not in filename and not os.path.isfile(os.path.join(folder, filename)):
+        filename = fanout_path(filename)
+    response = send_file_ranges(folder, filename)
+    if response.status_code in (200, 206, 304):
+        response.headers['Cache-Control'] = UPLOAD_CACHE_CONTROL
+    return response
 
 # 个人中心路由
 @app.route('/profile')
@@ -1197,8 +3475,8 @@ def update_profile():
             if len(new_password) < 6:
                 return redirect(url_for('profile'))
             
-            # 加密新密码
-            hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+            # 加密新密码（在密码哈希进程池中计算）
+            hashed_password = password_hasher.hash_password(new_password)
             execute_db_query(
                 "UPDATE users SET password = ? WHERE id = ?",
                 (hashed_password, user_id),
@@ -1214,6 +3492,11 @@ def update_profile():
                              highest_rated_movie={},
                              user=session)
     
+    except HashingBusy as e:
+        print(f"更新密码被拒绝: {e}")
+        return busy_response('profile.html', user_info=execute_db_query(
+            "SELECT * FROM users WHERE id = ?", (user_id,), fetch_one=True),
+            ratings=[], reviews=[], avg_rating=0, highest_rated_movie={}, user=session)
     except Exception as e:
         print(f"更新个人信息失败: {e}")
         return redirect(url_for('profile'))
@@ -1237,18 +3520,10 @@ def delete_rating(rating_id):
     if not rating:
         return redirect(url_for('profile'))
     
-    movie_id = rating['movie_id']
-    
     try:
-        # 删除评分
-        execute_db_query("DELETE FROM ratings WHERE id = ?", (rating_id,), commit=True)
-        
-        # 重新计算该电影的平均评分
-        execute_db_query(
-            "UPDATE movies SET rating = COALESCE((SELECT AVG(rating) FROM ratings WHERE movie_id = ?), 0.0) WHERE id = ?",
-            (movie_id, movie_id),
-            commit=True
-        )
+        # 删除评分（触发器会同步更新该电影的平均评分）
+        execute_db_query("DELETE FROM ratings WHERE id = ?", (rating_id,), commit=True,
+                         invalidate_tags=movie_cache_tags(rating['movie_id']))
         
         return redirect(url_for('profile'))
     except Exception as e:
@@ -1260,7 +3535,7 @@ def delete_rating(rating_id):
 def too_large(e):
     """处理文件上传大小超限的错误"""
     error_msg = '上传的文件太大，请选择小于5MB的图片文件'
-    categories = execute_db_query("SELECT * FROM categories", fetch_all=True)
+    categories = get_categories()
     return render_template('admin_add_movie.html', 
                          categories=categories, 
                          user=session, 
@@ -1274,6 +3549,9 @@ if __name__ == '__main__':
         print("访问 http://127.0.0.1:5000 使用应用")
         print("管理员账号: admin")
         print("管理员密码: admin123")
+        # 开发环境在后台线程中运行任务worker（debug模式下只在重载后的子进程中启动）；生产环境请单独运行 python manage.py worker
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            threading.Thread(target=make_job_worker().run, daemon=True).start()
         app.run(debug=True, host='127.0.0.1', port=5000)
     else:
         print("数据库初始化失败，无法启动应用")
\ No newline at end of file
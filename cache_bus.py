@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 跨进程的缓存失效通知
+
+多个worker进程各有一份进程内缓存（query_cache.py等），管理员在一个进程中修改电影后，
+其他进程的缓存也要失效。这里不依赖外部消息服务，直接用数据库中的cache_invalidations表
+（表结构由app.setup_database创建）：
+
+- 发布：修改数据的一方插入失效标签（可以与业务数据在同一事务中提交）
+- 订阅：每个进程记住读到的最大id，请求开始时每隔poll_interval秒查一次 id > 上次位置 的新记录
+  （按主键范围查询，没有新记录时只读一个索引页），把标签交给订阅的缓存
+- 自己发布的记录也会读到：事务提交后再失效一次，避免提交前被其他请求读到旧数据写回缓存
+
+记录保留retention秒后删除；进程长时间没有读取、错过了已删除的记录时（id不连续），清空所有订阅的缓存。
+"""
+
+import time
+import threading
+
+# 通知记录的保留时间（秒），应大于各缓存的有效期
+CACHE_BUS_RETENTION = 3600
+
+def publish(conn, tags, retention=CACHE_BUS_RETENTION):
+    """
+    发布失效标签（不提交，调用方可以与业务数据在同一事务中提交），顺便删除过期的记录
+    """
+    now = time.time()
+    conn.executemany("INSERT INTO cache_invalidations (tag, created_at) VALUES (?, ?)",
+                     [(tag, now) for tag in tags])
+    conn.execute("DELETE FROM cache_invalidations WHERE created_at < ?", (now - retention,))
+
+class InvalidationBus:
+    """
+    订阅端：定期读取新的失效记录，转交给订阅的缓存
+
+    订阅的缓存需要提供 invalidate(*tags) 和 clear() 方法（如TaggedCache）
+    """
+
+    def __init__(self, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._last_id = None   # None表示还没有读过，下次读取时从当前最大id开始
+        self._last_poll = 0.0
+        self._counters = {'polls': 0, 'events': 0, 'resets': 0}
+
+    def subscribe(self, cache):
+        """订阅失效通知"""
+        self._subscribers.append(cache)
+
+    def invalidate_local(self, *tags):
+        """让本进程订阅的缓存立即失效（发布方不必等到下次读取）"""
+        for cache in self._subscribers:
+            cache.invalidate(*tags)
+
+    def reset(self):
+        """切换数据库后调用：下次读取时重新定位"""
+        with self._lock:
+            self._last_id = None
+            self._last_poll = 0.0
+
+    def poll(self, connect, force=False):
+        """
+        读取新的失效记录并通知订阅者（距上次读取不足poll_interval秒时直接返回）
+
+        Args:
+            connect: 返回数据库连接的函数，确实需要读取时才调用，大部分请求不占用连接
+
+        Returns:
+            本次处理的记录数
+        """
+        now = time.monotonic()
+        if not force and now - self._last_poll < self.poll_interval:
+            return 0
+        # 只让一个线程去读，其他请求线程不等待
+        if not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            self._last_poll = now
+            conn = connect()
+            self._counters['polls'] += 1
+            if self._last_id is None:
+                # 进程刚启动（缓存还是空的），之前的记录不需要处理
+                # sqlite_sequence记录AUTOINCREMENT发过的最大id（旧记录都删除后表可能是空的）
+                row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'cache_invalidations'").fetchone()
+                self._last_id = row[0] if row else 0
+                return 0
+            rows = conn.execute(
+                "SELECT id, tag FROM cache_invalidations WHERE id > ? ORDER BY id", (self._last_id,)
+            ).fetchall()
+            if not rows:
+                return 0
+            if rows[0][0] != self._last_id + 1:
+                # 中间的记录已经被删除，不知道错过了哪些标签
+                self._counters['resets'] += 1
+                for cache in self._subscribers:
+                    cache.clear()
+            else:
+                self.invalidate_local(*dict.fromkeys(tag for _, tag in rows))
+            self._last_id = rows[-1][0]
+            self._counters['events'] += len(rows)
+            return len(rows)
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """订阅端状态，便于监控"""
+        return dict(self._counters, last_id=self._last_id, subscribers=len(self._subscribers))
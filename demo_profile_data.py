@@ -66,13 +66,7 @@ def add_test_ratings():
                     print(f"    评论: {review[:30]}...")
                 added_count += 1
     
-    # 更新电影的平均评分
-    for movie in movies:
-        execute_db_query(
-            "UPDATE movies SET rating = (SELECT AVG(rating) FROM ratings WHERE movie_id = ?) WHERE id = ?",
-            (movie['id'], movie['id']),
-            commit=True
-        )
+    # 电影的平均评分由ratings表上的触发器自动更新
     
     print(f"\n成功添加 {added_count} 条评分记录")
     print("现在可以登录admin账户查看个人中心的完整功能了！")
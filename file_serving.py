@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 上传文件的分段下载（HTTP Range）
+
+视频播放器拖动进度条、断点续播时会发送Range请求，只需要返回请求的字节区间（206 Partial Content）：
+- 单个区间、条件请求（ETag / If-None-Match / If-Range）交给Werkzeug的send_file处理；
+  完整文件响应使用WSGI服务器的wsgi.file_wrapper（gunicorn等会用sendfile零拷贝发送），
+  开启USE_X_SENDFILE时由前端的Apache/lighttpd直接发送文件，Python worker不读取文件内容
+- 多个区间（Range: bytes=0-99,500-599）时返回multipart/byteranges，按块流式读取，
+  重叠或相邻的区间先合并
+"""
+
+import os
+import uuid
+import mimetypes
+from email.utils import formatdate
+
+from flask import Response, request, send_file, current_app
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+# 一次请求最多处理的区间数，超过时忽略Range返回完整文件，避免大量小区间拖慢worker
+MAX_RANGES = 16
+# 流式发送multipart响应时每次读取的字节数
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def file_etag(stat):
+    """由修改时间和文件大小生成强ETag，单区间和多区间响应使用同一个值"""
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+def parse_byte_ranges(header):
+    """
+    解析Range请求头
+
+    Werkzeug的parse_range_header会拒绝重叠的区间，而RFC 7233允许重叠（服务器可以合并），这里自己解析。
+
+    Returns:
+        [(start, stop)]，stop不含且可能为None（到文件末尾），后缀区间的start为负数；格式错误时返回None
+    """
+    units, _, spec = (header or '').partition('=')
+    if units.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    ranges = []
+    for item in spec.split(','):
+        first, dash, last = item.strip().partition('-')
+        if not dash:
+            return None
+        if not first:
+            if not last.isdigit():
+                return None
+            # bytes=-0 无法满足，用空区间表示
+            ranges.append((-int(last), None) if int(last) else (0, 0))
+        else:
+            if not first.isdigit() or (last and not last.isdigit()):
+                return None
+            if last and int(last) < int(first):
+                return None
+            ranges.append((int(first), int(last) + 1 if last else None))
+    return ranges
+
+def _resolve_ranges(ranges, size):
+    """
+    把Range头中的区间换算成[start, stop)，丢弃无法满足的区间，合并重叠和相邻的区间
+
+    Returns:
+        排好序的[(start, stop)]；全部无法满足时为空列表
+    """
+    resolved = []
+    for start, stop in ranges:
+        if start < 0:
+            # 后缀区间：bytes=-500 表示最后500字节
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            resolved.append((start, stop))
+    resolved.sort()
+    merged = []
+    for start, stop in resolved:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+def _if_range_matches(etag, mtime):
+    """If-Range条件：没有该请求头，或者ETag/日期与当前文件一致时才按区间返回"""
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        # HTTP日期精确到秒：必须与Last-Modified完全相同，更晚的日期不能证明文件没有变化
+        return int(mtime) == int(if_range.date.timestamp())
+    return True
+
+def _multipart_response(path, ranges, size, mimetype, etag, mtime):
+    """返回multipart/byteranges响应，各区间按块流式读取"""
+    boundary = uuid.uuid4().hex
+    headers = [
+        (f'--{boundary}\r\n'
+         f'Content-Type: {mimetype}\r\n'
+         f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode('ascii')
+        for start, stop in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode('ascii')
+    length = sum(len(header) + stop - start for header, (start, stop) in zip(headers, ranges))
+    length += 2 * (len(ranges) - 1) + len(closing)
+
+    def generate():
+        with open(path, 'rb') as f:
+            for i, (header, (start, stop)) in enumerate(zip(headers, ranges)):
+                yield (b'\r\n' + header) if i else header
+                f.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        return
+                    remaining -= len(chunk)
+                    yield chunk
+        yield closing
+
+    response = Response(generate(), status=206, mimetype=f'multipart/byteranges; boundary={boundary}')
+    response.headers['Content-Length'] = str(length)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['ETag'] = f'"{etag}"'
+    response.headers['Last-Modified'] = formatdate(mtime, usegmt=True)
+    return response
+
+def send_file_ranges(directory, filename):
+    """
+    发送directory下的文件，支持单区间/多区间Range请求和条件请求
+
+    Raises:
+        NotFound: 文件不存在或路径越出directory
+    """
+    path = safe_join(os.path.abspath(directory), filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+    stat = os.stat(path)
+    etag = file_etag(stat)
+
+    header = request.environ.get('HTTP_RANGE')
+    ranges = parse_byte_ranges(header) if header else None
+    if header and (ranges is None or len(ranges) > MAX_RANGES):
+        # 无法解析或区间过多：按RFC 7233忽略Range头，返回完整文件
+        request.environ.pop('HTTP_RANGE')
+    elif ranges and len(ranges) > 1:
+        if (not current_app.config.get('USE_X_SENDFILE')
+                and not request.if_none_match.contains(etag) and _if_range_matches(etag, stat.st_mtime)):
+            ranges = _resolve_ranges(ranges, stat.st_size)
+            if not ranges:
+                response = Response(status=416)
+                response.headers['Content-Range'] = f'bytes */{stat.st_size}'
+                return response
+            if len(ranges) > 1:
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                return _multipart_response(path, ranges, stat.st_size, mimetype, etag, stat.st_mtime)
+            # 合并后只剩一个区间：改写Range头，交给send_file按单区间处理
+            start, stop = ranges[0]
+            request.environ['HTTP_RANGE'] = f'bytes={start}-{stop - 1}'
+        else:
+            # send_file不支持多区间，去掉Range头返回完整文件（或304）
+            request.environ.pop('HTTP_RANGE')
+
+    # 单区间、无Range请求和条件请求由send_file处理
+    response = send_file(path, etag=etag, conditional=True)
+    # 完整文件响应也声明支持Range，播放器据此决定能否拖动进度条
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - Jinja模板片段缓存
+
+首页、分类页、搜索页的电影卡片（海报、星级、简介）对所有用户都一样，只随电影本身变化。
+{% cache %} 标签把渲染好的片段保存在缓存中，下次直接输出：
+
+    {% cache movie.id, movie.version tags 'movie:' ~ movie.id %}
+        ...卡片内容...
+    {% endcache %}
+
+- 键：标签后的表达式（可以是多个，用逗号分隔），再加上模板名和行号，不同位置的片段互不冲突；
+  不同页面通过同一个宏（如movie_card.html）渲染时共享缓存
+- tags（可选）：失效标签，字符串或字符串列表，数据修改后 cache.invalidate(标签) 删除相关片段
+- 缓存对象由 environment.fragment_cache 指定（需要提供TaggedCache的get/set/generation接口），
+  为None时直接渲染
+
+片段内容只能依赖键中的值，不能依赖当前用户等请求状态。
+"""
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+_MISSING = object()
+
+class FragmentCacheExtension(Extension):
+    """{% cache 键 [tags 标签] %}...{% endcache %}"""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = parser.parse_tuple(extra_end_rules=('name:tags',))
+        if parser.stream.skip_if('name:tags'):
+            cache_tags = parser.parse_expression()
+        else:
+            cache_tags = nodes.Const(())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        location = nodes.Const((parser.name, lineno))
+        return nodes.CallBlock(
+            self.call_method('_cache_support', [location, key, cache_tags]), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache_support(self, location, key, cache_tags, caller):
+        """查找片段，没有时渲染并保存"""
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = ('fragment', location) + (key if isinstance(key, tuple) else (key,))
+        rv = cache.get(key, _MISSING)
+        if rv is not _MISSING:
+            return rv
+        # 与查询缓存相同：渲染期间发生过失效时不保存
+        generation = cache.generation
+        rv = caller()
+        if isinstance(cache_tags, str):
+            cache_tags = (cache_tags,)
+        cache.set(key, rv, tags=tuple(cache_tags), generation=generation)
+        return rv
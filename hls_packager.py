@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 把上传的MP4打包成HLS（fMP4分片），不转码
+
+读取MP4的样本表（stts/ctts/stsz/stsc/stco/stss），在视频关键帧处按目标时长切分，
+原样复制压缩后的音视频数据，写出：
+- init.mp4：ftyp + moov（保留原来的stsd编码参数，样本表为空，加上mvex）
+- seg00000.m4s …：每个分片一个moof + mdat，音视频在同一个分片中
+- index.m3u8：点播播放列表（EXT-X-MAP引用init.mp4）
+
+分片都是不会再修改的小文件，可以由浏览器和CDN长期缓存；拖动进度条时只需要下载对应的几个分片，
+不必对整个大文件发Range请求。
+"""
+
+import os
+import math
+import mmap
+import uuid
+import shutil
+import struct
+import bisect
+
+from mp4_meta import iter_boxes, find_box
+
+# 每个分片的目标时长（秒）；只能在关键帧处切分，实际时长可能更长
+HLS_SEGMENT_DURATION = 6.0
+HLS_PLAYLIST_NAME = 'index.m3u8'
+HLS_INIT_NAME = 'init.mp4'
+
+# trun中样本的sample_flags：关键帧 / 依赖其他帧的非关键帧
+SYNC_SAMPLE_FLAGS = 0x02000000
+NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+def _box(box_type, *payload):
+    """组装一个box"""
+    data = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(data), box_type) + data
+
+def _full_box(box_type, version, flags, *payload):
+    """组装一个带version/flags的box"""
+    return _box(box_type, struct.pack('>I', (version << 24) | flags), *payload)
+
+def _array(buf, offset, count, item='I'):
+    """一次读出count个大端整数"""
+    return struct.unpack_from(f'>{count}{item}', buf, offset) if count else ()
+
+class Track:
+    """一个轨道的编码参数和样本表（样本按解码顺序排列）"""
+
+    def __init__(self, buf, start, end):
+        self.start, self.end = start, end
+        tkhd = find_box(buf, start, end, [b'tkhd'])
+        mdhd = find_box(buf, start, end, [b'mdia', b'mdhd'])
+        hdlr = find_box(buf, start, end, [b'mdia', b'hdlr'])
+        stbl = find_box(buf, start, end, [b'mdia', b'minf', b'stbl'])
+        if not (tkhd and mdhd and hdlr and stbl):
+            raise ValueError("轨道缺少tkhd/mdhd/hdlr/stbl")
+        self.track_id = struct.unpack_from('>I', buf, tkhd[0] + (20 if buf[tkhd[0]] == 1 else 12))[0]
+        self.timescale = struct.unpack_from('>I', buf, mdhd[0] + (20 if buf[mdhd[0]] == 1 else 12))[0]
+        self.handler = bytes(buf[hdlr[0] + 8:hdlr[0] + 12])
+
+        tables = {box_type: (content, box_end) for box_type, _, content, box_end in iter_boxes(buf, *stbl)}
+        for required in (b'stsd', b'stts', b'stsc', b'stsz'):
+            if required not in tables:
+                raise ValueError(f"样本表缺少{required.decode()}")
+
+        # 每个样本的时长和解码时间
+        content = tables[b'stts'][0]
+        runs = _array(buf, content + 8, 2 * struct.unpack_from('>I', buf, content + 4)[0])
+        self.durations = [delta for count, delta in zip(runs[::2], runs[1::2]) for _ in range(count)]
+        self.decode_times = []
+        time = 0
+        for duration in self.durations:
+            self.decode_times.append(time)
+            time += duration
+
+        # 显示时间偏移（有B帧时才有ctts；version 1为有符号数）
+        self.composition_offsets = None
+        if b'ctts' in tables:
+            content = tables[b'ctts'][0]
+            item = 'i' if buf[content] == 1 else 'I'
+            runs = _array(buf, content + 8, 2 * struct.unpack_from('>I', buf, content + 4)[0], item)
+            self.composition_offsets = [offset for count, offset in zip(runs[::2], runs[1::2]) for _ in range(count)]
+
+        # 样本大小
+        content = tables[b'stsz'][0]
+        sample_size, count = struct.unpack_from('>II', buf, content + 4)
+        self.sizes = list(_array(buf, content + 12, count)) if sample_size == 0 else [sample_size] * count
+
+        # 样本在文件中的偏移：按stsc把样本分到各个chunk，chunk偏移来自stco/co64
+        if b'stco' in tables:
+            content = tables[b'stco'][0]
+            chunk_offsets = _array(buf, content + 8, struct.unpack_from('>I', buf, content + 4)[0])
+        elif b'co64' in tables:
+            content = tables[b'co64'][0]
+            chunk_offsets = _array(buf, content + 8, struct.unpack_from('>I', buf, content + 4)[0], 'Q')
+        else:
+            raise ValueError("样本表缺少stco/co64")
+        content = tables[b'stsc'][0]
+        entries = _array(buf, content + 8, 3 * struct.unpack_from('>I', buf, content + 4)[0])
+        first_chunks = list(entries[::3]) + [len(chunk_offsets) + 1]
+        self.offsets = []
+        for index, samples_per_chunk in enumerate(entries[1::3]):
+            for chunk in range(first_chunks[index], first_chunks[index + 1]):
+                offset = chunk_offsets[chunk - 1]
+                for _ in range(samples_per_chunk):
+                    if len(self.offsets) == len(self.sizes):
+                        break
+                    self.offsets.append(offset)
+                    offset += self.sizes[len(self.offsets) - 1]
+        if not (len(self.durations) == len(self.sizes) == len(self.offsets)):
+            raise ValueError("样本表不一致")
+
+        # 关键帧（没有stss时每个样本都是关键帧）
+        if b'stss' in tables:
+            content = tables[b'stss'][0]
+            numbers = _array(buf, content + 8, struct.unpack_from('>I', buf, content + 4)[0])
+            self.sync = [False] * len(self.sizes)
+            for number in numbers:
+                if 0 < number <= len(self.sync):
+                    self.sync[number - 1] = True
+        else:
+            self.sync = [True] * len(self.sizes)
+
+    def first_sample_at(self, seconds):
+        """解码时间不早于seconds的第一个样本的序号"""
+        return bisect.bisect_left(self.decode_times, seconds * self.timescale)
+
+def _init_segment(buf, moov, tracks):
+    """初始化分片：保留原moov的编码参数，样本表置空，加上mvex"""
+    def rebuild(start, end):
+        children = []
+        for box_type, box_start, content, box_end in iter_boxes(buf, start, end):
+            if box_type == b'udta':
+                continue
+            if box_type == b'trak' and not any(track.start == content for track in tracks):
+                continue
+            if box_type == b'stbl':
+                stsd = find_box(buf, content, box_end, [b'stsd'])
+                children.append(_box(b'stbl',
+                                     _box(b'stsd', buf[stsd[0]:stsd[1]]),
+                                     _full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+                                     _full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+                                     _full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+                                     _full_box(b'stco', 0, 0, struct.pack('>I', 0))))
+            elif box_type in (b'trak', b'mdia', b'minf'):
+                children.append(_box(box_type, rebuild(content, box_end)))
+            else:
+                children.append(bytes(buf[box_start:box_end]))
+        return b''.join(children)
+
+    mvex = _box(b'mvex', *[_full_box(b'trex', 0, 0, struct.pack('>5I', track.track_id, 1, 0, 0, 0))
+                           for track in tracks])
+    ftyp = _box(b'ftyp', b'iso6', struct.pack('>I', 0), b'iso6', b'isom', b'mp41')
+    return ftyp + _box(b'moov', rebuild(*moov), mvex)
+
+def _media_segment(sequence, parts):
+    """
+    一个媒体分片的moof（mdat中的数据由调用方按同样的顺序写出）
+
+    Args:
+        parts: [(Track, 起始样本, 结束样本)]
+    """
+    def build_moof(data_offsets):
+        trafs = []
+        for (track, first, last), data_offset in zip(parts, data_offsets):
+            has_cts = track.composition_offsets is not None
+            flags = 0x000001 | 0x000100 | 0x000200 | 0x000400 | (0x000800 if has_cts else 0)
+            samples = []
+            for index in range(first, last):
+                sample_flags = SYNC_SAMPLE_FLAGS if track.sync[index] else NON_SYNC_SAMPLE_FLAGS
+                samples.append(struct.pack('>III', track.durations[index], track.sizes[index], sample_flags))
+                if has_cts:
+                    samples.append(struct.pack('>i', track.composition_offsets[index]))
+            trafs.append(_box(
+                b'traf',
+                # default-base-is-moof：trun的data_offset相对moof起始位置
+                _full_box(b'tfhd', 0, 0x020000, struct.pack('>I', track.track_id)),
+                _full_box(b'tfdt', 1, 0, struct.pack('>Q', track.decode_times[first] if first < len(track.decode_times) else 0)),
+                _full_box(b'trun', 1 if has_cts else 0, flags, struct.pack('>Ii', last - first, data_offset), *samples),
+            ))
+        return _box(b'moof', _full_box(b'mfhd', 0, 0, struct.pack('>I', sequence)), *trafs)
+
+    # moof的长度与data_offset的取值无关：先算长度，再填入实际偏移
+    moof_size = len(build_moof([0] * len(parts)))
+    data_offsets = []
+    position = moof_size + 8
+    for track, first, last in parts:
+        data_offsets.append(position)
+        position += sum(track.sizes[first:last])
+    return build_moof(data_offsets), position - moof_size - 8
+
+def package_hls(path, output_dir, segment_duration=HLS_SEGMENT_DURATION):
+    """
+    把MP4打包为HLS，写入output_dir（先写同级临时目录，完成后整体替换）
+
+    Returns:
+        {'segments': 分片数, 'duration': 秒, 'size': 总字节数}
+
+    Raises:
+        ValueError: 不是可以打包的MP4（没有moov或音视频轨道）
+    """
+    parent = os.path.dirname(output_dir)
+    os.makedirs(parent, exist_ok=True)
+    temp_dir = os.path.join(parent, f'.hls-{uuid.uuid4().hex}')
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        moov = find_box(buf, 0, len(buf), [b'moov'])
+        if moov is None:
+            raise ValueError(f"没有找到moov: {path}")
+        tracks = [Track(buf, content, box_end) for box_type, _, content, box_end in iter_boxes(buf, *moov)
+                  if box_type == b'trak']
+        tracks = [track for track in tracks if track.handler in (b'vide', b'soun') and track.sizes]
+        if not tracks:
+            raise ValueError(f"没有音视频轨道: {path}")
+        # 以视频轨道（没有时用第一个轨道）的关键帧决定切分位置
+        reference = next((track for track in tracks if track.handler == b'vide'), tracks[0])
+        boundaries = [0.0]
+        for index, decode_time in enumerate(reference.decode_times):
+            seconds = decode_time / reference.timescale
+            if reference.sync[index] and seconds - boundaries[-1] >= segment_duration:
+                boundaries.append(seconds)
+        total = (reference.decode_times[-1] + reference.durations[-1]) / reference.timescale
+        boundaries.append(math.inf)
+
+        os.makedirs(temp_dir)
+        try:
+            size = 0
+            with open(os.path.join(temp_dir, HLS_INIT_NAME), 'wb') as out:
+                size += out.write(_init_segment(buf, moov, tracks))
+            playlist_items = []
+            for number in range(len(boundaries) - 1):
+                parts = [(track, track.first_sample_at(boundaries[number]), track.first_sample_at(boundaries[number + 1]))
+                         for track in tracks]
+                moof, mdat_size = _media_segment(number + 1, parts)
+                name = f'seg{number:05d}.m4s'
+                with open(os.path.join(temp_dir, name), 'wb') as out:
+                    size += out.write(moof)
+                    size += out.write(struct.pack('>I4s', mdat_size + 8, b'mdat'))
+                    for track, first, last in parts:
+                        for index in range(first, last):
+                            offset = track.offsets[index]
+                            size += out.write(buf[offset:offset + track.sizes[index]])
+                end = min(boundaries[number + 1], total)
+                playlist_items.append((end - boundaries[number], name))
+
+            lines = ['#EXTM3U', '#EXT-X-VERSION:7',
+                     f'#EXT-X-TARGETDURATION:{max(1, math.ceil(max(item[0] for item in playlist_items)))}',
+                     '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-INDEPENDENT-SEGMENTS',
+                     f'#EXT-X-MAP:URI="{HLS_INIT_NAME}"']
+            for duration, name in playlist_items:
+                lines += [f'#EXTINF:{duration:.3f},', name]
+            lines.append('#EXT-X-ENDLIST')
+            with open(os.path.join(temp_dir, HLS_PLAYLIST_NAME), 'w', encoding='utf-8') as out:
+                size += out.write('\n'.join(lines) + '\n')
+
+            if os.path.isdir(output_dir):
+                shutil.rmtree(output_dir)
+            os.replace(temp_dir, output_dir)
+        except BaseException:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+    return {'segments': len(playlist_items), 'duration': round(total, 3), 'size': size}
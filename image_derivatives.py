@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 海报缩略图
+
+每张上传的海报生成几种固定宽度的缩略图（AVIF/WebP），保存在上传目录的derived/子目录中，
+页面的海报通过 <picture> + srcset 让浏览器按卡片宽度选择最小的合适文件，原图只作为后备。
+
+上传文件按内容哈希命名（见upload_store.py），缩略图文件名由原图文件名、宽度和格式决定：
+同一张海报只生成一次，被多部电影引用时共用同一组缩略图。
+
+Pillow是可选依赖：未安装时不生成缩略图，页面继续使用原图。
+"""
+
+import os
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+# 缩略图宽度（像素），覆盖网格卡片在手机到宽屏上的1x/2x显示
+POSTER_WIDTHS = (160, 320, 640)
+# 输出格式和编码质量，按优先级排列（<picture>中先列出的格式优先）
+POSTER_FORMATS = (('avif', 'AVIF', 50), ('webp', 'WEBP', 80))
+# 缩略图在上传目录中的子目录
+DERIVED_DIRNAME = 'derived'
+
+def pillow_available():
+    """是否可以生成缩略图"""
+    return Image is not None
+
+def supported_formats():
+    """当前Pillow支持编码的输出格式"""
+    if Image is None:
+        return []
+    return [(name, pil_format, quality) for name, pil_format, quality in POSTER_FORMATS if features.check(name)]
+
+def derivative_filename(source, width, format_name):
+    """缩略图相对路径：原图相对路径（不含扩展名）-宽度w.格式，与原图使用相同的分散目录"""
+    stem = source.rsplit('.', 1)[0]
+    return f'{stem}-{width}w.{format_name}'
+
+def generate_poster_derivatives(path, folder, source=None):
+    """
+    为一张海报生成全部缩略图（已存在的文件直接跳过）
+
+    不会放大图片：原图比某个宽度还窄时，只额外生成一份原始宽度的缩略图
+
+    Args:
+        path: 原图路径
+        folder: 缩略图目录
+        source: 原图在上传目录中的相对路径（默认为文件名）
+
+    Returns:
+        [(宽度, 格式, 相对路径, 文件大小)]
+    """
+    source = source or os.path.basename(path)
+    variants = []
+    with Image.open(path) as image:
+        # 按EXIF方向旋转，并统一转换成编码器都支持的模式
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        widths = sorted({min(width, image.width) for width in POSTER_WIDTHS})
+        for width in widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            for format_name, pil_format, quality in supported_formats():
+                filename = derivative_filename(source, width, format_name)
+                target = os.path.join(folder, filename)
+                if not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    # 先写临时文件再重命名，并发生成或中途退出都不会留下不完整的文件
+                    temp_path = os.path.join(os.path.dirname(target), f'.{os.path.basename(target)}.tmp')
+                    resized.save(temp_path, pil_format, quality=quality)
+                    os.replace(temp_path, target)
+                variants.append((width, format_name, filename, os.path.getsize(target)))
+    return variants
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 持久化后台任务队列
+
+任务保存在SQLite的jobs表中（与业务数据同一个数据库，表结构由app.setup_database创建）。
+Web请求只插入任务就返回；worker（python manage.py worker）循环领取任务，
+把耗时的文件处理（计算哈希、解析视频、生成海报缩略图……）交给进程池执行，
+执行结果再由worker主进程写回数据库——只有一个进程写库，不会与Web请求争抢写锁太久。
+
+任务状态：queued -> running -> done / failed
+- 执行失败时按指数退避重新排队，超过max_attempts次后为failed
+- worker崩溃时running状态的任务在租约（lease_until）到期后重新排队
+
+任务处理器：{任务类型: (run, apply)}
+- run(payload) -> result：在子进程中执行，只做文件处理，不访问数据库；payload和result都必须能JSON序列化
+- apply(conn, job, result)：在worker主进程中执行，与标记完成在同一个事务内写回结果
+"""
+
+import os
+import json
+import time
+import socket
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# 失败重试的退避时间：第n次失败后等待 JOB_RETRY_DELAY * 2^(n-1) 秒
+JOB_RETRY_DELAY = 30
+# 执行中任务的租约时间（秒），超时未完成视为worker已退出
+JOB_LEASE_SECONDS = 1800
+
+def enqueue_job(conn, kind, payload, movie_id=None, max_attempts=3):
+    """
+    插入一个任务（不提交，调用方可以与业务数据在同一事务中提交）
+
+    Returns:
+        任务ID
+    """
+    cursor = conn.execute(
+        "INSERT INTO jobs (kind, payload, movie_id, max_attempts) VALUES (?, ?, ?, ?)",
+        (kind, json.dumps(payload, ensure_ascii=False), movie_id, max_attempts)
+    )
+    return cursor.lastrowid
+
+def requeue_expired_jobs(conn):
+    """把租约已过期的running任务重新排队"""
+    with conn:
+        return conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL "
+            "WHERE status = 'running' AND lease_until < CURRENT_TIMESTAMP"
+        ).rowcount
+
+def claim_job(conn, worker_id, lease_seconds=JOB_LEASE_SECONDS):
+    """
+    领取一个可以执行的任务（单条UPDATE ... RETURNING，多个worker并发领取也不会重复）
+
+    Returns:
+        任务dict（payload已解析）；没有任务时返回None
+    """
+    with conn:
+        row = conn.execute(
+            '''UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                   started_at = CURRENT_TIMESTAMP, lease_until = datetime('now', ?)
+               WHERE id = (SELECT id FROM jobs
+                           WHERE status = 'queued' AND run_after <= CURRENT_TIMESTAMP
+                           ORDER BY run_after LIMIT 1)
+               RETURNING id, kind, payload, movie_id, attempts, max_attempts''',
+            (worker_id, f'+{int(lease_seconds)} seconds')
+        ).fetchone()
+    if row is None:
+        return None
+    job = dict(zip(('id', 'kind', 'payload', 'movie_id', 'attempts', 'max_attempts'), row))
+    job['payload'] = json.loads(job['payload'])
+    return job
+
+def complete_job(conn, job, result):
+    """标记任务完成（不提交）"""
+    conn.execute(
+        "UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (json.dumps(result, ensure_ascii=False), job['id'])
+    )
+
+def fail_job(conn, job, error):
+    """
+    记录任务失败（不提交）：还有重试次数时按退避时间重新排队，否则标记为failed
+
+    Returns:
+        True表示已彻底失败
+    """
+    if job['attempts'] < job['max_attempts']:
+        delay = JOB_RETRY_DELAY * 2 ** (job['attempts'] - 1)
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, error = ?, run_after = datetime('now', ?) WHERE id = ?",
+            (error, f'+{delay} seconds', job['id'])
+        )
+        return False
+    conn.execute(
+        "UPDATE jobs SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+        (error, job['id'])
+    )
+    return True
+
+def job_counts(conn):
+    """各状态的任务数量"""
+    rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status /* advisor: full-scan */").fetchall()
+    return {status: count for status, count in rows}
+
+class JobWorker:
+    """
+    任务执行器：领取任务 -> 进程池执行run -> 主进程执行apply并标记完成
+
+    Args:
+        connect: 返回sqlite3连接的函数（worker主进程使用）
+        handlers: {任务类型: (run, apply)}
+        processes: 进程池大小；0表示在当前进程中直接执行（测试和调试用）
+        after_job: 每个任务完成或彻底失败后调用 after_job(conn, job)，与结果在同一事务中
+        maintenance: 没有任务时每隔maintenance_interval秒调用一次的维护函数（如清理上传目录）
+    """
+
+    def __init__(self, connect, handlers, processes=2, poll_interval=1.0, after_job=None,
+                 lease_seconds=JOB_LEASE_SECONDS, maintenance=None, maintenance_interval=3600):
+        self.connect = connect
+        self.handlers = handlers
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.after_job = after_job
+        self.lease_seconds = lease_seconds
+        self.maintenance = maintenance
+        self.maintenance_interval = maintenance_interval
+        self.last_maintenance = 0.0
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.processed = 0
+        self.failed = 0
+
+    def _finish(self, conn, job, result=None, error=None):
+        """写回一个任务的执行结果"""
+        run, apply = self.handlers[job['kind']]
+        try:
+            with conn:
+                if error is None:
+                    if apply:
+                        apply(conn, job, result)
+                    complete_job(conn, job, result)
+                    finished = True
+                else:
+                    finished = fail_job(conn, job, error)
+                if finished and self.after_job:
+                    self.after_job(conn, job)
+        except Exception:
+            # apply写库失败：按执行失败处理，稍后重试
+            error = traceback.format_exc()
+            with conn:
+                if fail_job(conn, job, error) and self.after_job:
+                    self.after_job(conn, job)
+        if error is None:
+            self.processed += 1
+            print(f"任务完成: #{job['id']} {job['kind']}")
+        else:
+            self.failed += 1
+            print(f"任务失败: #{job['id']} {job['kind']} 第{job['attempts']}次: {error.strip().splitlines()[-1]}")
+
+    def _claim(self, conn):
+        """领取一个任务；遇到没有处理器的任务类型时直接标记失败"""
+        while True:
+            job = claim_job(conn, self.worker_id, self.lease_seconds)
+            if job is None or job['kind'] in self.handlers:
+                return job
+            with conn:
+                job['attempts'] = job['max_attempts']
+                fail_job(conn, job, f"未知的任务类型: {job['kind']}")
+
+    def _idle(self):
+        """空闲时执行到期的维护函数，否则等待一个轮询间隔"""
+        if self.maintenance and time.monotonic() - self.last_maintenance >= self.maintenance_interval:
+            self.last_maintenance = time.monotonic()
+            try:
+                self.maintenance()
+            except Exception:
+                print(f"维护任务失败: {traceback.format_exc().strip().splitlines()[-1]}")
+        else:
+            time.sleep(self.poll_interval)
+
+    def run_pending(self):
+        """在当前进程中依次执行所有可执行的任务（processes=0时使用），返回执行的任务数"""
+        conn = self.connect()
+        count = 0
+        try:
+            requeue_expired_jobs(conn)
+            while True:
+                job = self._claim(conn)
+                if job is None:
+                    return count
+                count += 1
+                run, _ = self.handlers[job['kind']]
+                try:
+                    result = run(job['payload'])
+                except Exception:
+                    self._finish(conn, job, error=traceback.format_exc())
+                else:
+                    self._finish(conn, job, result=result)
+        finally:
+            conn.close()
+
+    def run(self, stop_event=None):
+        """持续运行，直到stop_event被设置（或收到KeyboardInterrupt）"""
+        if self.processes <= 0:
+            while not (stop_event and stop_event.is_set()):
+                if not self.run_pending():
+                    self._idle()
+            return
+
+        conn = self.connect()
+        # spawn方式启动子进程：不继承父进程的数据库连接和线程状态
+        pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+        running = {}
+        last_requeue = 0.0
+        try:
+            while not (stop_event and stop_event.is_set()):
+                if time.monotonic() - last_requeue > 60:
+                    requeue_expired_jobs(conn)
+                    last_requeue = time.monotonic()
+                # 进程池有空闲时继续领取，正在执行的任务数不超过进程数
+                while len(running) < self.processes:
+                    job = self._claim(conn)
+                    if job is None:
+                        break
+                    run, _ = self.handlers[job['kind']]
+                    running[pool.submit(run, job['payload'])] = job
+                if not running:
+                    self._idle()
+                    continue
+                done, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception:
+                        self._finish(conn, job, error=traceback.format_exc())
+                    else:
+                        self._finish(conn, job, result=result)
+        finally:
+            # 未完成的任务留在running状态，租约到期后由其他worker重新领取
+            pool.shutdown(wait=False, cancel_futures=True)
+            conn.close()
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 维护命令
+
+用法：
+    python manage.py index-advisor          检查app.py中的SQL是否出现全表扫描
+    python manage.py ratings-check [--fix]  核对电影评分聚合字段，--fix时重建
+    python manage.py bench-votes [-n 2000]  评分写入吞吐量基准测试（旧路径 vs UPSERT）
+    python manage.py search-rebuild         重建全文搜索索引
+    python manage.py train-als              训练ALS矩阵分解模型，因子保存在数据库旁的.npy文件
+    python manage.py refresh-neighbors      刷新详情页的相似电影表
+    python manage.py uploads-dedup          把旧上传文件迁移到内容寻址存储
+    python manage.py uploads-gc [--dry-run] 回收没有被电影引用的上传文件
+    python manage.py uploads-fanout         把平铺的上传文件迁移到两级分散目录（ab/cd/文件名）
+    python manage.py worker [--once]        运行后台任务worker（处理上传的视频等）
+    python manage.py posters-backfill       为还没有缩略图的海报安排生成任务
+    python manage.py videos-backfill        为还没有元数据的上传视频安排解析任务（moov在末尾时重排）
+    python manage.py hls-package            把已解析的上传视频切分为HLS分片（不转码）
+"""
+
+import os
+import re
+import sys
+import ast
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as movie_app
+
+# ==============================
+# 索引顾问
+# ==============================
+
+# 以这些关键字开头的字符串常量被视为SQL语句
+SQL_PATTERN = re.compile(r'^(SELECT|INSERT|UPDATE|DELETE)\s', re.IGNORECASE)
+
+# 允许全表扫描的表（行数很少且基本不变，扫描比走索引更便宜）
+ADVISOR_ALLOWED_SCANS = {'categories', 'sqlite_master', 'CONSTANT'}
+
+# 有意全表扫描的维护语句（迁移、重建、校验、回填）在SQL末尾加上这个注释，顾问不再报告；
+# 请求路径上的查询不要加，即使带LIMIT也要有索引
+ADVISOR_SCAN_MARKER = '/* advisor: full-scan */'
+
+def collect_sql_strings(path):
+    """
+    从Python源文件中收集所有SQL字符串常量
+
+    Returns:
+        [(行号, SQL语句)]
+    """
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    # f-string中的常量片段不是完整的SQL，跳过
+    fragments = {id(part) for node in ast.walk(tree) if isinstance(node, ast.JoinedStr)
+                 for part in node.values}
+
+    statements = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in fragments:
+            sql = ' '.join(node.value.split())
+            if SQL_PATTERN.match(sql):
+                statements.append((node.lineno, sql))
+    return sorted(statements)
+
+def explain_query_plan(conn, sql):
+    """对SQL执行EXPLAIN QUERY PLAN，参数全部用NULL代替"""
+    params = [None] * sql.count('?')
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def find_plan_issues(sql, plan):
+    """
+    找出查询计划中的问题
+
+    Returns:
+        (全表扫描列表, 临时排序列表)
+    """
+    scans = []
+    sorts = []
+    for detail in plan:
+        match = re.match(r'SCAN (\w+)', detail)
+        # 虚拟表（FTS5）冒号后列出用到的约束，如 "INDEX 0:=" 按rowid查找、"INDEX 0:M..." 按MATCH查找；为空时是全表扫描
+        indexed = 'USING' in detail or re.search(r'VIRTUAL TABLE INDEX \d+:\S', detail)
+        if match and not indexed \
+                and match.group(1) not in ADVISOR_ALLOWED_SCANS and ADVISOR_SCAN_MARKER not in sql:
+            scans.append(detail)
+        elif detail.startswith('USE TEMP B-TREE'):
+            sorts.append(detail)
+    return scans, sorts
+
+def index_advisor(args):
+    """检查源文件中每一条SQL的查询计划"""
+    conn = sqlite3.connect(args.db)
+    # 注册触发器用到的SQL函数，否则写movies表的语句无法分析
+    movie_app.configure_connection(conn)
+    total = 0
+    flagged = 0
+    warned = 0
+
+    for path in args.files:
+        for lineno, sql in collect_sql_strings(path):
+            total += 1
+            try:
+                plan = explain_query_plan(conn, sql)
+            except sqlite3.Error as e:
+                flagged += 1
+                print(f"✗ {path}:{lineno} 无法分析: {e}")
+                print(f"    {sql}")
+                continue
+
+            scans, sorts = find_plan_issues(sql, plan)
+            if scans:
+                flagged += 1
+                print(f"✗ {path}:{lineno} 全表扫描")
+            elif sorts:
+                warned += 1
+                print(f"⚠ {path}:{lineno} 使用临时排序")
+            if scans or sorts:
+                print(f"    {sql}")
+                for detail in scans + sorts:
+                    print(f"    -> {detail}")
+            elif args.verbose:
+                print(f"✓ {path}:{lineno} {'; '.join(plan) or '无需查询计划'}")
+
+    conn.close()
+    print(f"\n共检查 {total} 条SQL，{flagged} 条全表扫描，{warned} 条临时排序")
+    # 出现全表扫描时返回非零退出码，便于在CI中使用
+    return 1 if flagged else 0
+
+# ==============================
+# 评分聚合校验
+# ==============================
+
+def ratings_check(args):
+    """核对movies.rating_sum/rating_count与ratings表是否一致"""
+    mismatches = movie_app.verify_rating_aggregates()
+    if mismatches is None:
+        print("✗ 校验失败，请先运行 python app.py 初始化数据库结构")
+        return 1
+
+    for row in mismatches:
+        print(f"✗ 《{row['title']}》(ID: {row['id']}) "
+              f"记录: {row['rating_sum']}/{row['rating_count']} = {row['rating']}，"
+              f"实际: {row['actual_sum']}/{row['actual_count']}")
+
+    if not mismatches:
+        print("✓ 所有电影的评分聚合字段都与评分表一致")
+        return 0
+
+    print(f"\n共 {len(mismatches)} 部电影不一致")
+    if not args.fix:
+        print("使用 --fix 重建评分聚合字段")
+        return 1
+
+    movie_app.rebuild_rating_aggregates()
+    remaining = movie_app.verify_rating_aggregates()
+    print(f"已重建评分聚合字段，剩余不一致: {len(remaining)}")
+    return 1 if remaining else 0
+
+# ==============================
+# 评分写入基准测试
+# ==============================
+
+def legacy_rate_movie(user_id, movie_id, rating, review):
+    """
+    改造前的评分写入路径：每条语句新开一个连接，
+    先SELECT判断是否评分过，再INSERT/UPDATE并提交，最后用AVG()重算电影评分并再次提交
+    """
+    def run(query, params, fetch_one=False, commit=False):
+        conn = sqlite3.connect(movie_app.DATABASE)
+        try:
+            cursor = conn.execute(query, params)
+            result = cursor.fetchone() if fetch_one else cursor.lastrowid
+            if commit:
+                conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    existing = run("SELECT * FROM ratings WHERE user_id = ? AND movie_id = ?",
+                   (user_id, movie_id), fetch_one=True)
+    if existing:
+        run("UPDATE ratings SET rating = ?, review = ? WHERE user_id = ? AND movie_id = ?",
+            (rating, review, user_id, movie_id), commit=True)
+    else:
+        run("INSERT INTO ratings (user_id, movie_id, rating, review) VALUES (?, ?, ?, ?)",
+            (user_id, movie_id, rating, review), commit=True)
+    run("UPDATE movies SET rating = (SELECT AVG(rating) FROM ratings WHERE movie_id = ?) WHERE id = ?",
+        (movie_id, movie_id), commit=True)
+
+def run_vote_benchmark(label, rate, votes):
+    """执行一组投票并输出每秒投票数"""
+    start = time.perf_counter()
+    for user_id, movie_id, rating in votes:
+        rate(user_id, movie_id, rating, '')
+    elapsed = time.perf_counter() - start
+    print(f"  {label}: {len(votes)} 票，用时 {elapsed:.2f} 秒，{len(votes) / elapsed:.0f} 票/秒")
+    return len(votes) / elapsed
+
+def bench_votes(args):
+    """在临时数据库副本上比较旧评分路径和UPSERT路径的吞吐量"""
+    temp_dir = tempfile.mkdtemp()
+    original_database = movie_app.DATABASE
+    try:
+        temp_db = os.path.join(temp_dir, 'bench.db')
+        if os.path.exists(original_database):
+            shutil.copy(original_database, temp_db)
+        movie_app.set_database(temp_db)
+        movie_app.setup_database()
+
+        movie_ids = [row['id'] for row in movie_app.execute_db_query("SELECT id FROM movies", fetch_all=True)]
+        conn = sqlite3.connect(temp_db)
+        conn.executemany("INSERT INTO users (username, password) VALUES (?, 'x')",
+                         [(f'bench_user_{i}',) for i in range(args.users)])
+        conn.commit()
+        user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE username LIKE 'bench_user_%'")]
+
+        # 约一半是新评分，一半是修改已有评分
+        rng = random.Random(42)
+        votes = [(rng.choice(user_ids), rng.choice(movie_ids), rng.randint(1, 5)) for _ in range(args.votes)]
+        print(f"评分写入基准测试（PRAGMA配置方案: {movie_app.DB_PRAGMA_PROFILE}，"
+              f"{len(user_ids)} 个用户，{len(movie_ids)} 部电影）")
+
+        # 旧路径：没有聚合触发器，每次投票用AVG()重算
+        for name in movie_app.RATING_AGGREGATE_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute("DELETE FROM ratings WHERE user_id IN (SELECT id FROM users WHERE username LIKE 'bench_user_%')")
+        conn.commit()
+        before = run_vote_benchmark('改造前（SELECT + INSERT/UPDATE + AVG，3个连接2次提交）', legacy_rate_movie, votes)
+
+        # 新路径：单条UPSERT，触发器维护聚合字段
+        conn.execute("DELETE FROM ratings WHERE user_id IN (SELECT id FROM users WHERE username LIKE 'bench_user_%')")
+        for trigger_sql in movie_app.RATING_AGGREGATE_TRIGGERS.values():
+            conn.execute(trigger_sql)
+        conn.execute(movie_app.REBUILD_RATING_AGGREGATES_SQL)
+        conn.commit()
+        conn.close()
+        after = run_vote_benchmark('改造后（单条UPSERT，连接池，1次提交）', movie_app.save_user_rating, votes)
+
+        print(f"  提升: {after / before:.1f} 倍")
+        mismatches = movie_app.verify_rating_aggregates()
+        print(f"  评分聚合字段校验: {'✓ 一致' if not mismatches else f'✗ {len(mismatches)} 部电影不一致'}")
+        return 0 if not mismatches else 1
+    finally:
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+# ==============================
+# 全文搜索索引
+# ==============================
+
+def search_rebuild(args):
+    """清空并重建movies_fts全文搜索索引"""
+    count = movie_app.rebuild_search_index()
+    print(f"✓ 已重建全文搜索索引，共 {count} 部电影")
+    return 0
+
+# ==============================
+# 矩阵分解模型训练
+# ==============================
+
+def train_als(args):
+    """从ratings表训练ALS模型并保存因子矩阵"""
+    start = time.perf_counter()
+    arrays = movie_app.load_rating_arrays()
+    if arrays is None:
+        print("✗ 评分表为空，无法训练")
+        return 1
+    print(f"读取 {len(arrays[2])} 条评分，用时 {time.perf_counter() - start:.1f} 秒")
+    print(f"训练参数: 因子维度 {args.factors}，正则化 {args.regularization}，迭代 {args.iterations} 轮")
+
+    def log(iteration, rmse):
+        print(f"  第 {iteration} 轮: 训练集RMSE {rmse:.4f}，累计 {time.perf_counter() - start:.1f} 秒")
+
+    model = movie_app.ALSModel.train(*arrays, factors=args.factors, regularization=args.regularization,
+                                     iterations=args.iterations, log=log)
+    prefix = movie_app.als_model_prefix()
+    model.save(prefix)
+    print(f"✓ 已保存 {len(model.user_ids)} 个用户、{len(model.movie_ids)} 部电影的因子: {prefix}_*.npy")
+    return 0
+
+# ==============================
+# 相似电影
+# ==============================
+
+def refresh_neighbors(args):
+    """增量（或全量）刷新movie_neighbors表，适合用cron定期执行"""
+    start = time.perf_counter()
+    stats = movie_app.refresh_movie_neighbors(full=args.full)
+    if not stats['computed'] and not args.full:
+        print("✓ 没有需要刷新的电影")
+    else:
+        print(f"✓ 用时 {time.perf_counter() - start:.1f} 秒")
+    return 0
+
+# ==============================
+# 上传文件
+# ==============================
+
+def uploads_dedup(args):
+    """把上传目录中的旧文件迁移到内容寻址存储，合并重复文件"""
+    stats = movie_app.deduplicate_uploads()
+    print(f"✓ 改名 {stats['files']} 个文件，合并 {stats['duplicates']} 个重复文件，"
+          f"释放 {stats['reclaimed_bytes'] / 1024 / 1024:.1f} MB")
+    return 0
+
+def uploads_fanout(args):
+    """把平铺的上传文件迁移到分散目录，并改写数据库中的路径"""
+    stats = movie_app.migrate_upload_layout(batch_size=args.batch)
+    print(f"✓ 迁移 {stats['files']} 个上传文件、{stats['variants']} 个缩略图，改写 {stats['movies']} 个电影URL")
+    return 0
+
+def uploads_gc(args):
+    """回收没有被电影引用的上传文件"""
+    stats = movie_app.collect_upload_garbage(grace=args.grace * 3600, quarantine=not args.delete,
+                                             dry_run=args.dry_run)
+    action = '可回收' if args.dry_run else ('删除' if args.delete else '隔离')
+    print(f"✓ 扫描 {stats['scanned']} 个文件，{action} {stats['orphaned']} 个"
+          f"（宽限期内跳过 {stats['skipped_recent']} 个），释放 {stats['reclaimed_bytes'] / 1024 / 1024:.1f} MB")
+    if stats['deleted'] and not args.delete:
+        print(f"  删除了 {stats['deleted']} 个隔离期已满的文件")
+    return 0
+
+# ==============================
+# 后台任务
+# ==============================
+
+def worker(args):
+    """运行后台任务worker；--once时执行完当前所有任务后退出"""
+    movie_app.setup_database()
+    print(f"任务状态: {movie_app.get_job_counts() or '无任务'}")
+    job_worker = movie_app.make_job_worker(processes=args.processes)
+    if args.once:
+        count = job_worker.run_pending()
+        print(f"✓ 执行了 {count} 个任务，失败 {job_worker.failed} 次")
+        return 0
+    print(f"worker已启动（{args.processes} 个进程），按Ctrl+C退出")
+    try:
+        job_worker.run()
+    except KeyboardInterrupt:
+        print(f"worker已退出，完成 {job_worker.processed} 个任务，失败 {job_worker.failed} 次")
+    return 0
+
+def posters_backfill(args):
+    """为已有的上传海报安排缩略图任务，由worker执行"""
+    if not movie_app.pillow_available():
+        print("✗ 未安装Pillow，无法生成缩略图（pip install Pillow）")
+        return 1
+    count = movie_app.enqueue_poster_backfill()
+    print(f"✓ 已安排 {count} 张海报的缩略图任务，运行 python manage.py worker 执行")
+    return 0
+
+def videos_backfill(args):
+    """为已有的上传视频安排元数据解析任务，由worker执行"""
+    count = movie_app.enqueue_video_backfill()
+    print(f"✓ 已安排 {count} 个视频的解析任务，运行 python manage.py worker 执行")
+    return 0
+
+def hls_package(args):
+    """为已解析但还没有HLS分片的上传视频安排打包任务（不受HLS_PACKAGING开关影响）"""
+    count = movie_app.enqueue_hls_backfill()
+    print(f"✓ 已安排 {count} 个视频的HLS打包任务，运行 python manage.py worker 执行")
+    return 0
+
+# ==============================
+# 命令行入口
+# ==============================
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='电影推荐系统维护命令')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    advisor = subparsers.add_parser('index-advisor', help='用EXPLAIN QUERY PLAN检查SQL是否出现全表扫描')
+    advisor.add_argument('files', nargs='*', default=['app.py'], help='要检查的Python源文件（默认app.py）')
+    advisor.add_argument('--db', default=movie_app.DATABASE, help='用于分析的数据库文件')
+    advisor.add_argument('-v', '--verbose', action='store_true', help='同时输出没有问题的查询计划')
+    advisor.set_defaults(func=index_advisor)
+
+    ratings = subparsers.add_parser('ratings-check', help='核对电影的评分聚合字段')
+    ratings.add_argument('--fix', action='store_true', help='发现不一致时用评分表重建')
+    ratings.set_defaults(func=ratings_check)
+
+    bench = subparsers.add_parser('bench-votes', help='评分写入吞吐量基准测试')
+    bench.add_argument('-n', '--votes', type=int, default=2000, help='投票次数')
+    bench.add_argument('--users', type=int, default=500, help='参与投票的用户数')
+    bench.set_defaults(func=bench_votes)
+
+    search = subparsers.add_parser('search-rebuild', help='重建全文搜索索引')
+    search.set_defaults(func=search_rebuild)
+
+    als = subparsers.add_parser('train-als', help='训练ALS矩阵分解推荐模型')
+    als.add_argument('--factors', type=int, default=movie_app.ALS_FACTORS, help='隐因子维度')
+    als.add_argument('--regularization', type=float, default=movie_app.ALS_REGULARIZATION, help='正则化系数')
+    als.add_argument('--iterations', type=int, default=movie_app.ALS_ITERATIONS, help='迭代次数')
+    als.set_defaults(func=train_als)
+
+    neighbors = subparsers.add_parser('refresh-neighbors', help='刷新电影详情页的相似电影表')
+    neighbors.add_argument('--full', action='store_true', help='重新计算全部电影（默认只计算有变化的电影）')
+    neighbors.set_defaults(func=refresh_neighbors)
+
+    dedup = subparsers.add_parser('uploads-dedup', help='按内容哈希重命名上传文件并合并重复文件')
+    dedup.set_defaults(func=uploads_dedup)
+
+    fanout = subparsers.add_parser('uploads-fanout', help='把平铺的上传文件迁移到两级分散目录')
+    fanout.add_argument('--batch', type=int, default=movie_app.UPLOAD_MIGRATE_BATCH, help='每个事务改写的文件数')
+    fanout.set_defaults(func=uploads_fanout)
+
+    gc = subparsers.add_parser('uploads-gc', help='回收没有被电影引用的上传文件')
+    gc.add_argument('--grace', type=float, default=movie_app.UPLOAD_GC_GRACE / 3600,
+                    help='宽限期（小时），修改时间在宽限期内的文件不回收')
+    gc.add_argument('--delete', action='store_true', help='直接删除（默认移入上传目录下的.quarantine/）')
+    gc.add_argument('--dry-run', action='store_true', help='只列出可回收的文件')
+    gc.set_defaults(func=uploads_gc)
+
+    jobs = subparsers.add_parser('worker', help='运行后台任务worker')
+    jobs.add_argument('--processes', type=int, default=movie_app.JOB_WORKER_PROCESSES, help='执行任务的进程数')
+    jobs.add_argument('--once', action='store_true', help='在当前进程中执行完现有任务后退出')
+    jobs.set_defaults(func=worker)
+
+    posters = subparsers.add_parser('posters-backfill', help='为已有的上传海报生成缩略图')
+    posters.set_defaults(func=posters_backfill)
+
+    videos = subparsers.add_parser('videos-backfill', help='解析已有上传视频的时长、分辨率和编码')
+    videos.set_defaults(func=videos_backfill)
+
+    hls = subparsers.add_parser('hls-package', help='把已上传的视频切分为HLS分片')
+    hls.set_defaults(func=hls_package)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == '__main__':
+    main()
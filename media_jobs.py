@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 上传文件的后台处理任务
+
+这里的函数在worker的子进程中执行（见job_queue.py），只处理文件，不访问数据库：
+参数和返回值都是可以JSON序列化的dict，结果由app.py中对应的apply函数写回数据库。
+"""
+
+import os
+import json
+import uuid
+import shutil
+
+from upload_store import store_file, hash_file, content_filename, ingest_receipt_path
+from image_derivatives import generate_poster_derivatives
+from mp4_meta import MP4_EXTENSIONS, probe_mp4, make_faststart
+import hls_packager
+
+def _prepare_video(path, extension):
+    """
+    解析视频元数据，moov在文件末尾时原地重排为faststart
+
+    Returns:
+        probe_mp4()的结果；不是MP4/MOV或无法解析时返回None
+    """
+    if extension.lower() not in MP4_EXTENSIONS:
+        return None
+    try:
+        info = probe_mp4(path)
+        if not info['faststart'] and make_faststart(path):
+            print(f"已把moov移到文件开头: {path}")
+            info['faststart'] = True
+        return info
+    except ValueError as e:
+        print(f"无法解析视频 {path}: {e}")
+        return None
+
+def ingest_upload(payload):
+    """
+    分块上传完成后：解析视频元数据（必要时重排为faststart），计算哈希并移入内容寻址存储
+
+    移入存储前先把结果写入记录文件（upload_store.ingest_receipt_path）：移入之后写回数据库失败
+    或worker退出时任务会重试，此时临时文件已经不在了，存储中有这个文件时直接返回记录的结果
+
+    Args:
+        payload: {'part_path', 'extension', 'folder'}
+
+    Returns:
+        {'filename', 'sha256', 'size', 'duplicate', 'video': 视频元数据或None}
+    """
+    part_path = payload['part_path']
+    receipt_path = ingest_receipt_path(part_path)
+    if not os.path.exists(part_path) and os.path.exists(receipt_path):
+        with open(receipt_path, encoding='utf-8') as f:
+            result = json.load(f)
+        if os.path.exists(os.path.join(payload['folder'], result['filename'])):
+            return dict(result, duplicate=True)
+
+    video = _prepare_video(part_path, payload['extension'])
+    digest, size = hash_file(part_path)
+    result = {'filename': content_filename(digest, payload['extension']), 'sha256': digest, 'size': size,
+              'video': video}
+    with open(receipt_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+    filename, digest, size, duplicate = store_file(part_path, payload['extension'], payload['folder'],
+                                                   hashed=(digest, size))
+    return dict(result, duplicate=duplicate)
+
+def verify_upload(payload):
+    """
+    完整性检查：重新计算上传文件的哈希，与登记的值比较
+
+    Args:
+        payload: {'path', 'sha256', 'size'}
+
+    Raises:
+        ValueError: 文件内容与登记的哈希或大小不一致
+    """
+    digest, size = hash_file(payload['path'])
+    if size != payload['size'] or digest != payload['sha256']:
+        raise ValueError(f"文件校验失败: {payload['path']}（大小 {size}，SHA-256 {digest}）")
+    return {'size': size}
+
+def poster_derivatives(payload):
+    """
+    为上传的海报生成各种宽度的AVIF/WebP缩略图
+
+    Args:
+        payload: {'path', 'source', 'folder'}（source为原图在上传目录中的相对路径，folder为缩略图目录）
+
+    Returns:
+        {'source': 原图相对路径, 'variants': [[宽度, 格式, 相对路径, 文件大小]]}
+    """
+    variants = generate_poster_derivatives(payload['path'], payload['folder'], payload['source'])
+    return {'source': payload['source'], 'variants': [list(variant) for variant in variants]}
+
+def probe_video(payload):
+    """
+    解析表单直接上传的视频；不是faststart时复制一份重排后作为新文件存入内容寻址存储
+    （原文件按哈希命名、可能被其他电影引用，不能原地修改）
+
+    Args:
+        payload: {'path', 'source', 'extension', 'folder'}（source为原文件在上传目录中的相对路径）
+
+    Returns:
+        {'source': 原文件相对路径, 'video': 视频元数据或None}；重排后还有 'filename', 'sha256', 'size'
+    """
+    source = payload['source']
+    try:
+        video = probe_mp4(payload['path'])
+    except ValueError as e:
+        print(f"无法解析视频 {payload['path']}: {e}")
+        return {'source': source, 'video': None}
+    if video['faststart']:
+        return {'source': source, 'video': video}
+
+    temp_path = os.path.join(payload['folder'], f'.upload-{uuid.uuid4().hex}.tmp')
+    try:
+        shutil.copyfile(payload['path'], temp_path)
+        video = _prepare_video(temp_path, payload['extension'])
+        filename, digest, size, _ = store_file(temp_path, payload['extension'], payload['folder'])
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return {'source': source, 'video': video, 'filename': filename, 'sha256': digest, 'size': size}
+
+def package_hls(payload):
+    """
+    把上传的MP4切分为HLS分片（不转码）
+
+    Args:
+        payload: {'path', 'source', 'output_dir'}
+
+    Returns:
+        {'source', 'segments', 'duration', 'size'}
+    """
+    stats = hls_packager.package_hls(payload['path'], payload['output_dir'])
+    return dict(stats, source=payload['source'])
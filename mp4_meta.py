@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - MP4（ISO-BMFF）元数据解析和faststart重排
+
+MP4文件由一个个box组成：4字节大小 + 4字节类型 + 内容，容器box的内容又是box。
+这里用mmap按需读取，只访问moov中需要的几个box（mvhd/tkhd/mdhd/hdlr/stsd），
+几GB的视频也不会整个读进内存。
+
+faststart：moov（索引）在mdat（音视频数据）之前时，浏览器读到文件开头就能开始播放；
+moov在文件末尾时，浏览器要先用Range请求去取文件尾部。make_faststart()把moov移到mdat之前，
+并把stco/co64中的数据块偏移量加上moov的长度。
+"""
+
+import os
+import mmap
+import struct
+
+# 按ISO-BMFF解析的上传视频扩展名
+MP4_EXTENSIONS = {'mp4', 'mov'}
+# 内容是子box的容器类型（只列出解析时需要进入的）
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+# 复制文件时每次读写的字节数
+COPY_CHUNK = 1024 * 1024
+
+def iter_boxes(buf, start, end):
+    """
+    遍历buf[start:end]中的box
+
+    Yields:
+        (类型, box起始偏移, 内容起始偏移, box结束偏移)
+    """
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', buf, offset)
+        header = 8
+        if size == 1:
+            # 64位大小
+            if offset + 16 > end:
+                break
+            size = struct.unpack_from('>Q', buf, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            # 延伸到文件末尾
+            size = end - offset
+        if size < header or offset + size > end:
+            raise ValueError(f"box大小无效: {box_type!r} @ {offset}")
+        yield box_type, offset, offset + header, offset + size
+        offset += size
+
+def find_box(buf, start, end, path):
+    """按路径（如 [b'mdia', b'hdlr']）查找第一个匹配的box，返回(内容起始, 结束)或None"""
+    for box_type, _, content, box_end in iter_boxes(buf, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return content, box_end
+            return find_box(buf, content, box_end, path[1:])
+    return None
+
+def _read_descriptor_length(buf, offset):
+    """esds中描述符的长度：每字节7位，最高位为1表示还有后续字节"""
+    length = 0
+    for _ in range(4):
+        byte = buf[offset]
+        offset += 1
+        length = (length << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return length, offset
+
+def _audio_codec(buf, content, end):
+    """mp4a的RFC 6381编码字符串，如 mp4a.40.2（AAC-LC）"""
+    # AudioSampleEntry的固定部分为28字节，之后是esds等子box
+    esds = find_box(buf, content + 28, end, [b'esds'])
+    if not esds:
+        return 'mp4a'
+    offset, esds_end = esds[0] + 4, esds[1]
+    try:
+        object_type = None
+        while offset < esds_end:
+            tag = buf[offset]
+            length, offset = _read_descriptor_length(buf, offset + 1)
+            if tag == 0x03:  # ES_Descriptor
+                flags = buf[offset + 2]
+                offset += 3
+                if flags & 0x80:
+                    offset += 2
+                if flags & 0x40:
+                    offset += 1 + buf[offset]
+                if flags & 0x20:
+                    offset += 2
+            elif tag == 0x04:  # DecoderConfigDescriptor
+                object_type = buf[offset]
+                offset += 13
+            elif tag == 0x05:  # DecoderSpecificInfo：前5位为audioObjectType
+                return f'mp4a.{object_type:02x}.{buf[offset] >> 3}'
+            else:
+                offset += length
+        return f'mp4a.{object_type:02x}' if object_type is not None else 'mp4a'
+    except IndexError:
+        return 'mp4a'
+
+def _sample_codec(buf, start, end):
+    """stsd中第一个样本描述的编码字符串"""
+    # stsd: version/flags(4) + entry_count(4)，之后是样本描述box
+    for box_type, _, content, box_end in iter_boxes(buf, start + 8, end):
+        codec = box_type.decode('latin-1')
+        if box_type in (b'avc1', b'avc3'):
+            # VisualSampleEntry的固定部分为78字节，之后是avcC
+            avcc = find_box(buf, content + 78, box_end, [b'avcC'])
+            if avcc and avcc[1] - avcc[0] >= 4:
+                profile, compatibility, level = buf[avcc[0] + 1:avcc[0] + 4]
+                codec = f'{codec}.{profile:02X}{compatibility:02X}{level:02X}'
+        elif box_type == b'mp4a':
+            codec = _audio_codec(buf, content, box_end)
+        return codec
+    return None
+
+def _parse_moov(buf, start, end):
+    """从moov中取出时长、分辨率和编码"""
+    info = {'duration': None, 'width': None, 'height': None, 'video_codec': None, 'audio_codec': None}
+    mvhd = find_box(buf, start, end, [b'mvhd'])
+    if mvhd:
+        if buf[mvhd[0]] == 1:
+            timescale, duration = struct.unpack_from('>IQ', buf, mvhd[0] + 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', buf, mvhd[0] + 12)
+        if timescale:
+            info['duration'] = round(duration / timescale, 3)
+
+    for box_type, _, content, box_end in iter_boxes(buf, start, end):
+        if box_type != b'trak':
+            continue
+        hdlr = find_box(buf, content, box_end, [b'mdia', b'hdlr'])
+        stsd = find_box(buf, content, box_end, [b'mdia', b'minf', b'stbl', b'stsd'])
+        if not hdlr or not stsd:
+            continue
+        handler = bytes(buf[hdlr[0] + 8:hdlr[0] + 12])
+        if handler == b'vide' and info['video_codec'] is None:
+            info['video_codec'] = _sample_codec(buf, *stsd)
+            tkhd = find_box(buf, content, box_end, [b'tkhd'])
+            if tkhd:
+                # tkhd最后8字节是16.16定点数的宽和高
+                width, height = struct.unpack_from('>II', buf, tkhd[1] - 8)
+                info['width'], info['height'] = width >> 16, height >> 16
+        elif handler == b'soun' and info['audio_codec'] is None:
+            info['audio_codec'] = _sample_codec(buf, *stsd)
+    return info
+
+def _top_level_boxes(buf):
+    """顶层box列表：[(类型, 起始, 结束)]"""
+    return [(box_type, offset, box_end) for box_type, offset, _, box_end in iter_boxes(buf, 0, len(buf))]
+
+def probe_mp4(path):
+    """
+    读取MP4/MOV文件的元数据
+
+    Returns:
+        {'duration': 秒, 'width', 'height', 'video_codec', 'audio_codec', 'faststart': moov是否在mdat之前}
+
+    Raises:
+        ValueError: 不是有效的MP4文件（没有moov）
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < 8:
+            raise ValueError(f"不是MP4文件: {path}")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            boxes = _top_level_boxes(buf)
+            moov = next(((start, end) for box_type, start, end in boxes if box_type == b'moov'), None)
+            if moov is None:
+                raise ValueError(f"没有找到moov: {path}")
+            mdat = next((start for box_type, start, _ in boxes if box_type == b'mdat'), None)
+            info = _parse_moov(buf, moov[0] + 8, moov[1])
+            info['faststart'] = mdat is None or moov[0] < mdat
+            return info
+
+def _shift_chunk_offsets(moov, start, end, delta):
+    """把moov（bytearray）中所有stco/co64的数据块偏移量加上delta"""
+    for box_type, _, content, box_end in iter_boxes(moov, start, end):
+        if box_type in CONTAINER_BOXES:
+            _shift_chunk_offsets(moov, content, box_end, delta)
+        elif box_type in (b'stco', b'co64'):
+            count = struct.unpack_from('>I', moov, content + 4)[0]
+            item, limit = ('>I', 0xFFFFFFFF) if box_type == b'stco' else ('>Q', 0xFFFFFFFFFFFFFFFF)
+            step = struct.calcsize(item)
+            for offset in range(content + 8, content + 8 + count * step, step):
+                value = struct.unpack_from(item, moov, offset)[0] + delta
+                if value > limit:
+                    # 改用co64会改变moov的长度，这种文件（接近4GB）保持原样
+                    raise ValueError("stco偏移量溢出，需要co64")
+                struct.pack_into(item, moov, offset, value)
+
+def make_faststart(path):
+    """
+    把moov移到mdat之前（先写同目录临时文件，完成后原子替换原文件）
+
+    Returns:
+        True表示已重排；文件已经是faststart时返回False
+
+    Raises:
+        ValueError: 文件结构无法处理
+    """
+    temp_path = f'{path}.faststart.tmp'
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            boxes = _top_level_boxes(buf)
+            moov_index = next((i for i, box in enumerate(boxes) if box[0] == b'moov'), None)
+            mdat_index = next((i for i, box in enumerate(boxes) if box[0] == b'mdat'), None)
+            if moov_index is None:
+                raise ValueError(f"没有找到moov: {path}")
+            if mdat_index is None or moov_index < mdat_index:
+                return False
+
+            _, moov_start, moov_end = boxes[moov_index]
+            moov = bytearray(buf[moov_start:moov_end])
+            header = 16 if struct.unpack_from('>I', moov, 0)[0] == 1 else 8
+            # moov插入到第一个mdat之前，之后的数据整体后移moov的长度
+            _shift_chunk_offsets(moov, header, len(moov), len(moov))
+
+            try:
+                with open(temp_path, 'wb') as out:
+                    for index, (_, start, end) in enumerate(boxes):
+                        if index == mdat_index:
+                            out.write(moov)
+                        if index != moov_index:
+                            for chunk_start in range(start, end, COPY_CHUNK):
+                                out.write(buf[chunk_start:min(chunk_start + COPY_CHUNK, end)])
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+    os.replace(temp_path, path)
+    return True
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 整页响应缓存
+
+未登录用户看到的首页、分类页、搜索结果页完全相同，没必要每次都查询数据库、渲染模板。
+PageCache保存渲染好的HTML：
+
+- 内存层：按总字节数限制大小，超出时淘汰最久没有使用的页面；淘汰的页面降级到磁盘层
+- 磁盘层（可选）：每个进程一个目录，同样按总字节数限制，超出时删除最久没有使用的文件；
+  磁盘上的页面被访问时重新放回内存；进程被强制结束时来不及清理自己的目录，
+  启动时（以及fork出的进程第一次写磁盘时）删除已经退出的进程留下的目录
+- TTL + 标签失效：与query_cache.TaggedCache相同的接口（invalidate/clear），可以订阅cache_bus
+
+缓存键由调用方决定（app.py中为 路径 + 查询参数 + 登录状态）。
+"""
+
+import os
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+def _process_alive(pid):
+    """进程是否还在运行（Windows上os.kill会结束目标进程，不能用来检查，一律当作在运行）"""
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # 进程存在，属于其他用户
+        return True
+    return True
+
+class PageCache:
+    """两级（内存+磁盘）的页面缓存"""
+
+    def __init__(self, memory_bytes=16 * 1024 * 1024, disk_dir=None, disk_bytes=256 * 1024 * 1024,
+                 ttl=60.0):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+        self.generation = 0            # 每次失效加1，含义同TaggedCache.generation
+        self._lock = threading.Lock()
+        self._reset()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0,
+                          'evictions': 0, 'invalidations': 0}
+        self._remove_dead_process_dirs()
+
+    def _reset(self):
+        """清空索引（初始化或fork后调用，磁盘层目录按进程区分）"""
+        self._memory = OrderedDict()   # key -> (过期时间, 页面, 标签)
+        self._memory_size = 0
+        self._disk = OrderedDict()     # key -> (过期时间, 文件路径, 大小, 标签)
+        self._disk_size = 0
+        self._pid = os.getpid()
+        self._dead_dirs_checked = False
+
+    def _check_pid(self):
+        """fork之后父进程的索引不能使用（调用方持有锁）"""
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _process_dir(self):
+        """本进程的磁盘层目录"""
+        return os.path.join(self.disk_dir, str(os.getpid()))
+
+    def _remove_dead_process_dirs(self):
+        """删除已经退出的进程留下的磁盘层目录（每个进程检查一次）"""
+        self._dead_dirs_checked = True
+        if not self.disk_dir:
+            return
+        try:
+            with os.scandir(self.disk_dir) as entries:
+                pids = [int(entry.name) for entry in entries if entry.name.isdigit() and entry.is_dir()]
+        except OSError:
+            return
+        for pid in pids:
+            if pid != os.getpid() and not _process_alive(pid):
+                shutil.rmtree(os.path.join(self.disk_dir, str(pid)), ignore_errors=True)
+
+    def _pop_memory(self, key):
+        expires, body, tags = self._memory.pop(key)
+        self._memory_size -= len(body)
+        return expires, body, tags
+
+    def _pop_disk(self, key):
+        expires, path, size, tags = self._disk.pop(key)
+        self._disk_size -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return expires, path, tags
+
+    def _store_disk(self, key, expires, body, tags):
+        """把页面写入磁盘层（调用方持有锁）"""
+        if not self.disk_dir or len(body) > self.disk_bytes:
+            return
+        if not self._dead_dirs_checked:
+            self._remove_dead_process_dirs()
+        directory = self._process_dir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+        if key in self._disk:
+            self._pop_disk(key)
+        with open(path, 'wb') as f:
+            f.write(body)
+        self._disk[key] = (expires, path, len(body), tags)
+        self._disk_size += len(body)
+        while self._disk_size > self.disk_bytes:
+            self._pop_disk(next(iter(self._disk)))
+            self._counters['evictions'] += 1
+
+    def _store_memory(self, key, expires, body, tags):
+        """把页面放入内存层，超出大小时把最久没有使用的页面降级到磁盘（调用方持有锁）"""
+        if key in self._memory:
+            self._pop_memory(key)
+        if len(body) > self.memory_bytes:
+            self._store_disk(key, expires, body, tags)
+            return
+        self._memory[key] = (expires, body, tags)
+        self._memory_size += len(body)
+        while self._memory_size > self.memory_bytes:
+            old_key = next(iter(self._memory))
+            old_expires, old_body, old_tags = self._pop_memory(old_key)
+            if self.disk_dir:
+                self._store_disk(old_key, old_expires, old_body, old_tags)
+            else:
+                self._counters['evictions'] += 1
+
+    def get(self, key):
+        """取出未过期的页面（bytes），没有时返回None"""
+        with self._lock:
+            self._check_pid()
+            now = time.monotonic()
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return entry[1]
+                self._pop_memory(key)
+            entry = self._disk.get(key)
+            if entry is not None:
+                expires, path, _, tags = entry
+                body = None
+                if expires > now:
+                    try:
+                        with open(path, 'rb') as f:
+                            body = f.read()
+                    except OSError:
+                        pass
+                self._pop_disk(key)
+                if body is not None:
+                    self._store_memory(key, expires, body, tags)
+                    self._counters['disk_hits'] += 1
+                    return body
+            self._counters['misses'] += 1
+            return None
+
+    def set(self, key, body, tags=(), generation=None):
+        """保存页面；generation为渲染开始前的cache.generation，期间发生过失效时放弃保存"""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._check_pid()
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._disk:
+                self._pop_disk(key)
+            self._store_memory(key, time.monotonic() + self.ttl, body, tuple(tags))
+            self._counters['stores'] += 1
+
+    def invalidate(self, *tags):
+        """删除带有任一标签的页面，返回删除的页面数"""
+        tags = set(tags)
+        with self._lock:
+            self._check_pid()
+            self.generation += 1
+            memory_keys = [key for key, entry in self._memory.items() if tags.intersection(entry[2])]
+            disk_keys = [key for key, entry in self._disk.items() if tags.intersection(entry[3])]
+            for key in memory_keys:
+                self._pop_memory(key)
+            for key in disk_keys:
+                self._pop_disk(key)
+            count = len(memory_keys) + len(disk_keys)
+            self._counters['invalidations'] += count
+            return count
+
+    def clear(self):
+        """清空缓存（包括本进程的磁盘目录）"""
+        with self._lock:
+            self.generation += 1
+            if self.disk_dir and self._pid == os.getpid():
+                shutil.rmtree(self._process_dir(), ignore_errors=True)
+            self._reset()
+
+    def stats(self):
+        """缓存状态，hit_ratio为命中次数（内存+磁盘）/查询次数"""
+        with self._lock:
+            stats = dict(self._counters, memory_entries=len(self._memory), memory_size=self._memory_size,
+                         disk_entries=len(self._disk), disk_size=self._disk_size)
+        hits = stats['memory_hits'] + stats['disk_hits']
+        lookups = hits + stats['misses']
+        stats['hit_ratio'] = round(hits / lookups, 3) if lookups else 0.0
+        return stats
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 密码哈希进程池
+
+bcrypt每次计算要占用几十到几百毫秒的CPU，并且在请求线程中执行时会一直占着GIL之外的CPU核心：
+登录高峰时所有请求线程都在算哈希，普通页面也要排队。这里把hashpw/checkpw交给独立的小进程池：
+
+- 进程数固定（默认2），登录再多也只占用这么多CPU核心，页面请求总有CPU可用
+- 准入控制：排队+执行中的哈希数达到上限时立即拒绝（HashingBusy），由路由返回503，
+  而不是让请求线程无限等待、把线程池也拖垮
+- stats() 提供队列深度、拒绝次数、等待时间等指标
+
+进程池在第一次使用时才创建（spawn方式，子进程只导入本模块和bcrypt，不会继承Flask进程的数据库连接）；
+processes=0 时在调用线程中直接计算（测试和单进程脚本使用）。
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+import bcrypt
+
+class HashingBusy(Exception):
+    """哈希进程池已满或等待超时，请稍后重试"""
+
+def _hashpw(password, rounds):
+    """在子进程中执行：生成bcrypt哈希"""
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+def _checkpw(password, hashed):
+    """在子进程中执行：校验密码"""
+    return bcrypt.checkpw(password, hashed)
+
+class PasswordHasher:
+    """有界的bcrypt进程池"""
+
+    def __init__(self, processes=2, max_pending=16, timeout=5.0, rounds=12):
+        self.processes = processes
+        self.max_pending = max_pending  # 排队+执行中的哈希数上限
+        self.timeout = timeout          # 等待结果的最长时间（秒）
+        self.rounds = rounds            # bcrypt cost
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._pid = None
+        self._counters = {'submitted': 0, 'completed': 0, 'rejected': 0, 'timeouts': 0,
+                          'pending': 0, 'peak_pending': 0, 'wait_seconds': 0.0}
+
+    def _get_executor(self):
+        """第一次使用时创建进程池；fork之后父进程的进程池不能在子进程中使用，重新创建"""
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.processes,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+                self._pid = os.getpid()
+            return self._executor
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counters[name] += delta
+            self._counters['peak_pending'] = max(self._counters['peak_pending'], self._counters['pending'])
+
+    def _run(self, func, *args):
+        """准入控制后在进程池中执行，拿不到名额或等待超时时抛出HashingBusy"""
+        if not self._slots.acquire(blocking=False):
+            self._count(rejected=1)
+            raise HashingBusy(f"密码哈希队列已满（上限 {self.max_pending}）")
+        self._count(submitted=1, pending=1)
+        started = time.monotonic()
+        try:
+            if self.processes <= 0:
+                return func(*args)
+            future = self._get_executor().submit(func, *args)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                # 已经在执行的任务无法取消，结果直接丢弃
+                future.cancel()
+                self._count(timeouts=1)
+                raise HashingBusy(f"等待密码哈希超过 {self.timeout} 秒")
+        finally:
+            self._count(completed=1, pending=-1, wait_seconds=time.monotonic() - started)
+            self._slots.release()
+
+    def hash_password(self, password):
+        """生成密码哈希（bytes）"""
+        return self._run(_hashpw, password.encode('utf-8'), self.rounds)
+
+    def check_password(self, password, hashed):
+        """校验密码是否与哈希匹配"""
+        if isinstance(hashed, str):
+            hashed = hashed.encode('utf-8')
+        return self._run(_checkpw, password.encode('utf-8'), hashed)
+
+    def stats(self):
+        """进程池状态，便于监控：pending为当前队列深度（排队+执行中）"""
+        with self._lock:
+            stats = dict(self._counters)
+        stats['avg_wait_ms'] = round(stats.pop('wait_seconds') * 1000 / stats['completed'], 1) if stats['completed'] else 0.0
+        stats.update(processes=self.processes, max_pending=self.max_pending)
+        return stats
+
+    def shutdown(self):
+        """关闭进程池（进程退出时调用）"""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
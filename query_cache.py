@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 进程内的查询结果缓存
+
+分类列表、电影详情这类几乎不变的查询，每个页面都要查一遍。TaggedCache在进程内缓存结果：
+
+- LRU：条目数达到上限时淘汰最久没有使用的条目
+- TTL：每个条目有过期时间，即使漏掉了失效通知，过期后也会重新查询
+- 标签失效：写入缓存时带上标签（如 'categories'、'movie:12'），数据修改后调用 invalidate(标签)
+  删除所有带这个标签的条目
+
+查询和失效可能交错：一个请求读到旧数据后，另一个请求提交修改并失效缓存，前者再把旧数据写入缓存。
+set() 的 generation 参数用来避免这种情况：查询前记下 cache.generation，写入时如果期间发生过失效就放弃写入。
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+class TaggedCache:
+    """线程安全的TTL/LRU缓存，支持按标签失效"""
+
+    def __init__(self, max_entries=1024, default_ttl=300.0):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.generation = 0            # 每次失效加1
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (过期时间, 值, 标签)
+        self._tags = {}                # 标签 -> {key}
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _remove(self, key):
+        """删除条目并从标签索引中移除（调用方持有锁）"""
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key, default=None):
+        """取出未过期的缓存值，没有时返回default"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return default
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                self._counters['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None, tags=(), generation=None):
+        """
+        写入缓存
+
+        Args:
+            ttl: 有效期（秒），默认default_ttl；小于等于0时不缓存
+            tags: 失效标签
+            generation: 查询开始前的cache.generation，期间发生过失效时放弃写入
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return False
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+            return True
+
+    def invalidate(self, *tags):
+        """删除带有任一标签的条目，返回删除的条目数"""
+        with self._lock:
+            self.generation += 1
+            keys = set()
+            for tag in tags:
+                keys |= self._tags.get(tag, set())
+            for key in keys:
+                self._remove(key)
+            self._counters['invalidations'] += len(keys)
+            return len(keys)
+
+    def clear(self):
+        """清空缓存（切换数据库时使用）"""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        """缓存状态，便于监控"""
+        with self._lock:
+            stats = dict(self._counters, entries=len(self._entries), max_entries=self.max_entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 推荐算法
+
+ItemCFModel：基于物品的协同过滤（item-item collaborative filtering）
+- 用SciPy稀疏矩阵存放 用户×电影 评分矩阵
+- 相似度采用修正余弦（adjusted cosine）：先减去每个用户的平均分，消除"打分松紧"的差异；
+  用户平均分向全站平均分收缩，否则只打过一两次分或总打同一个分的用户会被完全抵消
+- 每部电影只保留前N个最相似的邻居，推荐时只需要在用户评过分的电影的邻居表上做向量化累加
+
+compute_movie_neighbors：电影详情页"相似电影"，内容相似度与共同评分相似度加权混合，
+由批处理任务写入movie_neighbors表（python manage.py refresh-neighbors）
+
+ALSModel：交替最小二乘矩阵分解，离线训练（python manage.py train-als），
+因子矩阵保存为.npy文件，Web进程用mmap零拷贝加载
+
+本模块只依赖NumPy/SciPy（以及text_search的分词），不访问数据库；数据由app.py读取后传入。
+"""
+
+import os
+import re
+import json
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from text_search import ngram_tokenize
+
+def _rating_matrices(user_ids, movie_cols, ratings, n_movies, mean_damping):
+    """
+    构造修正余弦所需的稀疏矩阵
+
+    Args:
+        movie_cols: 每条评分对应的列号（0..n_movies-1）
+
+    Returns:
+        (按列归一化的去均值评分矩阵, 0/1评分指示矩阵, 全站平均分)，矩阵均为 用户×电影 的CSC格式
+    """
+    unique_users, user_rows = np.unique(user_ids, return_inverse=True)
+    n_users = len(unique_users)
+
+    # 修正余弦：每条评分减去该用户（收缩后）的平均分
+    global_mean = float(ratings.mean()) if len(ratings) else 0.0
+    user_counts = np.bincount(user_rows, minlength=n_users)
+    user_sums = np.bincount(user_rows, weights=ratings, minlength=n_users)
+    user_means = (user_sums + mean_damping * global_mean) / (user_counts + mean_damping)
+    centered = ratings - user_means[user_rows]
+
+    matrix = sp.csc_matrix((centered, (user_rows, movie_cols)), shape=(n_users, n_movies))
+    matrix.eliminate_zeros()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    normalized = (matrix @ sp.diags(1.0 / np.where(norms > 0, norms, 1.0))).tocsc()
+    rated = sp.csc_matrix((np.ones_like(ratings), (user_rows, movie_cols)), shape=(n_users, n_movies))
+    return normalized, rated, global_mean
+
+class ItemCFModel:
+    """基于物品的协同过滤模型，保存每部电影的前N个邻居"""
+
+    def __init__(self, movie_ids, neighbor_index, neighbor_scores, popularity, global_mean,
+                 mean_damping=5.0):
+        self.movie_ids = movie_ids              # 列号 -> 电影ID
+        self.neighbor_index = neighbor_index    # (电影数, N)，邻居的列号，不足N个时为-1
+        self.neighbor_scores = neighbor_scores  # (电影数, N)，对应的相似度
+        self.popularity = popularity            # 每部电影的评分人数，冷启动时使用
+        self.global_mean = global_mean          # 全站平均分
+        self.mean_damping = mean_damping
+        self.column_of = {movie_id: col for col, movie_id in enumerate(movie_ids.tolist())}
+        self.built_at = time.time()
+
+    @classmethod
+    def fit(cls, user_ids, movie_ids, ratings, top_n=50, shrinkage=10.0, mean_damping=5.0, block_size=1024):
+        """
+        训练模型
+
+        Args:
+            user_ids, movie_ids, ratings: 长度相同的一维数组，每个元素是一条评分
+            top_n: 每部电影保留的邻居数量
+            shrinkage: 共同评分人数较少时把相似度向0收缩，避免两三个人的巧合造成高相似度
+            mean_damping: 用户平均分向全站平均分收缩的强度（相当于额外的虚拟评分条数）
+            block_size: 分块计算相似度时每块的电影数，限制内存占用
+
+        Returns:
+            ItemCFModel
+        """
+        user_ids = np.asarray(user_ids)
+        movie_ids = np.asarray(movie_ids)
+        ratings = np.asarray(ratings, dtype=np.float64)
+
+        unique_movies, movie_cols = np.unique(movie_ids, return_inverse=True)
+        n_movies = len(unique_movies)
+        top_n = max(1, min(top_n, n_movies - 1)) if n_movies > 1 else 1
+        normalized, rated, global_mean = _rating_matrices(user_ids, movie_cols, ratings, n_movies, mean_damping)
+
+        neighbor_index = np.full((n_movies, top_n), -1, dtype=np.int32)
+        neighbor_scores = np.zeros((n_movies, top_n), dtype=np.float32)
+        normalized_t = normalized.T.tocsr()
+        rated_t = rated.T.tocsr()
+
+        # 分块计算 相似度 = Xᵀ·X，每块只保留每列的前N个
+        for start in range(0, n_movies, block_size):
+            stop = min(start + block_size, n_movies)
+            similarity = (normalized_t @ normalized[:, start:stop]).toarray()
+            co_counts = (rated_t @ rated[:, start:stop]).toarray()
+            similarity *= co_counts / (co_counts + shrinkage)
+            # 去掉自身，只保留正相关
+            similarity[np.arange(start, stop), np.arange(stop - start)] = 0.0
+            similarity[similarity <= 0] = 0.0
+
+            block = similarity.T  # (块内电影数, 全部电影数)
+            if n_movies > top_n:
+                top = np.argpartition(-block, top_n - 1, axis=1)[:, :top_n]
+            else:
+                top = np.tile(np.arange(n_movies), (stop - start, 1))[:, :top_n]
+            top_scores = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            neighbor_index[start:stop] = np.where(top_scores > 0, top, -1)
+            neighbor_scores[start:stop] = top_scores
+
+        popularity = np.bincount(movie_cols, minlength=n_movies)
+        return cls(unique_movies, neighbor_index, neighbor_scores, popularity, global_mean, mean_damping)
+
+    def recommend(self, user_ratings, limit=8):
+        """
+        为一个用户生成推荐
+
+        预测分 = 用户平均分 + Σ 相似度×(评分-平均分) / Σ 相似度，
+        再按邻居支持度收缩，只被一两部电影弱相关支持的候选排在后面。
+
+        Args:
+            user_ratings: {电影ID: 评分}，该用户的全部评分
+            limit: 返回数量
+
+        Returns:
+            [(电影ID, 分数)]，已评过分的电影不会出现；协同过滤结果不足时用热门电影补足
+        """
+        n_movies = len(self.movie_ids)
+        known = [(self.column_of[movie_id], rating) for movie_id, rating in user_ratings.items()
+                 if movie_id in self.column_of]
+        seen = np.zeros(n_movies, dtype=bool)
+        results = []
+
+        if known:
+            cols = np.array([col for col, _ in known])
+            values = np.array([rating for _, rating in known], dtype=np.float64)
+            seen[cols] = True
+            user_mean = (values.sum() + self.mean_damping * self.global_mean) / (len(values) + self.mean_damping)
+            deviations = values - user_mean
+
+            neighbors = self.neighbor_index[cols]
+            scores = self.neighbor_scores[cols]
+            valid = neighbors >= 0
+            numerator = np.bincount(neighbors[valid], weights=(scores * deviations[:, None])[valid],
+                                    minlength=n_movies)
+            support = np.bincount(neighbors[valid], weights=scores[valid], minlength=n_movies)
+
+            candidates = np.flatnonzero((support > 0) & ~seen)
+            if len(candidates):
+                predicted = user_mean + numerator[candidates] / (support[candidates] + 1.0)
+                # 先按预测分，再按支持度排序
+                order = np.lexsort((-support[candidates], -predicted))[:limit]
+                results = [(int(self.movie_ids[candidates[i]]), float(predicted[i])) for i in order]
+                seen[candidates[order]] = True
+
+        if len(results) < limit:
+            # 冷启动：补充该用户没看过的热门电影
+            popular = np.argsort(-self.popularity, kind='stable')
+            for col in popular[~seen[popular]][:limit - len(results)]:
+                results.append((int(self.movie_ids[col]), 0.0))
+        return results
+
+    def neighbors(self, movie_id, limit=10):
+        """返回与某部电影最相似的电影 [(电影ID, 相似度)]"""
+        col = self.column_of.get(movie_id)
+        if col is None:
+            return []
+        return [(int(self.movie_ids[n]), float(s))
+                for n, s in zip(self.neighbor_index[col][:limit], self.neighbor_scores[col][:limit]) if n >= 0]
+
+# ==============================
+# 相似电影（内容 + 共同评分）
+# ==============================
+
+GENRE_SEPARATORS = re.compile(r'[/,，、|\s]+')
+
+def movie_content_tokens(movie):
+    """
+    电影的内容特征词：类型、导演各作为一个整体特征（权重更高），简介取两字及以上的n-gram
+
+    Returns:
+        {特征词: 词频}
+    """
+    tokens = {}
+    for genre in GENRE_SEPARATORS.split(movie.get('genre') or ''):
+        if genre:
+            tokens[f'genre:{genre.lower()}'] = 2.0
+    director = (movie.get('director') or '').strip().lower()
+    if director:
+        tokens[f'director:{director}'] = 2.0
+    for token in ngram_tokenize(movie.get('description')).split():
+        if len(token) >= 2:
+            tokens[token] = tokens.get(token, 0.0) + 1.0
+    return tokens
+
+def _content_matrix(movies):
+    """TF-IDF特征矩阵（电影×特征词，CSR），每行做L2归一化，行内积即余弦相似度"""
+    vocabulary = {}
+    rows, cols, values = [], [], []
+    for row, movie in enumerate(movies):
+        for token, weight in movie_content_tokens(movie).items():
+            rows.append(row)
+            cols.append(vocabulary.setdefault(token, len(vocabulary)))
+            values.append(weight)
+    matrix = sp.csr_matrix((values, (rows, cols)), shape=(len(movies), len(vocabulary)))
+    document_counts = np.bincount(matrix.indices, minlength=len(vocabulary))
+    idf = np.log((1.0 + len(movies)) / (1.0 + document_counts)) + 1.0
+    matrix = matrix @ sp.diags(idf)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    return (sp.diags(1.0 / np.where(norms > 0, norms, 1.0)) @ matrix).tocsr()
+
+def compute_movie_neighbors(movies, user_ids, movie_ids, ratings, targets=None, top_n=12,
+                            content_weight=0.4, shrinkage=10.0, mean_damping=5.0, block_size=1024):
+    """
+    计算电影的相似电影列表
+
+    相似度 = content_weight × 内容相似度 + (1 - content_weight) × 共同评分相似度
+    - 内容相似度：类型、导演、简介的TF-IDF余弦
+    - 共同评分相似度：与ItemCFModel相同的修正余弦（含共同评分人数收缩）
+    没有评分的新电影只靠内容相似度也能得到相似电影。
+
+    Args:
+        movies: [{'id', 'genre', 'director', 'description'}]，全部电影
+        user_ids, movie_ids, ratings: 全部评分（可以为空数组）
+        targets: 只计算这些电影ID的行；None表示全部
+        top_n: 每部电影保留的相似电影数量
+
+    Returns:
+        {电影ID: [(相似电影ID, 相似度)]}，按相似度从高到低
+    """
+    all_ids = np.array([movie['id'] for movie in movies], dtype=np.int64)
+    n_movies = len(all_ids)
+    if n_movies == 0:
+        return {}
+    order = np.argsort(all_ids)
+    sorted_ids = all_ids[order]
+    if targets is None:
+        target_rows = np.arange(n_movies)
+    else:
+        wanted = np.asarray(sorted(set(targets)), dtype=np.int64)
+        positions = np.searchsorted(sorted_ids, wanted)
+        found = (positions < n_movies) & (sorted_ids[np.minimum(positions, n_movies - 1)] == wanted)
+        target_rows = order[positions[found]]
+
+    content = _content_matrix(movies)
+    content_t = content.T.tocsc()
+
+    # 评分按电影在movies中的行号对齐；已删除电影的残留评分直接忽略
+    ratings = np.asarray(ratings, dtype=np.float64)
+    movie_ids = np.asarray(movie_ids, dtype=np.int64)
+    positions = np.searchsorted(sorted_ids, movie_ids)
+    valid = (positions < n_movies) & (sorted_ids[np.minimum(positions, n_movies - 1)] == movie_ids)
+    if valid.any():
+        movie_cols = order[positions[valid]]
+        normalized, rated, _ = _rating_matrices(np.asarray(user_ids)[valid], movie_cols, ratings[valid],
+                                                n_movies, mean_damping)
+        normalized_t = normalized.T.tocsr()
+        rated_t = rated.T.tocsr()
+    else:
+        normalized = None
+
+    top_n = max(1, min(top_n, n_movies - 1))
+    results = {}
+    for start in range(0, len(target_rows), block_size):
+        rows = target_rows[start:start + block_size]
+        similarity = content_weight * (content[rows] @ content_t).toarray()
+        if normalized is not None:
+            co_rating = (normalized_t[rows] @ normalized).toarray()
+            co_counts = (rated_t[rows] @ rated).toarray()
+            co_rating *= co_counts / (co_counts + shrinkage)
+            similarity += (1.0 - content_weight) * np.maximum(co_rating, 0.0)
+        # 去掉自身
+        similarity[np.arange(len(rows)), rows] = 0.0
+
+        if n_movies > top_n:
+            top = np.argpartition(-similarity, top_n - 1, axis=1)[:, :top_n]
+        else:
+            top = np.tile(np.arange(n_movies), (len(rows), 1))
+        top_scores = np.take_along_axis(similarity, top, axis=1)
+        for i, row in enumerate(rows):
+            ranked = sorted(zip(top_scores[i], top[i]), reverse=True)
+            results[int(all_ids[row])] = [(int(all_ids[col]), float(score))
+                                          for score, col in ranked if score > 0]
+    return results
+
+# ==============================
+# 矩阵分解（ALS）
+# ==============================
+
+ALS_FILES = ('user_factors', 'item_factors', 'user_ids', 'movie_ids')
+
+def _solve_least_squares(matrix, fixed, regularization, row_block=4096, fixed_chunk=16384):
+    """
+    ALS的半步：固定一侧因子，求解另一侧每一行的正则化最小二乘
+
+    对第u行：(Σ_i f_i f_iᵀ + λ·n_u·I) x_u = Σ_i r_ui f_i
+    Σ_i f_i f_iᵀ 用 稀疏指示矩阵 × 每个f_i的外积展开 一次算出，再用批量np.linalg.solve求解，
+    不需要逐行循环。分块进行，内存占用与行数无关。
+
+    Args:
+        matrix: CSR稀疏矩阵（行×固定侧），值为去均值后的评分
+        fixed: 固定侧因子 (固定侧数量, k)
+    """
+    n_rows = matrix.shape[0]
+    k = fixed.shape[1]
+    counts = np.diff(matrix.indptr)
+    indicator = matrix.copy()
+    indicator.data = np.ones_like(indicator.data)
+    eye = np.eye(k)
+    result = np.zeros((n_rows, k))
+
+    for start in range(0, n_rows, row_block):
+        stop = min(start + row_block, n_rows)
+        gram = np.zeros((stop - start, k * k))
+        block_indicator = indicator[start:stop]
+        for chunk_start in range(0, fixed.shape[0], fixed_chunk):
+            chunk_stop = min(chunk_start + fixed_chunk, fixed.shape[0])
+            chunk = fixed[chunk_start:chunk_stop]
+            outer = (chunk[:, :, None] * chunk[:, None, :]).reshape(len(chunk), k * k)
+            gram += block_indicator[:, chunk_start:chunk_stop] @ outer
+        gram = gram.reshape(-1, k, k) + regularization * np.maximum(counts[start:stop], 1)[:, None, None] * eye
+        rhs = matrix[start:stop] @ fixed
+        result[start:stop] = np.linalg.solve(gram, rhs[:, :, None])[:, :, 0]
+    return result
+
+class ALSModel:
+    """
+    交替最小二乘（ALS）矩阵分解模型
+
+    评分 ≈ 全站平均分 + 用户因子 · 电影因子
+    因子矩阵保存为.npy文件，Web进程用mmap方式加载：多个worker共享同一份操作系统页缓存，
+    不会在每个进程里各复制一份。
+    """
+
+    def __init__(self, user_ids, movie_ids, user_factors, item_factors, meta):
+        self.user_ids = user_ids          # 有序的用户ID，行号 -> 用户ID
+        self.movie_ids = movie_ids        # 有序的电影ID，行号 -> 电影ID
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.meta = meta                  # global_mean、factors、trained_at等
+
+    @classmethod
+    def train(cls, user_ids, movie_ids, ratings, factors=32, regularization=0.1, iterations=10,
+              seed=0, log=None):
+        """
+        训练模型
+
+        Args:
+            user_ids, movie_ids, ratings: 长度相同的一维数组，每个元素是一条评分
+            factors: 隐因子维度
+            regularization: 正则化系数（按每行评分数加权）
+            iterations: 迭代次数
+            log: 每轮迭代后调用 log(轮次, 训练集RMSE)
+        """
+        ratings = np.asarray(ratings, dtype=np.float64)
+        unique_users, user_rows = np.unique(np.asarray(user_ids), return_inverse=True)
+        unique_movies, movie_cols = np.unique(np.asarray(movie_ids), return_inverse=True)
+        global_mean = float(ratings.mean())
+        residuals = ratings - global_mean
+
+        by_user = sp.csr_matrix((residuals, (user_rows, movie_cols)),
+                                shape=(len(unique_users), len(unique_movies)))
+        by_movie = by_user.T.tocsr()
+
+        rng = np.random.default_rng(seed)
+        user_factors = rng.normal(0, 0.1, (len(unique_users), factors))
+        item_factors = rng.normal(0, 0.1, (len(unique_movies), factors))
+        rmse = None
+
+        for iteration in range(1, iterations + 1):
+            user_factors = _solve_least_squares(by_user, item_factors, regularization)
+            item_factors = _solve_least_squares(by_movie, user_factors, regularization)
+            predicted = np.einsum('ij,ij->i', user_factors[user_rows], item_factors[movie_cols])
+            rmse = float(np.sqrt(np.mean((residuals - predicted) ** 2)))
+            if log:
+                log(iteration, rmse)
+
+        meta = {
+            'global_mean': global_mean,
+            'factors': factors,
+            'regularization': regularization,
+            'iterations': iterations,
+            'ratings': int(len(ratings)),
+            'train_rmse': rmse,
+            'trained_at': time.time(),
+        }
+        return cls(unique_users, unique_movies, user_factors.astype(np.float32),
+                   item_factors.astype(np.float32), meta)
+
+    def save(self, prefix):
+        """
+        保存为 <prefix>_<名称>.npy 和 <prefix>_meta.json
+
+        先写临时文件再原子替换：正在用mmap读取旧文件的进程不受影响，
+        meta最后写入，读取方以meta的修改时间判断是否有新模型。
+        """
+        arrays = dict(zip(ALS_FILES, (self.user_factors, self.item_factors, self.user_ids, self.movie_ids)))
+        for name, array in arrays.items():
+            temp_path = f'{prefix}_{name}.tmp.npy'
+            np.save(temp_path, np.ascontiguousarray(array))
+            os.replace(temp_path, f'{prefix}_{name}.npy')
+        temp_path = f'{prefix}_meta.json.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(temp_path, f'{prefix}_meta.json')
+
+    @classmethod
+    def load(cls, prefix):
+        """以只读mmap方式加载模型；文件不存在时返回None"""
+        if not os.path.exists(f'{prefix}_meta.json'):
+            return None
+        with open(f'{prefix}_meta.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = [np.load(f'{prefix}_{name}.npy', mmap_mode='r') for name in ALS_FILES]
+        user_factors, item_factors, user_ids, movie_ids = arrays
+        return cls(user_ids, movie_ids, user_factors, item_factors, meta)
+
+    def recommend(self, user_id, exclude=(), limit=8):
+        """
+        为用户推荐预测分最高的电影
+
+        Returns:
+            [(电影ID, 预测分)]；用户不在模型中（训练后才注册或首次评分）时返回None
+        """
+        row = np.searchsorted(self.user_ids, user_id)
+        if row >= len(self.user_ids) or self.user_ids[row] != user_id:
+            return None
+        scores = self.meta['global_mean'] + self.item_factors @ self.user_factors[row]
+        if exclude:
+            scores[np.isin(self.movie_ids, list(exclude))] = -np.inf
+        limit = min(limit, len(scores))
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.movie_ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影详情页条件请求（ETag/Last-Modified）和上传文件缓存头测试脚本
+"""
+
+import sys
+import os
+import shutil
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as movie_app
+from app import execute_db_query
+from testing_helpers import use_temp_database
+
+def get_version(movie_id):
+    return execute_db_query("SELECT version FROM movies WHERE id = ?", (movie_id,), fetch_one=True)['version']
+
+def test_movie_detail_conditional_get():
+    """测试内容不变时返回304且不执行页面查询，评分、编辑、相似电影变化后ETag改变"""
+    print("=== 详情页条件请求测试 ===")
+    original_database = movie_app.DATABASE
+    temp_dir = use_temp_database()
+    try:
+        movie_id, neighbor_id = [row['id'] for row in execute_db_query(
+            "SELECT id FROM movies ORDER BY id LIMIT 2", fetch_all=True)]
+        user_id = execute_db_query("INSERT INTO users (username, password) VALUES (?, ?)",
+                                   ('etag_user', b'x'), commit=True)
+        with movie_app.app.test_client() as client:
+            print("1. 首次访问返回验证信息...")
+            first = client.get(f'/movie/{movie_id}')
+            etag = first.headers['ETag']
+            assert first.status_code == 200 and etag.startswith('"movie-')
+            assert first.headers['Last-Modified'] and 'no-cache' in first.headers['Cache-Control']
+            assert 'Cookie' in first.headers['Vary']
+
+            print("2. 内容不变时返回304，不再查询电影...")
+            stats = movie_app.query_cache.stats()
+            lookups = stats['hits'] + stats['misses']
+            cached = client.get(f'/movie/{movie_id}', headers={'If-None-Match': etag})
+            assert cached.status_code == 304 and cached.data == b'' and cached.headers['ETag'] == etag
+            stats = movie_app.query_cache.stats()
+            assert stats['hits'] + stats['misses'] == lookups
+            since = client.get(f'/movie/{movie_id}', headers={'If-Modified-Since': first.headers['Last-Modified']})
+            assert since.status_code == 304
+
+            print("3. 评分后版本号增加...")
+            version = get_version(movie_id)
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+                sess['username'] = 'etag_user'
+                sess['role'] = 'user'
+            logged_in = client.get(f'/movie/{movie_id}', headers={'If-None-Match': etag})
+            assert logged_in.status_code == 200 and logged_in.headers['ETag'] != etag
+            client.post(f'/rate_movie/{movie_id}', data={'rating': '4', 'review': '条件请求'})
+            assert get_version(movie_id) == version + 1
+            rated = client.get(f'/movie/{movie_id}', headers={'If-None-Match': logged_in.headers['ETag']})
+            assert rated.status_code == 200 and '条件请求' in rated.get_data(as_text=True)
+            client.get('/logout')
+            assert client.get(f'/movie/{movie_id}', headers={'If-None-Match': etag}).status_code == 200
+
+            print("4. 相似电影被编辑后版本号增加...")
+            execute_db_query("DELETE FROM movie_neighbors WHERE movie_id = ?", (movie_id,), commit=True)
+            execute_db_query("INSERT INTO movie_neighbors (movie_id, neighbor_id, score) VALUES (?, ?, ?)",
+                             (movie_id, neighbor_id, 0.5), commit=True)
+            version = get_version(movie_id)
+            execute_db_query("UPDATE movies SET title = ? WHERE id = ?", ('条件请求相似电影', neighbor_id), commit=True)
+            assert get_version(movie_id) == version + 1
+            # 更新详情页不显示的列（如created_at）不改变版本号
+            execute_db_query("UPDATE movies SET created_at = created_at WHERE id = ?", (movie_id,), commit=True)
+            assert get_version(movie_id) == version + 1
+
+            assert client.get('/movie/999999', headers={'If-None-Match': etag}).status_code == 404
+        print("✓ 详情页条件请求测试通过")
+    finally:
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_upload_cache_control():
+    """测试上传文件带有长期缓存的响应头，不存在的文件没有"""
+    print("=== 上传文件缓存头测试 ===")
+    original_database = movie_app.DATABASE
+    original_folder = movie_app.app.config['UPLOAD_FOLDER']
+    temp_dir = use_temp_database()
+    folder = os.path.join(temp_dir, 'uploads')
+    os.makedirs(folder)
+    movie_app.app.config['UPLOAD_FOLDER'] = folder
+    try:
+        with open(os.path.join(folder, 'poster.jpg'), 'wb') as f:
+            f.write(b'\xff\xd8' + b'0' * 100)
+        with movie_app.app.test_client() as client:
+            response = client.get('/uploads/poster.jpg')
+            assert response.status_code == 200
+            assert response.headers['Cache-Control'] == movie_app.UPLOAD_CACHE_CONTROL
+            revalidated = client.get('/uploads/poster.jpg', headers={'If-None-Match': response.headers['ETag']})
+            assert revalidated.status_code == 304 and 'immutable' in revalidated.headers['Cache-Control']
+            assert 'immutable' not in client.get('/uploads/missing.jpg').headers.get('Cache-Control', '')
+        print("✓ 上传文件缓存头测试通过")
+    finally:
+        movie_app.app.config['UPLOAD_FOLDER'] = original_folder
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_movie_detail_conditional_get()
+    test_upload_cache_control()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板片段缓存测试脚本
+"""
+
+import sys
+import os
+import shutil
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from jinja2 import Environment, DictLoader
+
+import app as movie_app
+from app import execute_db_query
+from fragment_cache import FragmentCacheExtension
+from query_cache import TaggedCache
+from testing_helpers import use_temp_database
+
+def test_cache_tag():
+    """测试相同的键只渲染一次、不同位置的片段互不冲突、按标签失效、没有缓存对象时直接渲染"""
+    print("=== {% cache %} 标签测试 ===")
+    calls = []
+
+    def render_count(name):
+        calls.append(name)
+        return f'{name}-{len(calls)}'
+
+    env = Environment(extensions=[FragmentCacheExtension], autoescape=True, loader=DictLoader({
+        'a.html': "{% cache item.id, item.version tags 'item:' ~ item.id %}<b>{{ count(item.name) }}</b>{% endcache %}",
+        'b.html': "{% cache item.id, item.version %}<i>{{ count(item.name) }}</i>{% endcache %}",
+    }))
+    env.globals['count'] = render_count
+    env.fragment_cache = TaggedCache(default_ttl=60)
+
+    item = {'id': 1, 'version': 1, 'name': '<x>'}
+    first = env.get_template('a.html').render(item=item)
+    assert first == '<b>&lt;x&gt;-1</b>'
+    assert env.get_template('a.html').render(item=item) == first and len(calls) == 1
+    # 另一个模板中的片段键相同，但位置不同
+    assert env.get_template('b.html').render(item=item) == '<i>&lt;x&gt;-2</i>'
+    # 版本号变化后重新渲染
+    assert env.get_template('a.html').render(item=dict(item, version=2)) == '<b>&lt;x&gt;-3</b>'
+
+    assert env.fragment_cache.invalidate('item:1') == 2
+    assert env.get_template('a.html').render(item=item) == '<b>&lt;x&gt;-4</b>'
+
+    env.fragment_cache = None
+    assert env.get_template('a.html').render(item=item) == '<b>&lt;x&gt;-5</b>'
+    print("✓ {% cache %} 标签测试通过")
+
+def test_movie_card_fragments():
+    """测试首页、分类页、搜索页共享电影卡片片段，输出与不使用缓存时一致，评分后卡片更新"""
+    print("=== 电影卡片片段缓存测试 ===")
+    original_database = movie_app.DATABASE
+    temp_dir = use_temp_database()
+    try:
+        category = execute_db_query("SELECT category_id FROM movie_categories LIMIT 1", fetch_one=True)
+        movie = execute_db_query("SELECT * FROM movies WHERE id IN (SELECT movie_id FROM movie_categories "
+                                 "WHERE category_id = ?) LIMIT 1", (category['category_id'],), fetch_one=True)
+        user_id = execute_db_query("INSERT INTO users (username, password) VALUES (?, ?)",
+                                   ('fragment_user', b'x'), commit=True)
+        with movie_app.app.test_client() as client:
+            # 登录后不走整页缓存，每次都渲染模板
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+                sess['username'] = 'fragment_user'
+                sess['role'] = 'user'
+
+            movie_app.app.jinja_env.fragment_cache = None
+            uncached = client.get('/').get_data(as_text=True)
+            movie_app.app.jinja_env.fragment_cache = movie_app.fragment_cache
+            assert client.get('/').get_data(as_text=True) == uncached
+            assert client.get('/').get_data(as_text=True) == uncached
+
+            stats = movie_app.fragment_cache.stats()
+            client.get(f"/category/{category['category_id']}")
+            # 分类页的卡片都已经在首页渲染过
+            assert movie_app.fragment_cache.stats()['misses'] == stats['misses']
+            assert movie_app.fragment_cache.stats()['hits'] > stats['hits']
+
+            title = movie['title'][:2]
+            searched = client.get('/search', query_string={'q': title}).get_data(as_text=True)
+            assert f'<mark>{title}</mark>' in searched
+
+            client.post(f"/rate_movie/{movie['id']}", data={'rating': '1', 'review': ''})
+            rating = execute_db_query("SELECT rating FROM movies WHERE id = ?", (movie['id'],), fetch_one=True)['rating']
+            misses = movie_app.fragment_cache.stats()['misses']
+            assert f'({rating:.1f})' in client.get('/').get_data(as_text=True)
+            # 版本号变了，这部电影的两个片段重新渲染
+            assert movie_app.fragment_cache.stats()['misses'] >= misses + 2
+            # 批量修改（迁移、重建）发布movies标签，全部卡片重新渲染
+            assert movie_app.fragment_cache.invalidate('movies') > 0
+            assert movie_app.fragment_cache.stats()['entries'] == 0
+            print(f"   {movie_app.fragment_cache.stats()}")
+        print("✓ 电影卡片片段缓存测试通过")
+    finally:
+        movie_app.app.jinja_env.fragment_cache = movie_app.fragment_cache
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_cache_tag()
+    test_movie_card_fragments()
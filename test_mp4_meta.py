@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MP4元数据解析和faststart重排测试脚本（使用uploads/中的示例视频）
+"""
+
+import io
+import sys
+import mmap
+import struct
+import os
+import glob
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as movie_app
+from app import execute_db_query
+from mp4_meta import probe_mp4, make_faststart, iter_boxes, find_box, _shift_chunk_offsets
+from hls_packager import package_hls, Track, HLS_PLAYLIST_NAME, HLS_INIT_NAME
+from upload_store import upload_filename_from_url
+from testing_helpers import use_temp_database
+
+SAMPLE_VIDEO = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', '*.mp4')))[0]
+
+def split_layout(data):
+    """返回(moov起始, moov结束, 第一个mdat起始)"""
+    boxes = [(box_type, start, end) for box_type, start, _, end in iter_boxes(data, 0, len(data))]
+    moov = next((start, end) for box_type, start, end in boxes if box_type == b'moov')
+    mdat = next(start for box_type, start, _ in boxes if box_type == b'mdat')
+    assert moov[0] < mdat
+    return moov[0], moov[1], mdat
+
+def move_moov_to_end(data):
+    """构造moov在文件末尾的视频（与make_faststart相反的操作）"""
+    moov_start, moov_end, _ = split_layout(data)
+    moov_bytes = bytearray(data[moov_start:moov_end])
+    _shift_chunk_offsets(moov_bytes, 8, len(moov_bytes), -len(moov_bytes))
+    return data[:moov_start] + data[moov_end:] + bytes(moov_bytes)
+
+def expected_faststart(data):
+    """make_faststart把moov放在紧挨mdat之前：moov与mdat之间的其他box（如free）会排到moov前面"""
+    moov_start, moov_end, mdat = split_layout(data)
+    return data[:moov_start] + data[moov_end:mdat] + data[moov_start:moov_end] + data[mdat:]
+
+def test_probe_and_faststart():
+    """测试元数据解析，以及把moov移回文件开头后数据块偏移量仍然正确"""
+    print("=== MP4解析测试 ===")
+    with open(SAMPLE_VIDEO, 'rb') as f:
+        original = f.read()
+    info = probe_mp4(SAMPLE_VIDEO)
+    print(f"   {info}")
+    assert info['faststart'] and info['duration'] > 0
+    assert info['width'] and info['height']
+    assert info['video_codec'].startswith('avc1.') and info['audio_codec'].startswith('mp4a.')
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_dir, 'tail.mp4')
+        with open(path, 'wb') as f:
+            f.write(move_moov_to_end(original))
+        tail_info = probe_mp4(path)
+        assert not tail_info['faststart']
+        assert dict(tail_info, faststart=True) == info
+
+        assert make_faststart(path)
+        assert not make_faststart(path)
+        with open(path, 'rb') as f:
+            assert f.read() == expected_faststart(original)
+        assert probe_mp4(path) == info
+        assert os.listdir(temp_dir) == ['tail.mp4']
+
+        bad = os.path.join(temp_dir, 'bad.mp4')
+        with open(bad, 'wb') as f:
+            f.write(b'not a video at all')
+        try:
+            probe_mp4(bad)
+            assert False, "应该抛出ValueError"
+        except ValueError:
+            pass
+        print("✓ MP4解析测试通过")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_upload_probe_job():
+    """测试上传moov在末尾的视频后，后台任务重排并改写电影的video_url"""
+    print("=== 上传视频解析任务测试 ===")
+    original_database = movie_app.DATABASE
+    original_folder = movie_app.app.config['UPLOAD_FOLDER']
+    temp_dir = use_temp_database()
+    folder = os.path.join(temp_dir, 'uploads')
+    movie_app.app.config['UPLOAD_FOLDER'] = folder
+    with open(SAMPLE_VIDEO, 'rb') as f:
+        original = f.read()
+    try:
+        with movie_app.app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['username'] = 'admin'
+                sess['role'] = 'admin'
+            client.post('/admin/add_movie', data={
+                'title': '视频解析测试', 'director': '导演', 'year': '2024', 'genre': '剧情', 'description': '简介',
+                'video_file': (io.BytesIO(move_moov_to_end(original)), 'tail.mp4'),
+            }, content_type='multipart/form-data')
+            movie = execute_db_query("SELECT * FROM movies WHERE title = ?", ('视频解析测试',), fetch_one=True)
+            uploaded = upload_filename_from_url(movie['video_url'])
+
+            assert movie_app.run_pending_jobs() == 2  # 完整性检查 + 视频解析
+            movie = execute_db_query("SELECT * FROM movies WHERE id = ?", (movie['id'],), fetch_one=True)
+            filename = upload_filename_from_url(movie['video_url'])
+            print(f"   {uploaded} -> {filename}")
+            assert filename != uploaded and movie['processing_state'] == 'ready'
+            with open(os.path.join(folder, filename), 'rb') as f:
+                assert f.read() == expected_faststart(original)
+            info = execute_db_query("SELECT * FROM video_info WHERE filename = ?", (filename,), fetch_one=True)
+            assert info['faststart'] == 1 and info['video_codec'].startswith('avc1.')
+            # 原文件不再被引用，等待清理
+            refs = execute_db_query("SELECT ref_count FROM upload_files WHERE filename = ?", (uploaded,), fetch_one=True)
+            assert refs['ref_count'] == 0
+
+            html = client.get(f"/movie/{movie['id']}").get_data(as_text=True)
+            assert f'codecs="{info["video_codec"]}' in html
+        print("✓ 上传视频解析任务测试通过")
+    finally:
+        movie_app.app.config['UPLOAD_FOLDER'] = original_folder
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def segment_samples(data):
+    """解析一个媒体分片，返回 {track_id: [样本数据]}"""
+    moof = find_box(data, 0, len(data), [b'moof'])
+    moof_start = moof[0] - 8
+    samples = {}
+    for box_type, _, content, box_end in iter_boxes(data, *moof):
+        if box_type != b'traf':
+            continue
+        tfhd = find_box(data, content, box_end, [b'tfhd'])
+        trun = find_box(data, content, box_end, [b'trun'])
+        track_id = struct.unpack_from('>I', data, tfhd[0] + 4)[0]
+        flags = struct.unpack_from('>I', data, trun[0])[0] & 0xFFFFFF
+        count, data_offset = struct.unpack_from('>Ii', data, trun[0] + 4)
+        step = 16 if flags & 0x000800 else 12
+        offset = moof_start + data_offset
+        for index in range(count):
+            size = struct.unpack_from('>I', data, trun[0] + 12 + index * step + 4)[0]
+            samples.setdefault(track_id, []).append(data[offset:offset + size])
+            offset += size
+    return samples
+
+def test_hls_package():
+    """测试HLS打包：所有样本原样出现在分片中，且每个分片从视频关键帧开始"""
+    print("=== HLS打包测试 ===")
+    with open(SAMPLE_VIDEO, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        moov = find_box(buf, 0, len(buf), [b'moov'])
+        tracks = [Track(buf, content, end) for box_type, _, content, end in iter_boxes(buf, *moov) if box_type == b'trak']
+        expected = {track.track_id: [bytes(buf[o:o + n]) for o, n in zip(track.offsets, track.sizes)] for track in tracks}
+        video = next(track for track in tracks if track.handler == b'vide')
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        output_dir = os.path.join(temp_dir, 'hls', 'sample')
+        stats = package_hls(SAMPLE_VIDEO, output_dir, segment_duration=2.0)
+        print(f"   {stats}")
+        with open(os.path.join(output_dir, HLS_PLAYLIST_NAME), encoding='utf-8') as f:
+            playlist = f.read().splitlines()
+        assert playlist[0] == '#EXTM3U' and playlist[-1] == '#EXT-X-ENDLIST'
+        assert f'#EXT-X-MAP:URI="{HLS_INIT_NAME}"' in playlist
+        names = [line for line in playlist if line and not line.startswith('#')]
+        assert len(names) == stats['segments'] >= 1
+        durations = [float(line[len('#EXTINF:'):-1]) for line in playlist if line.startswith('#EXTINF:')]
+        assert abs(sum(durations) - stats['duration']) < 0.01
+
+        actual = {}
+        for name in names:
+            with open(os.path.join(output_dir, name), 'rb') as f:
+                segment = segment_samples(f.read())
+            # 每个分片的第一个视频样本是关键帧
+            assert video.sync[len(actual.get(video.track_id, []))]
+            for track_id, samples in segment.items():
+                actual.setdefault(track_id, []).extend(samples)
+        assert actual == expected
+
+        with open(os.path.join(output_dir, HLS_INIT_NAME), 'rb') as f:
+            init = f.read()
+        assert find_box(init, 0, len(init), [b'moov', b'mvex', b'trex'])
+        assert os.listdir(os.path.join(temp_dir, 'hls')) == ['sample']
+        print("✓ HLS打包测试通过")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_upload_hls_job():
+    """测试开启HLS_PACKAGING后，视频解析完成即安排打包任务，详情页带上播放列表"""
+    print("=== 上传视频HLS任务测试 ===")
+    original_database = movie_app.DATABASE
+    original_folder = movie_app.app.config['UPLOAD_FOLDER']
+    original_packaging = movie_app.HLS_PACKAGING
+    temp_dir = use_temp_database()
+    folder = os.path.join(temp_dir, 'uploads')
+    movie_app.app.config['UPLOAD_FOLDER'] = folder
+    movie_app.HLS_PACKAGING = True
+    try:
+        with movie_app.app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['username'] = 'admin'
+                sess['role'] = 'admin'
+            with open(SAMPLE_VIDEO, 'rb') as f:
+                client.post('/admin/add_movie', data={
+                    'title': 'HLS测试', 'director': '导演', 'year': '2024', 'genre': '剧情', 'description': '简介',
+                    'video_file': (io.BytesIO(f.read()), 'sample.mp4'),
+                }, content_type='multipart/form-data')
+            movie = execute_db_query("SELECT * FROM movies WHERE title = ?", ('HLS测试',), fetch_one=True)
+            filename = upload_filename_from_url(movie['video_url'])
+
+            assert movie_app.run_pending_jobs() == 3  # 完整性检查 + 视频解析 + HLS打包
+            stream = execute_db_query("SELECT * FROM hls_streams WHERE source = ?", (filename,), fetch_one=True)
+            assert stream['segments'] >= 1 and stream['playlist'].endswith(HLS_PLAYLIST_NAME)
+            # 已经打包过的视频不会重复安排
+            assert movie_app.enqueue_hls_backfill() == 0
+
+            html = client.get(f"/movie/{movie['id']}").get_data(as_text=True)
+            assert f'/uploads/{stream["playlist"]}' in html and 'hls.min.js' in html
+            response = client.get(f'/uploads/{stream["playlist"]}')
+            assert response.status_code == 200 and b'#EXTM3U' in response.data
+            response.close()
+
+            # 电影删除后回收原视频，分片目录一起删除
+            client.get(f"/admin/delete_movie/{movie['id']}")
+            stats = movie_app.collect_upload_garbage(grace=0, quarantine=False)
+            assert stats['reclaimed_bytes'] >= stream['size']
+            assert not os.path.exists(os.path.join(folder, movie_app.hls_output_dir(filename)))
+            assert not execute_db_query("SELECT 1 FROM hls_streams", fetch_one=True)
+        print("✓ 上传视频HLS任务测试通过")
+    finally:
+        movie_app.HLS_PACKAGING = original_packaging
+        movie_app.app.config['UPLOAD_FOLDER'] = original_folder
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_probe_and_faststart()
+    test_upload_probe_job()
+    test_hls_package()
+    test_upload_hls_job()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+整页响应缓存测试脚本
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+import subprocess
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as movie_app
+from app import execute_db_query
+from page_cache import PageCache
+from testing_helpers import use_temp_database
+
+def test_page_cache_tiers():
+    """测试内存层超出大小时降级到磁盘、磁盘命中后放回内存、按标签失效两层都删除"""
+    print("=== 页面缓存分层测试 ===")
+    temp_dir = tempfile.mkdtemp()
+    cache = PageCache(memory_bytes=250, disk_dir=temp_dir, disk_bytes=250, ttl=60)
+    try:
+        for name in 'abcde':
+            cache.set(name, name.encode() * 100, tags=['movies' if name != 'e' else 'other'])
+        # 内存层放得下两个页面，磁盘层也是两个：最早的a被淘汰
+        stats = cache.stats()
+        assert stats['memory_entries'] == 2 and stats['disk_entries'] == 2 and stats['evictions'] == 1
+        assert cache.get('a') is None
+        assert cache.get('b') == b'b' * 100          # 从磁盘读回
+        assert cache.get('b') == b'b' * 100          # 已经放回内存
+        stats = cache.stats()
+        assert stats['disk_hits'] == 1 and stats['memory_hits'] == 1
+
+        assert cache.invalidate('movies') == 3
+        assert cache.get('e') == b'e' * 100
+        assert len(os.listdir(os.path.join(temp_dir, str(os.getpid())))) == cache.stats()['disk_entries']
+
+        generation = cache.generation
+        cache.invalidate('other')
+        cache.set('e', b'stale', generation=generation)
+        assert cache.get('e') is None
+        print(f"   {cache.stats()}")
+        cache.clear()
+        assert not os.path.exists(os.path.join(temp_dir, str(os.getpid())))
+        print("✓ 页面缓存分层测试通过")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_dead_process_dirs():
+    """测试启动时删除已经退出的进程留下的磁盘层目录，运行中的进程的目录保留"""
+    print("=== 页面缓存残留目录测试 ===")
+    if os.name == 'nt':
+        print("Windows上不检查进程是否存在，跳过")
+        return
+    temp_dir = tempfile.mkdtemp()
+    try:
+        child = subprocess.Popen([sys.executable, '-c', 'pass'])
+        child.wait()
+        for name in (str(child.pid), str(os.getppid()), 'other'):
+            os.makedirs(os.path.join(temp_dir, name))
+            with open(os.path.join(temp_dir, name, 'page'), 'wb') as f:
+                f.write(b'x')
+        cache = PageCache(memory_bytes=10, disk_dir=temp_dir, disk_bytes=1000, ttl=60)
+        assert sorted(os.listdir(temp_dir)) == sorted([str(os.getppid()), 'other'])
+        cache.set('a', b'a' * 100)
+        assert os.path.isdir(os.path.join(temp_dir, str(os.getpid())))
+        cache.clear()
+        print("✓ 页面缓存残留目录测试通过")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_anonymous_page_cache():
+    """测试未登录用户的首页走缓存，登录用户不走缓存，评分后缓存失效"""
+    print("=== 未登录页面缓存测试 ===")
+    original_database = movie_app.DATABASE
+    temp_dir = use_temp_database()
+    try:
+        movie_id = execute_db_query("SELECT id FROM movies LIMIT 1", fetch_one=True)['id']
+        user_id = execute_db_query("INSERT INTO users (username, password) VALUES (?, ?)",
+                                   ('page_cache_user', b'x'), commit=True)
+        with movie_app.app.test_client() as client:
+            first = client.get('/')
+            assert first.headers['X-Page-Cache'] == 'MISS' and 'Cookie' in first.headers['Vary']
+            second = client.get('/')
+            assert second.headers['X-Page-Cache'] == 'HIT' and second.data == first.data
+            assert client.get('/search?q=%E7%94%B5%E5%BD%B1').headers.get('X-Page-Cache') == 'MISS'
+            assert client.get('/search').status_code == 302
+
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+                sess['username'] = 'page_cache_user'
+                sess['role'] = 'user'
+            assert 'X-Page-Cache' not in client.get('/').headers
+            client.post(f'/rate_movie/{movie_id}', data={'rating': '5', 'review': ''})
+            client.get('/logout')
+
+            assert client.get('/').headers['X-Page-Cache'] == 'MISS'
+            stats = movie_app.page_cache.stats()
+            print(f"   {stats}")
+            assert stats['invalidations'] >= 2 and 0 < stats['hit_ratio'] < 1
+        print("✓ 未登录页面缓存测试通过")
+    finally:
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_page_cache_tiers()
+    test_dead_process_dirs()
+    test_anonymous_page_cache()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+密码哈希进程池测试脚本
+"""
+
+import sys
+import os
+import shutil
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as movie_app
+from password_hashing import PasswordHasher, HashingBusy
+from testing_helpers import use_temp_database
+
+def test_password_hasher():
+    """测试在子进程中计算哈希，以及队列满时立即拒绝"""
+    print("=== 密码哈希进程池测试 ===")
+    hasher = PasswordHasher(processes=1, max_pending=2, rounds=4)
+    try:
+        hashed = hasher.hash_password('secret123')
+        assert hasher.check_password('secret123', hashed)
+        assert not hasher.check_password('wrong', hashed)
+        assert hasher.check_password('secret123', hashed.decode('utf-8'))
+
+        # 占满名额：新的请求不排队，直接拒绝
+        for _ in range(2):
+            hasher._slots.acquire()
+        try:
+            hasher.check_password('secret123', hashed)
+            assert False, "应该抛出HashingBusy"
+        except HashingBusy:
+            pass
+        finally:
+            for _ in range(2):
+                hasher._slots.release()
+
+        stats = hasher.stats()
+        print(f"   {stats}")
+        assert stats['submitted'] == 4 and stats['completed'] == 4 and stats['rejected'] == 1
+        assert stats['pending'] == 0 and stats['peak_pending'] == 1
+        print("✓ 密码哈希进程池测试通过")
+    finally:
+        hasher.shutdown()
+
+def test_login_admission():
+    """测试注册/登录使用进程池，繁忙时返回503"""
+    print("=== 登录准入控制测试 ===")
+    original_database = movie_app.DATABASE
+    original_hasher = movie_app.password_hasher
+    temp_dir = use_temp_database()
+    movie_app.password_hasher = PasswordHasher(processes=0, max_pending=1, rounds=4)
+    try:
+        with movie_app.app.test_client() as client:
+            response = client.post('/register', data={'username': 'pool_user', 'password': 'secret123'})
+            assert response.status_code == 302
+            client.get('/logout')
+
+            response = client.post('/login', data={'username': 'pool_user', 'password': 'secret123'})
+            assert response.status_code == 302
+            client.get('/logout')
+
+            movie_app.password_hasher._slots.acquire()
+            try:
+                response = client.post('/login', data={'username': 'pool_user', 'password': 'secret123'})
+                assert response.status_code == 503 and response.headers['Retry-After']
+                assert '请稍后再试' in response.get_data(as_text=True)
+            finally:
+                movie_app.password_hasher._slots.release()
+
+            # 页面请求不受影响，指标接口只对管理员开放
+            assert client.get('/').status_code == 200
+            assert client.get('/admin/api/metrics').status_code == 403
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['username'] = 'admin'
+                sess['role'] = 'admin'
+            metrics = client.get('/admin/api/metrics').get_json()
+            print(f"   {metrics['password_hashing']}")
+            assert metrics['password_hashing']['rejected'] == 1
+            assert metrics['password_hashing']['completed'] == 2
+        print("✓ 登录准入控制测试通过")
+    finally:
+        movie_app.password_hasher = original_hasher
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_password_hasher()
+    test_login_admission()
@@ -1,126 +1,141 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-个人中心功能测试脚本
+个人中心功能测试脚本（在临时数据库副本上运行，不修改movie_system.db）
 """
 
 import sys
 import os
+import shutil
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+import app as movie_app
 from app import app, execute_db_query
+from testing_helpers import use_temp_database
 import json
 
 def test_profile_functionality():
     """测试个人中心功能"""
     print("=== 个人中心功能测试 ===")
-    
-    with app.test_client() as client:
-        # 测试未登录访问个人中心
-        print("1. 测试未登录访问个人中心...")
-        response = client.get('/profile', follow_redirects=True)
-        print(f"   状态码: {response.status_code}")
-        print(f"   是否重定向到登录页: {'login' in response.get_data(as_text=True).lower()}")
+    original_database = movie_app.DATABASE
+    temp_dir = use_temp_database()
+    try:
+        with app.test_client() as client:
+            # 测试未登录访问个人中心
+            print("1. 测试未登录访问个人中心...")
+            response = client.get('/profile', follow_redirects=True)
+            print(f"   状态码: {response.status_code}")
+            print(f"   是否重定向到登录页: {'login' in response.get_data(as_text=True).lower()}")
         
-        # 创建测试用户会话
-        with client.session_transaction() as sess:
-            sess['user_id'] = 1
-            sess['username'] = 'testuser'
-            sess['role'] = 'user'
+            # 创建测试用户会话
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['username'] = 'testuser'
+                sess['role'] = 'user'
         
-        # 测试已登录访问个人中心
-        print("\n2. 测试已登录访问个人中心...")
-        response = client.get('/profile')
-        print(f"   状态码: {response.status_code}")
+            # 测试已登录访问个人中心
+            print("\n2. 测试已登录访问个人中心...")
+            response = client.get('/profile')
+            print(f"   状态码: {response.status_code}")
         
-        # 检查个人中心页面内容
-        content = response.get_data(as_text=True)
-        has_profile_elements = (
-            '个人信息' in content and
-            '我的评分' in content and
-            '我的评论' in content
-        )
-        print(f"   包含个人中心关键元素: {has_profile_elements}")
+            # 检查个人中心页面内容
+            content = response.get_data(as_text=True)
+            has_profile_elements = (
+                '个人信息' in content and
+                '我的评分' in content and
+                '我的评论' in content
+            )
+            print(f"   包含个人中心关键元素: {has_profile_elements}")
         
-        # 测试更新个人信息功能
-        print("\n3. 测试更新个人信息功能...")
-        response = client.post('/update_profile', data={
-            'email': 'test@example.com',
-            'new_password': '',
-            'confirm_password': ''
-        })
-        print(f"   更新邮箱状态码: {response.status_code}")
+            # 测试更新个人信息功能
+            print("\n3. 测试更新个人信息功能...")
+            response = client.post('/update_profile', data={
+                'email': 'test@example.com',
+                'new_password': '',
+                'confirm_password': ''
+            })
+            print(f"   更新邮箱状态码: {response.status_code}")
         
-        # 测试密码修改
-        print("\n4. 测试密码修改功能...")
-        response = client.post('/update_profile', data={
-            'email': 'test@example.com',
-            'new_password': 'newpassword123',
-            'confirm_password': 'newpassword123'
-        })
-        print(f"   修改密码状态码: {response.status_code}")
+            # 测试密码修改
+            print("\n4. 测试密码修改功能...")
+            response = client.post('/update_profile', data={
+                'email': 'test@example.com',
+                'new_password': 'newpassword123',
+                'confirm_password': 'newpassword123'
+            })
+            print(f"   修改密码状态码: {response.status_code}")
         
-        # 测试删除评分功能（需要先有评分数据）
-        print("\n5. 测试删除评分功能...")
+            # 测试删除评分功能（需要先有评分数据）
+            print("\n5. 测试删除评分功能...")
         
-        # 查找用户的评分记录
-        user_ratings = execute_db_query(
-            "SELECT * FROM ratings WHERE user_id = ? LIMIT 1",
-            (1,),
-            fetch_one=True
-        )
+            # 查找用户的评分记录
+            user_ratings = execute_db_query(
+                "SELECT * FROM ratings WHERE user_id = ? LIMIT 1",
+                (1,),
+                fetch_one=True
+            )
         
-        if user_ratings:
-            rating_id = user_ratings['id']
-            response = client.get(f'/delete_rating/{rating_id}', follow_redirects=True)
-            print(f"   删除评分状态码: {response.status_code}")
-            print(f"   评分ID {rating_id} 删除成功")
-        else:
-            print("   用户暂无评分记录，跳过删除测试")
+            if user_ratings:
+                rating_id = user_ratings['id']
+                response = client.get(f'/delete_rating/{rating_id}', follow_redirects=True)
+                print(f"   删除评分状态码: {response.status_code}")
+                print(f"   评分ID {rating_id} 删除成功")
+            else:
+                print("   用户暂无评分记录，跳过删除测试")
+    finally:
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
 
 def test_database_queries():
     """测试数据库查询功能"""
     print("\n=== 数据库查询测试 ===")
+    original_database = movie_app.DATABASE
+    temp_dir = use_temp_database()
+    try:
+        # 测试用户信息查询
+        print("1. 测试用户信息查询...")
+        user = execute_db_query("SELECT * FROM users WHERE id = 1", fetch_one=True)
+        if user:
+            print(f"   用户名: {user['username']}")
+            print(f"   邮箱: {user['email'] or '未设置'}")
+            print(f"   注册时间: {user['created_at']}")
+        else:
+            print("   未找到测试用户")
     
-    # 测试用户信息查询
-    print("1. 测试用户信息查询...")
-    user = execute_db_query("SELECT * FROM users WHERE id = 1", fetch_one=True)
-    if user:
-        print(f"   用户名: {user['username']}")
-        print(f"   邮箱: {user['email'] or '未设置'}")
-        print(f"   注册时间: {user['created_at']}")
-    else:
-        print("   未找到测试用户")
-    
-    # 测试评分记录查询
-    print("\n2. 测试评分记录查询...")
-    ratings = execute_db_query(
-        '''SELECT r.*, m.title 
-           FROM ratings r 
-           JOIN movies m ON r.movie_id = m.id 
-           WHERE r.user_id = 1 
-           ORDER BY r.created_at DESC''',
-        fetch_all=True
-    )
+        # 测试评分记录查询
+        print("\n2. 测试评分记录查询...")
+        ratings = execute_db_query(
+            '''SELECT r.*, m.title 
+               FROM ratings r 
+               JOIN movies m ON r.movie_id = m.id 
+               WHERE r.user_id = 1 
+               ORDER BY r.created_at DESC''',
+            fetch_all=True
+        )
     
-    print(f"   找到 {len(ratings)} 条评分记录")
-    for rating in ratings[:3]:  # 只显示前3条
-        print(f"   - {rating['title']}: {rating['rating']}/5 分")
+        print(f"   找到 {len(ratings)} 条评分记录")
+        for rating in ratings[:3]:  # 只显示前3条
+            print(f"   - {rating['title']}: {rating['rating']}/5 分")
     
-    # 测试评论记录查询
-    print("\n3. 测试评论记录查询...")
-    reviews = execute_db_query(
-        '''SELECT r.*, m.title 
-           FROM ratings r 
-           JOIN movies m ON r.movie_id = m.id 
-           WHERE r.user_id = 1 AND r.review IS NOT NULL AND r.review != ''
-           ORDER BY r.created_at DESC''',
-        fetch_all=True
-    )
+        # 测试评论记录查询
+        print("\n3. 测试评论记录查询...")
+        reviews = execute_db_query(
+            '''SELECT r.*, m.title 
+               FROM ratings r 
+               JOIN movies m ON r.movie_id = m.id 
+               WHERE r.user_id = 1 AND r.review IS NOT NULL AND r.review != ''
+               ORDER BY r.created_at DESC''',
+            fetch_all=True
+        )
     
-    print(f"   找到 {len(reviews)} 条评论记录")
-    for review in reviews[:3]:  # 只显示前3条
-        print(f"   - {review['title']}: {review['review'][:50]}...")
+        print(f"   找到 {len(reviews)} 条评论记录")
+        for review in reviews[:3]:  # 只显示前3条
+            print(f"   - {review['title']}: {review['review'][:50]}...")
+    finally:
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
 
 if __name__ == '__main__':
     try:
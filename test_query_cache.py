@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+查询结果缓存测试脚本
+"""
+
+import sys
+import os
+import time
+import shutil
+import sqlite3
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as movie_app
+from app import execute_db_query
+from query_cache import TaggedCache
+from cache_bus import InvalidationBus, publish
+from testing_helpers import use_temp_database
+
+def test_tagged_cache():
+    """测试LRU淘汰、过期、按标签失效，以及失效后不写入查询前读到的旧结果"""
+    print("=== 缓存基本功能测试 ===")
+    cache = TaggedCache(max_entries=2, default_ttl=60)
+    cache.set('a', 1, tags=['x'])
+    cache.set('b', 2, tags=['y'])
+    assert cache.get('a') == 1
+    cache.set('c', 3, tags=['x'])           # 淘汰最久没有使用的b
+    assert cache.get('b') is None and cache.get('c') == 3
+
+    assert cache.invalidate('x') == 2
+    assert cache.get('a') is None and cache.get('c') is None
+
+    generation = cache.generation
+    cache.invalidate('y')                   # 查询期间发生了失效
+    assert not cache.set('d', 4, generation=generation)
+    assert cache.set('d', 4, ttl=0.05, generation=cache.generation)
+    time.sleep(0.06)
+    assert cache.get('d', 'missing') == 'missing'
+
+    stats = cache.stats()
+    print(f"   {stats}")
+    assert stats['evictions'] == 1 and stats['entries'] == 0
+    print("✓ 缓存基本功能测试通过")
+
+def test_query_cache_invalidation():
+    """测试分类和电影查询走缓存，评分和编辑后立即看到新数据"""
+    print("=== 查询缓存失效测试 ===")
+    original_database = movie_app.DATABASE
+    temp_dir = use_temp_database()
+    try:
+        categories = movie_app.get_categories()
+        categories[0]['name'] = '被调用方修改'
+        hits = movie_app.query_cache.stats()['hits']
+        assert movie_app.get_categories()[0]['name'] != '被调用方修改'
+        assert movie_app.query_cache.stats()['hits'] == hits + 1
+
+        movie_id = execute_db_query("SELECT id FROM movies LIMIT 1", fetch_one=True)['id']
+        user_id = execute_db_query("INSERT INTO users (username, password) VALUES (?, ?)",
+                                   ('cache_admin', b'x'), commit=True)
+        before = movie_app.get_movie(movie_id)
+        with movie_app.app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+                sess['username'] = 'admin'
+                sess['role'] = 'admin'
+            client.post(f'/rate_movie/{movie_id}', data={'rating': '1', 'review': ''})
+            after = movie_app.get_movie(movie_id)
+            assert after['rating_count'] == before['rating_count'] + 1
+
+            client.post(f'/admin/edit_movie/{movie_id}', data={
+                'title': '缓存失效测试', 'director': before['director'], 'year': str(before['year']),
+                'genre': before['genre'], 'description': before['description'],
+                'image_url': before['image_url'] or '', 'video_url': before['video_url'] or '',
+            })
+            assert movie_app.get_movie(movie_id)['title'] == '缓存失效测试'
+            assert '缓存失效测试' in client.get(f'/movie/{movie_id}').get_data(as_text=True)
+
+        # 评分和失效记录在同一个事务中提交
+        with movie_app.app.test_request_context():
+            conn = movie_app.get_db_connection()
+            statements = []
+            conn.set_trace_callback(statements.append)
+            movie_app.save_user_rating(user_id, movie_id, 3, '')
+            conn.set_trace_callback(None)
+        assert statements.count('COMMIT') == 1
+        assert any(sql.startswith('INSERT INTO cache_invalidations') for sql in statements)
+        print("✓ 查询缓存失效测试通过")
+    finally:
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_invalidation_bus():
+    """测试另一个进程（独立连接）修改电影并发布失效记录后，本进程的缓存在下次请求时失效"""
+    print("=== 跨进程缓存失效测试 ===")
+    original_database = movie_app.DATABASE
+    temp_dir = use_temp_database()
+    try:
+        movie_id = execute_db_query("SELECT id FROM movies LIMIT 1", fetch_one=True)['id']
+        with movie_app.app.test_client() as client:
+            client.get('/')  # 第一次读取：定位到当前的最新记录
+            assert movie_app.get_movie(movie_id)['title'] != '其他进程修改'
+            assert client.get('/api/suggest?q=其他').get_json()['suggestions'] == []
+
+            other = movie_app.open_worker_connection()
+            try:
+                with other:
+                    other.execute("UPDATE movies SET title = '其他进程修改' WHERE id = ?", (movie_id,))
+                    publish(other, [f'movie:{movie_id}'])
+            finally:
+                other.close()
+            # 缓存还没有收到通知
+            assert movie_app.get_movie(movie_id)['title'] != '其他进程修改'
+            movie_app.cache_bus._last_poll = 0.0
+            assert '其他进程修改' in client.get(f'/movie/{movie_id}').get_data(as_text=True)
+            assert movie_app.get_movie(movie_id)['title'] == '其他进程修改'
+            # 自动补全索引只重新读取这部电影，不整体重建
+            built_at = movie_app.suggest_index.built_at
+            suggestions = client.get('/api/suggest?q=其他').get_json()['suggestions']
+            assert [item['title'] for item in suggestions] == ['其他进程修改']
+            assert movie_app.suggest_index.built_at == built_at
+
+            # 批量修改后重建自动补全索引、重新训练推荐模型；错过记录时全部丢弃
+            movie_app.invalidate_cache('movies')
+            assert movie_app.suggest_index.built_at is None and movie_app.recommender_state['stale']
+            movie_app.recommender_state['model'] = object()
+            movie_app.derived_data.clear()
+            assert movie_app.recommender_state['model'] is None and not movie_app.recommender_state['stale']
+
+        # 没到检查时间、或者是上传文件请求时，不从连接池取连接
+        movie_app.cache_bus._last_poll = time.monotonic()
+        with movie_app.app.test_request_context(f'/movie/{movie_id}'):
+            movie_app.app.preprocess_request()
+            assert 'db_conn' not in movie_app.g
+        movie_app.cache_bus._last_poll = 0.0
+        with movie_app.app.test_request_context('/uploads/poster.jpg'):
+            movie_app.app.preprocess_request()
+            assert 'db_conn' not in movie_app.g
+
+        # 订阅端错过了已删除的记录时清空缓存
+        cache = TaggedCache()
+        bus = InvalidationBus(poll_interval=0)
+        bus.subscribe(cache)
+        conn = sqlite3.connect(movie_app.DATABASE)
+        try:
+            bus.poll(lambda: conn)
+            cache.set('a', 1, tags=['x'])
+            cache.set('b', 2, tags=['y'])
+            with conn:
+                publish(conn, ['x'])
+            assert bus.poll(lambda: conn) == 1 and cache.get('a') is None and cache.get('b') == 2
+            with conn:
+                publish(conn, ['expired'])
+                publish(conn, ['z'])
+                conn.execute("DELETE FROM cache_invalidations WHERE tag = 'expired'")  # 模拟已被删除的旧记录
+            assert bus.poll(lambda: conn) == 1 and cache.get('b') is None
+            assert bus.stats()['resets'] == 1
+        finally:
+            conn.close()
+        print("✓ 跨进程缓存失效测试通过")
+    finally:
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_tagged_cache()
+    test_query_cache_invalidation()
+    test_invalidation_bus()
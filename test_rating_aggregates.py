@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+评分聚合字段测试脚本（在临时数据库副本上运行，不修改movie_system.db）
+"""
+
+import sys
+import os
+import shutil
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as movie_app
+from app import execute_db_query
+from testing_helpers import use_temp_database
+
+def get_movie(movie_id):
+    return execute_db_query("SELECT * FROM movies WHERE id = ?", (movie_id,), fetch_one=True)
+
+def test_rating_aggregates():
+    """测试评分聚合字段在插入、更新、删除评分时保持一致"""
+    print("=== 评分聚合字段测试 ===")
+    original_database = movie_app.DATABASE
+    temp_dir = use_temp_database()
+    try:
+        # 回填后应该与评分表一致
+        print("1. 检查初始化后的聚合字段...")
+        assert movie_app.verify_rating_aggregates() == []
+
+        movie = get_movie(1)
+        user = execute_db_query(
+            "INSERT INTO users (username, password) VALUES (?, ?)",
+            ('aggregate_tester', 'x'),
+            commit=True
+        )
+
+        print("2. 插入评分...")
+        movie_app.save_user_rating(user, 1, 2, '')
+        after_insert = get_movie(1)
+        print(f"   {movie['rating_sum']}/{movie['rating_count']} -> {after_insert['rating_sum']}/{after_insert['rating_count']}")
+        assert after_insert['rating_sum'] == movie['rating_sum'] + 2
+        assert after_insert['rating_count'] == movie['rating_count'] + 1
+        assert abs(after_insert['rating'] - after_insert['rating_sum'] / after_insert['rating_count']) < 1e-9
+
+        print("3. 重复评分（UPSERT更新已有评分）...")
+        movie_app.save_user_rating(user, 1, 5, '改主意了')
+        after_update = get_movie(1)
+        saved = execute_db_query(
+            "SELECT COUNT(*) AS count, MAX(review) AS review FROM ratings WHERE user_id = ?",
+            (user,),
+            fetch_one=True
+        )
+        assert saved['count'] == 1 and saved['review'] == '改主意了'
+        assert after_update['rating_sum'] == movie['rating_sum'] + 5
+        assert after_update['rating_count'] == movie['rating_count'] + 1
+
+        print("4. 删除评分...")
+        execute_db_query("DELETE FROM ratings WHERE user_id = ?", (user,), commit=True)
+        after_delete = get_movie(1)
+        assert after_delete['rating_sum'] == movie['rating_sum']
+        assert after_delete['rating_count'] == movie['rating_count']
+
+        print("   删除最后一条评分后rating为0.0，重建结果相同...")
+        unrated = execute_db_query("INSERT INTO movies (title, rating) VALUES (?, ?)", ('聚合规则测试', 8.5), commit=True)
+        movie_app.save_user_rating(user, unrated, 4, '')
+        execute_db_query("DELETE FROM ratings WHERE user_id = ?", (user,), commit=True)
+        assert get_movie(unrated)['rating'] == 0.0
+        execute_db_query("UPDATE movies SET rating = 8.5 WHERE id = ?", (unrated,), commit=True)
+        movie_app.rebuild_rating_aggregates()
+        assert get_movie(unrated)['rating'] == 0.0
+
+        print("5. 破坏聚合字段后重建...")
+        # 选一部有评分的电影（其他测试可能删掉了电影1的评分）
+        rated = execute_db_query("SELECT movie_id FROM ratings LIMIT 1", fetch_one=True)
+        execute_db_query("UPDATE movies SET rating_sum = 0, rating_count = 0 WHERE id = ?",
+                         (rated['movie_id'],), commit=True)
+        assert len(movie_app.verify_rating_aggregates()) == 1
+        movie_app.rebuild_rating_aggregates()
+        assert movie_app.verify_rating_aggregates() == []
+        print("✓ 评分聚合字段测试通过")
+    finally:
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_rating_aggregates()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推荐算法测试脚本
+"""
+
+import sys
+import os
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from recommender import ItemCFModel, ALSModel, compute_movie_neighbors
+
+# 两类口味的用户：科幻迷(1-4)喜欢电影1、2、3，讨厌4、5；爱情片观众(5-8)相反
+SAMPLE_RATINGS = [
+    (user, movie, 5 if (user <= 4) == (movie <= 3) else 1)
+    for user in range(1, 9)
+    for movie in range(1, 6)
+    if (user + movie) % 4 != 0  # 留出一些空缺，模拟没看过的电影
+]
+
+def fit_sample_model():
+    users, movies, ratings = zip(*SAMPLE_RATINGS)
+    return ItemCFModel.fit(users, movies, ratings, top_n=3, shrinkage=1.0)
+
+def test_item_neighbors():
+    """测试相似电影：同一类口味的电影互为邻居"""
+    print("=== 协同过滤相似电影测试 ===")
+    model = fit_sample_model()
+    neighbors = [movie_id for movie_id, _ in model.neighbors(1)]
+    print(f"   电影1的邻居: {neighbors}")
+    assert neighbors and set(neighbors) <= {2, 3}
+    assert {movie_id for movie_id, _ in model.neighbors(4)} <= {5}
+
+def test_recommend():
+    """测试推荐：不推荐已评分电影，优先推荐同口味的电影"""
+    print("=== 协同过滤推荐测试 ===")
+    model = fit_sample_model()
+    recommendations = model.recommend({1: 5, 4: 1}, limit=3)
+    print(f"   推荐结果: {recommendations}")
+    recommended = [movie_id for movie_id, _ in recommendations]
+    assert 1 not in recommended and 4 not in recommended
+    assert recommended[0] in {2, 3}
+
+    # 没有评分记录的用户得到热门电影
+    assert len(model.recommend({}, limit=2)) == 2
+
+def test_als_model():
+    """测试ALS训练、保存后以mmap加载并推荐"""
+    print("=== ALS矩阵分解测试 ===")
+    users, movies, ratings = zip(*SAMPLE_RATINGS)
+    model = ALSModel.train(users, movies, ratings, factors=4, regularization=0.05, iterations=10)
+    print(f"   训练集RMSE: {model.meta['train_rmse']:.4f}")
+    assert model.meta['train_rmse'] < 1.0
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        prefix = os.path.join(temp_dir, 'movie_system_als')
+        model.save(prefix)
+        loaded = ALSModel.load(prefix)
+        assert isinstance(loaded.item_factors, np.memmap)
+
+        # 科幻迷用户3没看过电影1（科幻）和电影5（爱情），科幻片应排在前面
+        rated = {movie for user, movie, _ in SAMPLE_RATINGS if user == 3}
+        recommended = [movie_id for movie_id, _ in loaded.recommend(3, exclude=rated, limit=5)]
+        print(f"   用户3未评分: {sorted(set(range(1, 6)) - rated)}，推荐: {recommended}")
+        assert recommended == [1, 5]
+        assert loaded.recommend(999) is None
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_movie_neighbors():
+    """测试相似电影：共同评分相似的电影排在前面，没有评分的新电影按内容找到相似电影"""
+    print("=== 相似电影计算测试 ===")
+    movies = [{'id': movie, 'genre': '科幻' if movie <= 3 else '爱情', 'director': None, 'description': None}
+              for movie in range(1, 6)]
+    movies.append({'id': 6, 'genre': '爱情/剧情', 'director': '导演甲', 'description': '一段跨越海洋的爱情故事'})
+    users, movie_ids, ratings = map(np.array, zip(*SAMPLE_RATINGS))
+    neighbors = compute_movie_neighbors(movies, users, movie_ids, ratings, top_n=3)
+    print(f"   电影1: {neighbors[1]}")
+    print(f"   电影6: {neighbors[6]}")
+    assert {movie_id for movie_id, _ in neighbors[1][:2]} == {2, 3}
+    assert neighbors[6] and {movie_id for movie_id, _ in neighbors[6]} <= {4, 5}
+
+    # 只计算指定的电影
+    assert set(compute_movie_neighbors(movies, users, movie_ids, ratings, targets=[2, 99])) == {2}
+
+def test_refresh_movie_neighbors():
+    """测试movie_neighbors表的全量刷新、触发器标记和增量刷新"""
+    print("=== 相似电影表刷新测试 ===")
+    import app as movie_app
+    from testing_helpers import use_temp_database
+    original_database = movie_app.DATABASE
+    temp_dir = use_temp_database()
+    try:
+        stats = movie_app.refresh_movie_neighbors()
+        movie_count = movie_app.execute_db_query("SELECT COUNT(*) AS count FROM movies", fetch_one=True)['count']
+        assert stats['computed'] == movie_count
+        assert movie_app.refresh_movie_neighbors()['computed'] == 0
+
+        similar = movie_app.get_similar_movies(1)
+        print(f"   电影1的相似电影: {[movie['title'] for movie in similar]}")
+        assert similar and all(movie['id'] != 1 for movie in similar)
+
+        # 新评分只标记被评分的电影
+        user = movie_app.execute_db_query(
+            "INSERT INTO users (username, password) VALUES (?, ?)", ('neighbor_tester', 'x'), commit=True)
+        movie_app.save_user_rating(user, 1, 4, '')
+        dirty = movie_app.execute_db_query("SELECT movie_id FROM movie_neighbors_dirty", fetch_all=True)
+        assert [row['movie_id'] for row in dirty] == [1]
+        stats = movie_app.refresh_movie_neighbors()
+        print(f"   增量刷新: {stats}")
+        assert stats['dirty'] == 1 and 1 <= stats['computed'] < movie_count
+
+        with movie_app.app.test_client() as client:
+            response = client.get('/movie/1')
+            assert '相似电影' in response.get_data(as_text=True)
+    finally:
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_item_neighbors()
+    test_recommend()
+    test_als_model()
+    test_movie_neighbors()
+    test_refresh_movie_neighbors()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+全文搜索功能测试脚本（在临时数据库副本上运行，不修改movie_system.db）
+"""
+
+import sys
+import os
+import shutil
+import sqlite3
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as movie_app
+from app import app, execute_db_query
+from testing_helpers import use_temp_database
+from text_search import ngram_tokenize, build_match_query, PrefixSuggestIndex
+
+def test_suggest_index():
+    """测试前缀索引按热度排序和增量更新"""
+    print("=== 自动补全前缀索引测试 ===")
+    index = PrefixSuggestIndex()
+    index.rebuild([
+        {'id': 1, 'title': '星际穿越', 'director': '诺兰', 'rating_count': 10, 'rating': 4.5},
+        {'id': 2, 'title': '星球大战', 'director': '卢卡斯', 'rating_count': 50, 'rating': 4.0},
+        {'id': 3, 'title': 'Star Trek', 'director': 'Abrams', 'rating_count': 5, 'rating': 3.0},
+    ])
+    assert [item['id'] for item in index.suggest('星')] == [2, 1]
+    assert [item['id'] for item in index.suggest('sta')] == [3]
+    index.update({'id': 1, 'title': '星际穿越', 'director': '诺兰', 'rating_count': 99, 'rating': 4.5})
+    assert [item['id'] for item in index.suggest('星', limit=1)] == [1]
+    index.remove(2)
+    assert [item['id'] for item in index.suggest('星球')] == []
+
+def search_titles(query):
+    return [movie['title'] for movie in movie_app.search_movies(query)]
+
+def test_tokenizer():
+    """测试中文n-gram分词"""
+    print("=== 分词测试 ===")
+    tokens = ngram_tokenize('盗梦空间 Inception').split()
+    print(f"   {tokens}")
+    assert '盗梦' in tokens and '空间' in tokens and '梦' in tokens and 'inception' in tokens
+    assert build_match_query('梦空间') == '"梦空" AND "空间"'
+    assert build_match_query('"*') is None
+
+def test_search_feature():
+    """测试全文搜索及管理员增删改后的索引同步"""
+    print("=== 全文搜索测试 ===")
+    original_database = movie_app.DATABASE
+    temp_dir = use_temp_database()
+    try:
+        print("1. 按标题、导演、类型搜索...")
+        assert search_titles('空间') == ['盗梦空间']
+        assert search_titles('诺兰') == ['盗梦空间']
+        assert '阿凡达' in search_titles('科幻')
+        assert search_titles('不存在的电影') == []
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['username'] = 'admin'
+                sess['role'] = 'admin'
+
+            print("2. 添加电影后可以搜索到...")
+            client.post('/admin/add_movie', data={
+                'title': '流浪地球', 'director': '郭帆', 'year': '2019',
+                'genre': '科幻', 'description': '太阳即将毁灭，人类带着地球逃离太阳系。',
+            })
+            movie = execute_db_query("SELECT * FROM movies WHERE title = ?", ('流浪地球',), fetch_one=True)
+            assert search_titles('地球')[0] == '流浪地球'
+
+            print("3. 编辑电影后索引同步更新...")
+            client.post(f"/admin/edit_movie/{movie['id']}", data={
+                'title': '流浪地球2', 'director': '郭帆', 'year': '2023',
+                'genre': '科幻', 'description': '太空电梯危机。',
+            })
+            assert search_titles('太空电梯') == ['流浪地球2']
+            assert search_titles('逃离太阳系') == []
+
+            response = client.get('/search?q=太空电梯')
+            assert '流浪地球2' in response.get_data(as_text=True)
+
+            print("4. 自动补全接口按前缀提示，编辑后增量更新...")
+            data = client.get('/api/suggest?q=流浪').get_json()
+            assert [item['title'] for item in data['suggestions']] == ['流浪地球2']
+            data = client.get('/api/suggest?q=郭').get_json()
+            assert data['suggestions'][0]['match'] == 'director'
+
+            print("5. 删除电影后从索引中移除...")
+            client.get(f"/admin/delete_movie/{movie['id']}")
+            assert search_titles('太空电梯') == []
+            assert client.get('/api/suggest?q=流浪').get_json()['suggestions'] == []
+
+        print("6. 没有注册search_ngrams的连接也能修改电影，重建后索引一致...")
+        other = sqlite3.connect(movie_app.DATABASE)
+        try:
+            with other:
+                other.execute("UPDATE movies SET title = '命令行改名' WHERE title = '盗梦空间'")
+        finally:
+            other.close()
+        assert search_titles('命令行') == []
+        movie_app.rebuild_search_index()
+        assert search_titles('命令行') == ['命令行改名'] and search_titles('空间') == []
+        print("✓ 全文搜索测试通过")
+    finally:
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_tokenizer()
+    test_suggest_index()
+    test_search_feature()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内容寻址上传存储、分块上传、后台任务及上传目录回收测试脚本（在临时数据库和临时上传目录中运行）
+"""
+
+import io
+import sys
+import json
+import os
+import time
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as movie_app
+from app import execute_db_query
+from upload_store import store_upload, upload_filename_from_url
+from job_queue import enqueue_job
+import media_jobs
+from testing_helpers import use_temp_database
+
+def get_ref_count(filename):
+    row = execute_db_query("SELECT ref_count FROM upload_files WHERE filename = ?", (filename,), fetch_one=True)
+    return row['ref_count'] if row else None
+
+def test_store_upload():
+    """测试相同内容只保存一份"""
+    print("=== 内容寻址存储测试 ===")
+    folder = tempfile.mkdtemp()
+    try:
+        first = store_upload(io.BytesIO(b'trailer' * 1000), 'MP4', folder)
+        second = store_upload(io.BytesIO(b'trailer' * 1000), 'mp4', folder)
+        other = store_upload(io.BytesIO(b'another trailer'), 'mp4', folder)
+        print(f"   {first[0]}")
+        assert first[0] == second[0] and first[0].endswith('.mp4')
+        assert not first[3] and second[3] and not other[3]
+        assert first[0] == f'{first[1][:2]}/{first[1][2:4]}/{first[1]}.mp4'
+        assert sorted(name for name, _ in movie_app.iter_upload_files(folder)) == sorted([first[0], other[0]])
+        assert upload_filename_from_url('/uploads\\abc.mp4') == 'abc.mp4'
+        assert upload_filename_from_url('https://example.com/a.mp4') is None
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def test_upload_refs_and_dedup():
+    """测试引用计数触发器和旧文件迁移"""
+    print("=== 上传文件引用计数测试 ===")
+    original_database = movie_app.DATABASE
+    original_folder = movie_app.app.config['UPLOAD_FOLDER']
+    temp_dir = use_temp_database()
+    folder = os.path.join(temp_dir, 'uploads')
+    os.makedirs(folder)
+    movie_app.app.config['UPLOAD_FOLDER'] = folder
+    try:
+        # 两个UUID命名、内容相同的旧文件，分别被两部电影引用
+        for name in ('old-a.mp4', 'old-b.mp4'):
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(b'same trailer' * 100)
+        first = execute_db_query(
+            "INSERT INTO movies (title, video_url) VALUES (?, ?)", ('旧电影A', '/uploads\\old-a.mp4'), commit=True)
+        second = execute_db_query(
+            "INSERT INTO movies (title, video_url) VALUES (?, ?)", ('旧电影B', '/uploads/old-b.mp4'), commit=True)
+
+        stats = movie_app.deduplicate_uploads()
+        print(f"   迁移结果: {stats}")
+        assert stats['files'] == 2 and stats['duplicates'] == 1
+        files = [name for name, _ in movie_app.iter_upload_files(folder)]
+        assert len(files) == 1
+        filename = files[0]
+        for movie_id in (first, second):
+            movie = execute_db_query("SELECT video_url FROM movies WHERE id = ?", (movie_id,), fetch_one=True)
+            assert movie['video_url'] == f'/uploads/{filename}'
+        assert get_ref_count(filename) == 2
+
+        # 触发器维护引用计数
+        execute_db_query("UPDATE movies SET video_url = NULL WHERE id = ?", (first,), commit=True)
+        assert get_ref_count(filename) == 1
+        execute_db_query("DELETE FROM movies WHERE id = ?", (second,), commit=True)
+        assert get_ref_count(filename) == 0
+        print("✓ 上传文件引用计数测试通过")
+    finally:
+        movie_app.app.config['UPLOAD_FOLDER'] = original_folder
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_migrate_upload_layout():
+    """测试把平铺的上传文件迁移到分散目录，旧URL仍然可以访问"""
+    print("=== 分散目录迁移测试 ===")
+    original_database = movie_app.DATABASE
+    original_folder = movie_app.app.config['UPLOAD_FOLDER']
+    temp_dir = use_temp_database()
+    folder = os.path.join(temp_dir, 'uploads')
+    os.makedirs(os.path.join(folder, 'derived'))
+    movie_app.app.config['UPLOAD_FOLDER'] = folder
+    try:
+        names = ['abcdef01.png', '12345678-aaaa.mp4', '.upload-x.part']
+        for name in names:
+            with open(os.path.join(folder, name), 'wb') as f:
+                f.write(name.encode())
+        with open(os.path.join(folder, 'derived', 'abcdef01-160w.webp'), 'wb') as f:
+            f.write(b'webp')
+        movie_id = execute_db_query("INSERT INTO movies (title, image_url, video_url) VALUES (?, ?, ?)",
+                                    ('迁移测试', '/uploads/abcdef01.png', '/uploads\\12345678-aaaa.mp4'), commit=True)
+        execute_db_query("INSERT INTO upload_files (filename, sha256, size) VALUES (?, ?, ?)",
+                         ('abcdef01.png', '0' * 64, 12), commit=True)
+        execute_db_query("INSERT INTO poster_variants (source, format, width, filename, size) VALUES (?, ?, ?, ?, ?)",
+                         ('abcdef01.png', 'webp', 160, 'abcdef01-160w.webp', 4), commit=True)
+        movie_app.rebuild_upload_refs()
+        assert get_ref_count('abcdef01.png') == 1
+        version = execute_db_query("SELECT version FROM movies WHERE id = ?", (movie_id,), fetch_one=True)['version']
+
+        stats = movie_app.migrate_upload_layout(batch_size=1)
+        print(f"   {stats}")
+        assert stats == {'files': 2, 'variants': 1, 'movies': 2}
+        movie = execute_db_query("SELECT * FROM movies WHERE id = ?", (movie_id,), fetch_one=True)
+        assert movie['image_url'] == '/uploads/ab/cd/abcdef01.png'
+        assert movie['video_url'] == '/uploads/12/34/12345678-aaaa.mp4'
+        assert get_ref_count('ab/cd/abcdef01.png') == 1
+        variant = execute_db_query("SELECT * FROM poster_variants", fetch_one=True)
+        assert variant['source'] == 'ab/cd/abcdef01.png' and variant['filename'] == 'ab/cd/abcdef01-160w.webp'
+        assert os.path.isfile(os.path.join(folder, 'derived', 'ab', 'cd', 'abcdef01-160w.webp'))
+        # 改写海报URL、视频URL、缩略图路径各更新一次版本号，电影卡片的片段缓存不会输出旧路径
+        assert movie['version'] == version + 3
+        assert sorted(os.listdir(folder)) == ['.upload-x.part', '12', 'ab', 'derived']
+        # 再次执行没有需要迁移的文件
+        assert movie_app.migrate_upload_layout() == {'files': 0, 'variants': 0, 'movies': 0}
+
+        with movie_app.app.test_client() as client:
+            assert client.get('/uploads/ab/cd/abcdef01.png').data == b'abcdef01.png'
+            # 迁移前的URL按分散目录查找
+            assert client.get('/uploads/abcdef01.png').data == b'abcdef01.png'
+            assert client.get('/uploads/derived/ab/cd/abcdef01-160w.webp').data == b'webp'
+            assert client.get('/uploads/.upload-x.part').status_code == 404
+            assert client.get('/uploads/../movie_system.db').status_code == 404
+        print("✓ 分散目录迁移测试通过")
+    finally:
+        movie_app.app.config['UPLOAD_FOLDER'] = original_folder
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_chunked_upload():
+    """测试分块上传：偏移量校验、断点续传、添加电影后由后台任务处理文件"""
+    print("=== 分块上传测试 ===")
+    original_database = movie_app.DATABASE
+    original_folder = movie_app.app.config['UPLOAD_FOLDER']
+    temp_dir = use_temp_database()
+    folder = os.path.join(temp_dir, 'uploads')
+    movie_app.app.config['UPLOAD_FOLDER'] = folder
+    data = os.urandom(300 * 1024)
+    try:
+        with movie_app.app.test_client() as client:
+            assert client.post('/api/uploads', json={'filename': 'a.mp4', 'size': 10}).status_code == 403
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['username'] = 'admin'
+                sess['role'] = 'admin'
+
+            print("1. 创建上传会话...")
+            assert client.post('/api/uploads', json={'filename': 'a.exe', 'size': 10}).status_code == 400
+            created = client.post('/api/uploads', json={'filename': '预告片.MP4', 'size': len(data)})
+            assert created.status_code == 201
+            upload_id = created.get_json()['upload_id']
+            url = f'/api/uploads/{upload_id}'
+
+            print("2. 按偏移量写入分块...")
+            response = client.put(url, data=data[:100 * 1024], headers={'Upload-Offset': '0'})
+            assert response.get_json()['offset'] == 100 * 1024
+            # 偏移量不对（例如重复发送了上一块）时返回409和正确的偏移量
+            response = client.put(url, data=data[:100 * 1024], headers={'Upload-Offset': '0'})
+            assert response.status_code == 409 and response.get_json()['offset'] == 100 * 1024
+            assert client.post(f'{url}/finalize').status_code == 409
+
+            print("3. 断点续传...")
+            offset = client.get(url).get_json()['offset']
+            response = client.put(url, data=data[offset:], headers={'Upload-Offset': str(offset)})
+            assert response.get_json()['offset'] == len(data)
+
+            print("4. 完成上传并添加电影...")
+            finished = client.post(f'{url}/finalize').get_json()
+            assert finished['upload_id'] == upload_id and finished['size'] == len(data)
+            client.post('/admin/add_movie', data={
+                'title': '分块上传测试', 'director': '导演', 'year': '2024', 'genre': '剧情',
+                'description': '简介', 'video_upload_id': upload_id,
+            })
+            movie = execute_db_query("SELECT * FROM movies WHERE title = ?", ('分块上传测试',), fetch_one=True)
+            # 文件由后台任务处理，处理完成前电影没有视频
+            assert movie['processing_state'] == 'processing' and movie['video_url'] is None
+            assert movie_app.claim_chunked_upload(upload_id) is None
+
+            print("5. 执行后台任务...")
+            assert movie_app.run_pending_jobs() == 1
+            movie = execute_db_query("SELECT * FROM movies WHERE id = ?", (movie['id'],), fetch_one=True)
+            assert movie['processing_state'] == 'ready' and movie['video_type'] == 'upload'
+            filename = upload_filename_from_url(movie['video_url'])
+            assert filename.endswith('.mp4')
+            with open(os.path.join(folder, filename), 'rb') as f:
+                assert f.read() == data
+            assert client.get(url).status_code == 404
+            assert get_ref_count(filename) == 1
+
+            print("6. 文件已移入存储后重试入库任务...")
+            job = execute_db_query("SELECT * FROM jobs WHERE kind = 'ingest_upload' AND movie_id = ?",
+                                   (movie['id'],), fetch_one=True)
+            payload = json.loads(job['payload'])
+            assert not os.path.exists(payload['part_path'])
+            retried = media_jobs.ingest_upload(payload)
+            assert retried['filename'] == filename and retried['size'] == len(data) and retried['duplicate']
+            # 任务结束后清理结果记录
+            assert [name for name in os.listdir(folder) if name.startswith('.')] == [f'.upload-{upload_id}.part.stored']
+            movie_app.expire_upload_sessions()
+            assert [name for name in os.listdir(folder) if name.startswith('.')] == []
+        print("✓ 分块上传测试通过")
+    finally:
+        movie_app.app.config['UPLOAD_FOLDER'] = original_folder
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_job_retry():
+    """测试任务失败后退避重试，超过次数后电影标记为处理失败"""
+    print("=== 后台任务重试测试 ===")
+    original_database = movie_app.DATABASE
+    temp_dir = use_temp_database()
+    try:
+        movie_id = execute_db_query("INSERT INTO movies (title) VALUES (?)", ('校验测试',), commit=True)
+        conn = movie_app.get_db_connection()
+        try:
+            with conn:
+                enqueue_job(conn, 'verify_upload', {'path': os.path.join(temp_dir, 'missing.mp4'),
+                                                    'sha256': '', 'size': 0}, movie_id, max_attempts=2)
+        finally:
+            movie_app.release_db_connection(conn)
+
+        assert movie_app.run_pending_jobs() == 1
+        job = execute_db_query("SELECT * FROM jobs WHERE movie_id = ?", (movie_id,), fetch_one=True)
+        # 第一次失败后按退避时间重新排队，还不能立即领取
+        assert job['status'] == 'queued' and job['attempts'] == 1 and job['run_after'] > job['created_at']
+        assert movie_app.run_pending_jobs() == 0
+
+        execute_db_query("UPDATE jobs SET run_after = CURRENT_TIMESTAMP WHERE id = ?", (job['id'],), commit=True)
+        assert movie_app.run_pending_jobs() == 1
+        job = execute_db_query("SELECT * FROM jobs WHERE id = ?", (job['id'],), fetch_one=True)
+        movie = execute_db_query("SELECT processing_state FROM movies WHERE id = ?", (movie_id,), fetch_one=True)
+        print(f"   {job['error'].strip().splitlines()[-1]}")
+        assert job['status'] == 'failed' and movie['processing_state'] == 'failed'
+        assert movie_app.get_job_counts() == {'failed': 1}
+        print("✓ 后台任务重试测试通过")
+    finally:
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def test_poster_derivatives():
+    """测试上传海报后由后台任务生成缩略图，列表页输出srcset"""
+    print("=== 海报缩略图测试 ===")
+    if not movie_app.pillow_available():
+        print("   未安装Pillow，跳过")
+        return
+    from PIL import Image
+    original_database = movie_app.DATABASE
+    original_folder = movie_app.app.config['UPLOAD_FOLDER']
+    temp_dir = use_temp_database()
+    folder = os.path.join(temp_dir, 'uploads')
+    movie_app.app.config['UPLOAD_FOLDER'] = folder
+    poster = io.BytesIO()
+    Image.new('RGB', (500, 750), (200, 30, 30)).save(poster, 'PNG')
+    poster.seek(0)
+    try:
+        with movie_app.app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+                sess['username'] = 'admin'
+                sess['role'] = 'admin'
+            client.post('/admin/add_movie', data={
+                'title': '海报测试', 'director': '导演', 'year': '2024', 'genre': '剧情',
+                'description': '简介', 'image_file': (poster, 'poster.png'),
+            }, content_type='multipart/form-data')
+            movie = execute_db_query("SELECT * FROM movies WHERE title = ?", ('海报测试',), fetch_one=True)
+            assert movie['processing_state'] == 'processing'
+            assert movie_app.run_pending_jobs() == 2  # 完整性检查 + 缩略图
+            movie = execute_db_query("SELECT * FROM movies WHERE id = ?", (movie['id'],), fetch_one=True)
+            assert movie['processing_state'] == 'ready'
+
+            variants = execute_db_query("SELECT * FROM poster_variants", fetch_all=True)
+            widths = sorted({row['width'] for row in variants})
+            print(f"   生成 {len(variants)} 个缩略图，宽度 {widths}")
+            # 不放大：原图只有500像素宽
+            assert widths == [160, 320, 500]
+
+            html = client.get('/').get_data(as_text=True)
+            assert 'type="image/webp"' in html and ' 160w, ' in html
+            webp = next(row for row in variants if row['format'] == 'webp' and row['width'] == 160)
+            response = client.get(f"/uploads/derived/{webp['filename']}")
+            assert response.status_code == 200 and response.mimetype == 'image/webp'
+            with Image.open(io.BytesIO(response.data)) as image:
+                assert image.size == (160, 240)
+            # 同一张海报不会重复生成
+            assert movie_app.poster_jobs([upload_filename_from_url(movie['image_url'])]) == []
+        print("✓ 海报缩略图测试通过")
+    finally:
+        movie_app.app.config['UPLOAD_FOLDER'] = original_folder
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def quarantined_files(folder):
+    """隔离目录中的文件（相对路径）"""
+    quarantine_folder = os.path.join(folder, '.quarantine')
+    return sorted(os.path.relpath(os.path.join(dirpath, name), quarantine_folder).replace(os.sep, '/')
+                  for dirpath, _, names in os.walk(quarantine_folder) for name in names)
+
+def test_upload_gc():
+    """测试回收未引用的上传文件：宽限期、临时文件、缩略图和隔离目录"""
+    print("=== 上传目录回收测试 ===")
+    original_database = movie_app.DATABASE
+    original_folder = movie_app.app.config['UPLOAD_FOLDER']
+    temp_dir = use_temp_database()
+    folder = os.path.join(temp_dir, 'uploads')
+    os.makedirs(os.path.join(folder, 'derived'))
+    movie_app.app.config['UPLOAD_FOLDER'] = folder
+    old = time.time() - 2 * 24 * 3600
+
+    def make_file(name, size=100, mtime=old):
+        path = os.path.join(folder, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    try:
+        make_file('used.png')
+        make_file('old-orphan.mp4', 1000)
+        make_file('new-orphan.mp4', mtime=time.time())
+        make_file('.upload-abc.part')
+        make_file('poster.png', 300)
+        make_file('derived/poster-160w.webp', 50)
+        execute_db_query("INSERT INTO movies (title, image_url) VALUES (?, ?)", ('引用测试', '/uploads/used.png'), commit=True)
+        execute_db_query("INSERT INTO upload_files (filename, sha256, size) VALUES (?, ?, ?)",
+                         ('poster.png', '0' * 64, 300), commit=True)
+        execute_db_query("INSERT INTO poster_variants (source, format, width, filename, size) VALUES (?, ?, ?, ?, ?)",
+                         ('poster.png', 'webp', 160, 'poster-160w.webp', 50), commit=True)
+
+        stats = movie_app.collect_upload_garbage(grace=3600, dry_run=True, pause=0)
+        assert stats['orphaned'] == 2 and stats['skipped_recent'] == 1 and stats['quarantined'] == 0
+        assert os.path.exists(os.path.join(folder, 'old-orphan.mp4'))
+
+        stats = movie_app.collect_upload_garbage(grace=3600, pause=0)
+        print(f"   {stats}")
+        assert stats['orphaned'] == 2 and stats['quarantined'] == 3 and stats['reclaimed_bytes'] == 1350
+        assert sorted(os.listdir(folder)) == ['.quarantine', '.upload-abc.part', 'derived', 'new-orphan.mp4', 'used.png']
+        assert quarantined_files(folder) == ['derived/poster-160w.webp', 'old-orphan.mp4', 'poster.png']
+        assert execute_db_query("SELECT * FROM upload_files WHERE filename = 'poster.png'", fetch_one=True) is None
+        assert execute_db_query("SELECT * FROM poster_variants", fetch_one=True) is None
+
+        # 分散目录中的同名文件隔离后互不覆盖；任务参数中只是包含该文件名的其他文件不算引用
+        os.makedirs(os.path.join(folder, 'ab', 'cd'))
+        os.makedirs(os.path.join(folder, 'ef', 'gh'))
+        make_file('ab/cd/same.mp4', 10)
+        make_file('ef/gh/same.mp4', 20)
+        make_file('ef/gh/busy.mp4', 30)
+        with movie_app.app.app_context():
+            conn = movie_app.get_db_connection()
+            with conn:
+                enqueue_job(conn, 'probe_video', {'path': os.path.join(os.path.abspath(folder), 'ef/gh/busy.mp4'),
+                                                  'source': 'ef/gh/busy.mp4'})
+                enqueue_job(conn, 'probe_video', {'source': 'xab/cd/same.mp4.bak'})
+        stats = movie_app.collect_upload_garbage(grace=3600, pause=0)
+        assert stats['orphaned'] == 2 and stats['skipped_recent'] == 2
+        assert quarantined_files(folder) == ['ab/cd/same.mp4', 'derived/poster-160w.webp', 'ef/gh/same.mp4',
+                                             'old-orphan.mp4', 'poster.png']
+        assert os.path.exists(os.path.join(folder, 'ef', 'gh', 'busy.mp4'))
+
+        # 隔离期满后删除
+        for name in quarantined_files(folder):
+            path = os.path.join(folder, '.quarantine', name)
+            os.utime(path, (old - movie_app.UPLOAD_GC_QUARANTINE_TTL, old - movie_app.UPLOAD_GC_QUARANTINE_TTL))
+        stats = movie_app.collect_upload_garbage(grace=3600, pause=0)
+        assert stats['orphaned'] == 0 and stats['deleted'] == 5
+        assert os.listdir(os.path.join(folder, '.quarantine')) == []
+        print("✓ 上传目录回收测试通过")
+    finally:
+        movie_app.app.config['UPLOAD_FOLDER'] = original_folder
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_store_upload()
+    test_upload_refs_and_dedup()
+    test_migrate_upload_layout()
+    test_chunked_upload()
+    test_job_retry()
+    test_poster_derivatives()
+    test_upload_gc()
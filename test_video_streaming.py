@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上传视频分段下载（HTTP Range）测试脚本
+"""
+
+import sys
+import os
+import shutil
+from datetime import timedelta
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from werkzeug.http import http_date
+
+import app as movie_app
+from testing_helpers import use_temp_database
+
+def test_video_streaming():
+    """测试单区间、多区间、If-Range和无法满足的区间"""
+    print("=== 视频分段下载测试 ===")
+    original_database = movie_app.DATABASE
+    original_folder = movie_app.app.config['UPLOAD_FOLDER']
+    temp_dir = use_temp_database()
+    data = bytes(range(256)) * 40  # 10240字节
+    with open(os.path.join(temp_dir, 'trailer.mp4'), 'wb') as f:
+        f.write(data)
+    movie_app.app.config['UPLOAD_FOLDER'] = temp_dir
+    try:
+        with movie_app.app.test_client() as client:
+            print("1. 完整文件...")
+            full = client.get('/uploads/trailer.mp4')
+            assert full.status_code == 200 and full.data == data
+            assert full.headers['Accept-Ranges'] == 'bytes'
+            etag = full.headers['ETag']
+
+            print("2. 单区间...")
+            part = client.get('/uploads/trailer.mp4', headers={'Range': 'bytes=100-199'})
+            assert part.status_code == 206 and part.data == data[100:200]
+            assert part.headers['Content-Range'] == f'bytes 100-199/{len(data)}'
+
+            print("3. 多区间（multipart/byteranges）...")
+            multi = client.get('/uploads/trailer.mp4', headers={'Range': 'bytes=0-9,-10'})
+            assert multi.status_code == 206
+            assert multi.mimetype == 'multipart/byteranges'
+            assert int(multi.headers['Content-Length']) == len(multi.data)
+            assert f'Content-Range: bytes 0-9/{len(data)}'.encode() in multi.data
+            assert f'Content-Range: bytes {len(data) - 10}-{len(data) - 1}/{len(data)}'.encode() in multi.data
+            assert data[:10] in multi.data and data[-10:] in multi.data
+
+            # 重叠的区间合并后只剩一个，按单区间返回
+            merged = client.get('/uploads/trailer.mp4', headers={'Range': 'bytes=0-99,50-149'})
+            assert merged.status_code == 206 and merged.data == data[:150]
+
+            print("4. If-Range...")
+            stale = client.get('/uploads/trailer.mp4', headers={'Range': 'bytes=0-9,20-29', 'If-Range': '"old"'})
+            assert stale.status_code == 200 and stale.data == data
+            fresh = client.get('/uploads/trailer.mp4', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+            assert fresh.status_code == 206 and fresh.data == data[:10]
+            # 日期形式的If-Range只有与Last-Modified相同时才按区间返回
+            last_modified = full.headers['Last-Modified']
+            dated = client.get('/uploads/trailer.mp4', headers={'Range': 'bytes=0-9,20-29', 'If-Range': last_modified})
+            assert dated.status_code == 206 and dated.mimetype == 'multipart/byteranges'
+            later = http_date(full.last_modified + timedelta(hours=1))
+            later = client.get('/uploads/trailer.mp4', headers={'Range': 'bytes=0-9,20-29', 'If-Range': later})
+            assert later.status_code == 200 and later.data == data
+
+            print("5. 无法满足的区间...")
+            outside = client.get('/uploads/trailer.mp4', headers={'Range': f'bytes={len(data)}-,{len(data) + 10}-'})
+            assert outside.status_code == 416
+
+            assert client.get('/uploads/missing.mp4').status_code == 404
+        print("✓ 视频分段下载测试通过")
+    finally:
+        movie_app.app.config['UPLOAD_FOLDER'] = original_folder
+        movie_app.set_database(original_database)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_video_streaming()
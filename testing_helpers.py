@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试脚本共用的辅助函数
+"""
+
+import os
+import shutil
+import tempfile
+
+import app as movie_app
+
+def use_temp_database():
+    """
+    复制一份数据库到临时目录，并让应用使用这份副本（不修改movie_system.db）
+
+    调用方在结束时执行 movie_app.set_database(原数据库) 并删除返回的临时目录
+
+    Returns:
+        临时目录
+    """
+    temp_dir = tempfile.mkdtemp()
+    temp_db = os.path.join(temp_dir, 'movie_system.db')
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'movie_system.db'), temp_db)
+    movie_app.set_database(temp_db)
+    movie_app.setup_database()
+    return temp_dir
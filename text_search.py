@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 全文搜索分词
+
+SQLite的FTS5内置分词器不会切分中文（一整段汉字会被当作一个词），
+Python的sqlite3模块也无法注册自定义FTS5分词器。
+因此写入索引前先在Python中把文本切成字符n-gram：
+- 连续的中日韩字符输出单字和相邻两字（"盗梦空间" -> "盗 梦 空 间 盗梦 梦空 空间"）
+- 字母和数字按单词输出，统一转为小写
+切分后的结果用空格分隔，交给FTS5的unicode61分词器按空格建立索引。
+
+PrefixSuggestIndex 是搜索框自动补全用的内存前缀索引。
+"""
+
+import re
+import time
+import heapq
+import bisect
+import threading
+
+# 中日韩字符范围：CJK统一汉字及扩展A、兼容汉字、平假名/片假名、韩文音节
+CJK_CHARS = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af'
+TOKEN_PATTERN = re.compile(f'[{CJK_CHARS}]+|[^\\W_{CJK_CHARS}]+')
+CJK_PATTERN = re.compile(f'[{CJK_CHARS}]')
+
+# 自动补全结果缓存的最大条目数
+SUGGEST_CACHE_SIZE = 4096
+
+def _split_runs(text):
+    """把文本切成连续的中日韩字符串和字母数字单词"""
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+def ngram_tokenize(text):
+    """
+    将文本转换为用于建立FTS5索引的n-gram词序列
+
+    Args:
+        text: 原始文本（可以为None）
+
+    Returns:
+        以空格分隔的词
+    """
+    tokens = []
+    for run in _split_runs(text):
+        if CJK_PATTERN.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return ' '.join(tokens)
+
+def build_match_query(query):
+    """
+    把用户输入的搜索词转换为FTS5 MATCH表达式
+
+    - 中日韩字符串：单字直接匹配，多字要求所有相邻两字都出现
+    - 字母数字单词：前缀匹配，输入"nol"即可匹配"nolan"
+    所有词之间是AND关系；每个词都用双引号包裹，用户输入的引号、星号等不会被当作FTS5语法
+
+    Returns:
+        MATCH表达式；搜索词中没有可检索的内容时返回None
+    """
+    terms = []
+    for run in _split_runs(query):
+        if CJK_PATTERN.match(run):
+            grams = [run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)]
+            terms.extend(f'"{gram}"' for gram in dict.fromkeys(grams))
+        else:
+            terms.append(f'"{run}"*')
+    return ' AND '.join(terms) if terms else None
+
+class PrefixSuggestIndex:
+    """
+    搜索框自动补全用的内存前缀索引
+
+    把电影标题和导演名（转为小写）放在一个有序数组中，用二分查找定位以输入内容开头的区间，
+    再按热度（评分人数、平均分）取前k个。单部电影的增删改只需要一次二分插入/删除，
+    不需要重建整个索引。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = []      # 有序的(前缀键, 电影ID)，与_fields一一对应
+        self._fields = []    # 每个键对应的字段：'title' 或 'director'
+        self._movies = {}    # 电影ID -> {'title', 'director', 'weight'}
+        self._cache = {}     # (前缀, limit) -> 结果；单字前缀命中区间很大，缓存后不必每次扫描
+        self.built_at = None
+
+    @staticmethod
+    def normalize(text):
+        """前缀匹配使用的规范化：去掉首尾空白并转为小写"""
+        return (text or '').strip().lower()
+
+    @staticmethod
+    def _weight(movie):
+        """热度：评分人数优先，其次平均分"""
+        return (movie.get('rating_count') or 0, movie.get('rating') or 0.0)
+
+    def rebuild(self, movies):
+        """用电影列表重建整个索引"""
+        entries = []
+        catalogue = {}
+        for movie in movies:
+            catalogue[movie['id']] = {
+                'title': movie['title'],
+                'director': movie.get('director'),
+                'weight': self._weight(movie),
+            }
+            for field in ('title', 'director'):
+                key = self.normalize(movie.get(field))
+                if key:
+                    entries.append(((key, movie['id']), field))
+        entries.sort()
+        with self._lock:
+            self._keys = [entry[0] for entry in entries]
+            self._fields = [entry[1] for entry in entries]
+            self._movies = catalogue
+            self._cache = {}
+            self.built_at = time.time()
+
+    def _remove_locked(self, movie_id):
+        """删除一部电影的所有键（调用方持有锁）"""
+        movie = self._movies.pop(movie_id, None)
+        if not movie:
+            return
+        self._cache = {}
+        for field in ('title', 'director'):
+            key = (self.normalize(movie[field]), movie_id)
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                del self._keys[i]
+                del self._fields[i]
+
+    def update(self, movie):
+        """新增或更新一部电影"""
+        with self._lock:
+            self._remove_locked(movie['id'])
+            self._cache = {}
+            self._movies[movie['id']] = {
+                'title': movie['title'],
+                'director': movie.get('director'),
+                'weight': self._weight(movie),
+            }
+            for field in ('title', 'director'):
+                key = self.normalize(movie.get(field))
+                if key:
+                    i = bisect.bisect_left(self._keys, (key, movie['id']))
+                    self._keys.insert(i, (key, movie['id']))
+                    self._fields.insert(i, field)
+
+    def remove(self, movie_id):
+        """删除一部电影"""
+        with self._lock:
+            self._remove_locked(movie_id)
+
+    def suggest(self, prefix, limit=8):
+        """
+        查询以prefix开头的标题或导演
+
+        Returns:
+            按热度排序的[{'id', 'title', 'director', 'match'}]，match为命中的字段
+        """
+        prefix = self.normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            cached = self._cache.get((prefix, limit))
+            if cached is not None:
+                return cached
+            lo = bisect.bisect_left(self._keys, (prefix,))
+            hi = bisect.bisect_left(self._keys, (prefix + '\U0010ffff',))
+            best = {}
+            for i in range(lo, hi):
+                movie_id = self._keys[i][1]
+                # 标题和导演同时命中时优先显示标题
+                if movie_id not in best or self._fields[i] == 'title':
+                    best[movie_id] = self._fields[i]
+            top = heapq.nlargest(limit, best, key=lambda movie_id: self._movies[movie_id]['weight'])
+            results = [{
+                'id': movie_id,
+                'title': self._movies[movie_id]['title'],
+                'director': self._movies[movie_id]['director'],
+                'match': best[movie_id],
+            } for movie_id in top]
+            if len(self._cache) >= SUGGEST_CACHE_SIZE:
+                self._cache = {}
+            self._cache[(prefix, limit)] = results
+            return results
+
+    def __len__(self):
+        return len(self._movies)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+电影推荐系统 - 按内容寻址的上传文件存储
+
+上传的文件边写入磁盘边计算SHA-256，最终以"哈希值.扩展名"命名：
+同一个预告片重复上传时只保留一份，不再多占磁盘和页缓存。
+文件按文件名的前两级十六进制前缀分散到子目录（ab/cd/abcd….mp4），
+单个目录的文件数保持在几百以内，文件查找和目录遍历不会随上传量变慢。
+文件被多少部电影引用记录在upload_files表中，由movies表上的触发器维护（见app.py）。
+
+大视频文件可以分块上传：每块按偏移量直接写入上传目录中的临时文件，
+中断后从已收到的字节处继续，全部收到后再计算哈希并重命名为最终文件名。
+"""
+
+import os
+import uuid
+import hashlib
+
+# 边读边写时每次处理的字节数
+UPLOAD_HASH_CHUNK = 1024 * 1024
+# 数据库中上传文件URL的前缀（历史数据里也有Windows风格的 /uploads\xxx）
+UPLOAD_URL_PREFIXES = ('/uploads/', '/uploads\\')
+
+# 分散目录的级数和每级的字符数：256 * 256 个子目录
+FANOUT_LEVELS = 2
+FANOUT_WIDTH = 2
+
+def fanout_path(name):
+    """
+    文件在上传目录中的相对路径：按文件名前缀分两级子目录，如 ab/cd/abcd1234.mp4
+
+    文件名是SHA-256或UUID，前缀本身就是均匀分布的十六进制字符
+    """
+    parts = [name[i * FANOUT_WIDTH:(i + 1) * FANOUT_WIDTH] for i in range(FANOUT_LEVELS)]
+    return '/'.join(parts + [name])
+
+def content_filename(digest, extension):
+    """内容寻址文件在上传目录中的相对路径：分散目录/SHA-256十六进制.小写扩展名"""
+    return fanout_path(f'{digest}.{extension.lower()}')
+
+def upload_filename_from_url(url):
+    """从movies表中的image_url/video_url取出上传目录内的文件名，不是本地上传的文件时返回None"""
+    if url:
+        for prefix in UPLOAD_URL_PREFIXES:
+            if url.startswith(prefix):
+                return url[len(prefix):].replace('\\', '/')
+    return None
+
+def hash_file(path):
+    """
+    计算文件的SHA-256
+
+    Returns:
+        (十六进制摘要, 文件大小)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(UPLOAD_HASH_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def _commit_to_store(temp_path, digest, size, extension, folder):
+    """把已写完的临时文件放到内容寻址位置：内容已存在时删除临时文件，否则原子重命名"""
+    filename = content_filename(digest, extension)
+    final_path = os.path.join(folder, filename)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    if os.path.exists(final_path):
+        os.remove(temp_path)
+        # 更新修改时间：已有文件可能正等待垃圾回收，重新上传后要重新计算宽限期
+        os.utime(final_path)
+        return filename, digest, size, True
+    os.replace(temp_path, final_path)
+    return filename, digest, size, False
+
+def store_upload(stream, extension, folder):
+    """
+    把上传的数据流写入内容寻址存储
+
+    先写到同目录下的临时文件并同时计算哈希，写完后：
+    - 目标文件已存在：内容相同，删除临时文件（去重）
+    - 目标文件不存在：原子重命名为最终文件名
+
+    Args:
+        stream: 可读的二进制流（如FileStorage.stream）
+        extension: 文件扩展名（不含点）
+        folder: 上传目录
+
+    Returns:
+        (相对路径, SHA-256, 文件大小, 是否与已有文件重复)
+    """
+    os.makedirs(folder, exist_ok=True)
+    temp_path = os.path.join(folder, f'.upload-{uuid.uuid4().hex}.tmp')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(UPLOAD_HASH_CHUNK)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        return _commit_to_store(temp_path, digest.hexdigest(), size, extension, folder)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def store_file(path, extension, folder, hashed=None):
+    """
+    把上传目录中已写完的文件（分块上传的临时文件）移入内容寻址存储
+
+    Args:
+        hashed: 已经计算好的 (SHA-256, 文件大小)，为None时重新计算
+
+    Returns:
+        与store_upload相同
+    """
+    digest, size = hashed or hash_file(path)
+    return _commit_to_store(path, digest, size, extension, folder)
+
+# ==============================
+# 分块上传（可断点续传）
+# ==============================
+
+def partial_upload_path(folder, upload_id):
+    """分块上传的临时文件，与最终文件在同一目录（同一文件系统），完成时只需重命名"""
+    return os.path.join(folder, f'.upload-{upload_id}.part')
+
+# 分块上传的临时文件移入存储前写下的结果记录（见media_jobs.ingest_upload）
+INGEST_RECEIPT_SUFFIX = '.stored'
+
+def ingest_receipt_path(part_path):
+    """临时文件对应的结果记录：移入存储之后任务重试时，临时文件已经不在了，从这里取回结果"""
+    return part_path + INGEST_RECEIPT_SUFFIX
+
+def write_chunk(path, offset, stream, length):
+    """
+    从数据流读取length字节，写入文件的offset处（每次最多读UPLOAD_HASH_CHUNK字节，内存占用固定）
+
+    Returns:
+        (实际写入的字节数, 异常或None)；客户端中途断开时已写入的部分仍然有效，可以从断点继续
+    """
+    written = 0
+    try:
+        with open(path, 'r+b') as f:
+            f.seek(offset)
+            while written < length:
+                chunk = stream.read(min(UPLOAD_HASH_CHUNK, length - written))
+                if not chunk:
+                    break
+                f.write(chunk)
+                written += len(chunk)
+    except Exception as e:
+        return written, e
+    return written, None